@@ -5,569 +5,2134 @@
 Фази 2-3: GPS2 парсване + Mapping + Групиране по шофьори
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Request, Response, render_template, request, jsonify, send_file, stream_with_context
 from datetime import datetime, timedelta
 import openpyxl
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import heapq
+from itertools import chain, groupby, islice
+from operator import attrgetter
+import multiprocessing
 import traceback
 import csv
 import io
+import shutil
+import sys
 import tempfile
+import tracemalloc
 import os
 
+from countries import CountryClassifier, DEFAULT_MARKERS_PATH
+from csv_reader import CsvReader, is_csv, is_xlsx
+from data_quality import DataQuality
+from driver_mapping import DriverMapping, date_columns, parse_mapping_date
+from excel_export import write_export
+from geo_countries import DEFAULT_BORDERS_PATH, CoordinateColumns, GeoClassifier, parse_coordinates
+from gps_dates import DateDecoder, GPS1_DATE_FORMATS, GPS2_DATE_FORMATS
+from history_store import HistoryStore
+from jobs import JobManager, DONE, ERROR
+from metrics import MetricsRegistry, RequestMetrics
+from result_store import ResultQuery, ResultStore, parse_edits
+from parse_cache import ParseCache
+from per_diem import DEFAULT_RATES_PATH, PerDiemRates
+from werkzeug.exceptions import RequestEntityTooLarge
+from xlsx_reader import XlsxReader, XlsxUnsupported
+
+class UploadRequest(Request):
+    """
+    Качените файлове се пазят в SpooledTemporaryFile: до UPLOAD_SPOOL_MB в
+    паметта, а над това в анонимен временен файл, който изчезва при
+    затварянето му (и при срив на процеса), така че не остават файлове.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        if UPLOAD_SPOOL_MB <= 0:
+            return tempfile.TemporaryFile()
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MB * 1024 * 1024)
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
+
+# Константи
+EUR_TO_BGN = 1.95583
+
+# Качени файлове: до JETOM_UPLOAD_SPOOL_MB на файл остават в паметта (0 =
+# винаги на диска), а заявки над JETOM_MAX_UPLOAD_MB се отказват с 413,
+# преди да се прочетат
+UPLOAD_SPOOL_MB = int(os.environ.get('JETOM_UPLOAD_SPOOL_MB', '32'))
+MAX_UPLOAD_MB = int(os.environ.get('JETOM_MAX_UPLOAD_MB', '200'))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Поточно парсване: генератори върху read-only sheets и инкрементални блокове
+# (JETOM_STREAMING_INGEST=0 връща стария режим с пълни списъци в паметта)
+STREAMING_INGEST = os.environ.get('JETOM_STREAMING_INGEST', '1') != '0'
+
+# Страницата ползва /process?stream=1 само с JETOM_STREAM_UPLOADS=1: поточният
+# отговор държи worker-а до края на обработката, затова е за async workers
+# (напр. gunicorn -k gthread). По подразбиране - фонова задача (async=1) с
+# проверка на прогреса, която работи и със синхронните workers от Procfile.
+STREAM_UPLOADS = os.environ.get('JETOM_STREAM_UPLOADS', '0') == '1'
+
+# Паралелно парсване на GPS1 и GPS2 sheets в process pool (1 = серийно).
+# GPS2 sheets се делят на порции по worker (не повече от процесорите); при
+# по-малко от JETOM_PARALLEL_MIN_SHEETS sheets GPS2 се парсва серийно.
+PARSE_WORKERS = int(os.environ.get('JETOM_PARSE_WORKERS', '1'))
+PARALLEL_MIN_SHEETS = int(os.environ.get('JETOM_PARALLEL_MIN_SHEETS', '16'))
+
+# Четец на .xlsx: 'openpyxl' или 'native' (xlsx_reader с openpyxl като резерва)
+XLSX_ENGINE = os.environ.get('JETOM_XLSX_ENGINE', 'openpyxl')
+
+# Пътувания на един камион от GPS1 и GPS2, които се различават с до толкова
+# секунди в началото и края (или се застъпват с повече), са едно пътуване
+MERGE_TOLERANCE = timedelta(seconds=int(os.environ.get('JETOM_MERGE_TOLERANCE', '300')))
+
+# Excel експорт: 'streaming' (write-only, excel_export) или 'legacy' (стария
+# експорт с целия sheet в паметта)
+EXPORT_ENGINE = os.environ.get('JETOM_EXPORT_ENGINE', 'streaming')
+
+# Таблица с маркери за държави и размер на кеша по адрес
+COUNTRY_CLASSIFIER = CountryClassifier.from_file(
+    os.environ.get('JETOM_COUNTRY_MARKERS', DEFAULT_MARKERS_PATH),
+    cache_size=int(os.environ.get('JETOM_COUNTRY_CACHE_SIZE', '65536')))
+
+# Дневни ставки по държава с дати на влизане в сила (виж per_diem.py)
+PER_DIEM_RATES = PerDiemRates.from_file(
+    COUNTRY_CLASSIFIER, os.environ.get('JETOM_PER_DIEM_RATES', DEFAULT_RATES_PATH))
+
+# Държава по координати (виж geo_countries.py) за адресите, които маркерите
+# не познават: от колоните с координати в GPS файловете, ако ги има, или от
+# адрес "ширина, дължина". JETOM_GEO_COUNTRIES=0 оставя само адресите.
+GEO_CLASSIFIER = GeoClassifier.from_file(
+    COUNTRY_CLASSIFIER, os.environ.get('JETOM_GEO_BORDERS', DEFAULT_BORDERS_PATH)
+) if os.environ.get('JETOM_GEO_COUNTRIES', '1') != '0' else None
+
+# Проверки на качеството на записите (виж data_quality.py): в отговора на
+# /process са общите броячи и до JETOM_QUALITY_MAX_TRUCKS камиона
+QUALITY_MAX_TRUCKS = int(os.environ.get('JETOM_QUALITY_MAX_TRUCKS', '50'))
+
+# Кеш на парснатите GPS файлове на диска, общ за всички workers.
+# PARSER_VERSION се увеличава при всяка промяна в записите от парсерите.
+# JETOM_PARSE_CACHE_MB=0 изключва кеша.
+PARSER_VERSION = 5
+PARSE_CACHE_MB = int(os.environ.get('JETOM_PARSE_CACHE_MB', '256'))
+PARSE_CACHE = ParseCache(
+    os.environ.get('JETOM_PARSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'jetom-parse-cache')),
+    PARSE_CACHE_MB * 1024 * 1024) if PARSE_CACHE_MB > 0 else None
+
+# Фонови задачи за /process?async=1 (в паметта на процеса)
+JOBS = JobManager(
+    workers=int(os.environ.get('JETOM_JOB_WORKERS', '2')),
+    ttl=int(os.environ.get('JETOM_JOB_TTL', '3600')))
+
+# Резултати от /process за /export-excel (в паметта на процеса)
+RESULTS = ResultStore(
+    ttl=int(os.environ.get('JETOM_RESULT_TTL', '3600')),
+    max_rows=int(os.environ.get('JETOM_RESULT_MAX_ROWS', '500000')))
+
+# История по камиони за поредни месечни файлове (SQLite). Без
+# JETOM_HISTORY_DB всяка обработка започва на чисто.
+HISTORY_DB = os.environ.get('JETOM_HISTORY_DB')
+HISTORY = HistoryStore(HISTORY_DB) if HISTORY_DB else None
+
+# Метрики по етапи за /metrics (в паметта на процеса). Пикът на паметта по
+# етапи се мери с tracemalloc, който забавя обработката, затова е по избор.
+METRICS = MetricsRegistry()
+if os.environ.get('JETOM_TRACE_MEMORY') == '1' and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+BULGARIA = COUNTRY_CLASSIFIER.code_of('България')
+
+
+def new_data_quality():
+    """DataQuality за една обработка; неопределените държави са от класификатора"""
+    return DataQuality((COUNTRY_CLASSIFIER.fallback_code, COUNTRY_CLASSIFIER.empty_code),
+                       QUALITY_MAX_TRUCKS)
+
+
+def location_code(address, point=None):
+    """
+    Код на държава за точка от GPS запис: по маркерите в адреса, а ако те
+    не я определят (празен или непознат адрес) - по координатите point
+    (ширина, дължина) от GEO_CLASSIFIER или по адрес "ширина, дължина".
+    Изрична държава в адреса е по-точна от опростените граници.
+    """
+    code = COUNTRY_CLASSIFIER.code(address)
+    if GEO_CLASSIFIER is None or (code != COUNTRY_CLASSIFIER.fallback_code
+                                  and code != COUNTRY_CLASSIFIER.empty_code):
+        return code
+    for candidate in (point, parse_coordinates(address)):
+        if candidate is not None:
+            geo_code = GEO_CLASSIFIER.code(*candidate)
+            if geo_code is not None:
+                return geo_code
+    return code
+
+
+def detect_country(address, point=None):
+    """Детекция на държава от адрес (и координати, ако ги има)"""
+    return country_name(location_code(address, point))
+
+
+def country_name(code):
+    """Име на държава по код от COUNTRY_CLASSIFIER"""
+    return COUNTRY_CLASSIFIER.names[code]
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class GpsRecord:
+    """
+    Един GPS запис (пътуване) от GPS1 или GPS2.
+    from_country/to_country са кодове от COUNTRY_CLASSIFIER, а камионът и
+    адресите са intern-нати низове, защото се повтарят в хиляди редове.
+    """
+
+    __slots__ = ('truck', 'start_time', 'end_time', 'from_addr', 'to_addr',
+                 'from_country', 'to_country', 'source')
+
+    def __init__(self, truck, start_time, end_time, from_addr, to_addr,
+                 from_country, to_country, source):
+        self.truck = truck
+        self.start_time = start_time
+        self.end_time = end_time
+        self.from_addr = from_addr
+        self.to_addr = to_addr
+        self.from_country = from_country
+        self.to_country = to_country
+        self.source = source
+
+    def __repr__(self):
+        return (f'GpsRecord({self.truck!r}, {self.start_time!r}, {self.end_time!r}, '
+                f'{country_name(self.from_country)} → {country_name(self.to_country)}, {self.source})')
+
+
+def _gps_record(truck, start_time, end_time, from_addr, to_addr, source,
+                from_point=None, to_point=None):
+    from_addr = _intern(from_addr)
+    to_addr = _intern(to_addr)
+    return GpsRecord(_intern(truck), start_time, end_time, from_addr, to_addr,
+                     location_code(from_addr, from_point), location_code(to_addr, to_point),
+                     source)
+
+
+class _OpenpyxlWorkbook:
+    """openpyxl read-only workbook с интерфейса на XlsxReader"""
+
+    def __init__(self, file_path):
+        self._wb = openpyxl.load_workbook(file_path, read_only=True)
+        self.sheetnames = self._wb.sheetnames
+        self.active_sheet_name = self._wb.active.title
+
+    def iter_rows(self, sheet_name, min_row, max_col, columns):
+        # Размерите се нулират, защото някои експорти записват грешен
+        # <dimension>, а max_col гарантира поне max_col колони на ред
+        ws = self._wb[sheet_name]
+        ws.reset_dimensions()
+        return ws.iter_rows(min_row=min_row, max_col=max_col, values_only=True)
+
+    def close(self):
+        self._wb.close()
+
+
+class GpsWorkbook:
+    """
+    .xlsx файл (път или seekable файлов обект), отворен за поточно четене на редове.
+    При XLSX_ENGINE='native' се чете с xlsx_reader, а openpyxl е резервен
+    вариант: за целия файл, ако не може да се отвори, или от текущия ред
+    нататък, ако бързият четец срещне нещо неподдържано по средата.
+    """
+
+    def __init__(self, file_path, engine=None):
+        self.file_path = file_path
+        self._native = None
+        self._openpyxl = None
+
+        if (engine or XLSX_ENGINE) == 'native':
+            try:
+                self._native = XlsxReader(file_path)
+            except XlsxUnsupported:
+                pass
+
+        base = self._native or self._get_openpyxl()
+        self.sheetnames = base.sheetnames
+        self.active_sheet_name = base.active_sheet_name
+
+    def _get_openpyxl(self):
+        if self._openpyxl is None:
+            self._openpyxl = _OpenpyxlWorkbook(self.file_path)
+        return self._openpyxl
+
+    def iter_rows(self, sheet_name, min_row, max_col, columns):
+        """Редовете на sheet от min_row; columns = нужните колони (0-базирани)"""
+        yielded = 0
+        if self._native is not None:
+            try:
+                for row in self._native.iter_rows(sheet_name, min_row, max_col, columns):
+                    yield row
+                    yielded += 1
+                return
+            except XlsxUnsupported:
+                pass
+
+        rows = self._get_openpyxl().iter_rows(sheet_name, min_row, max_col, columns)
+        yield from islice(rows, yielded, None)
+
+    def close(self):
+        if self._native is not None:
+            self._native.close()
+        if self._openpyxl is not None:
+            self._openpyxl.close()
+
+
+def open_gps_file(file_path, columns):
+    """
+    GPS файл за четене на редове: CsvReader за CSV експорт с колоните columns,
+    иначе GpsWorkbook
+    """
+    if is_csv(file_path, max(columns) + 1):
+        return CsvReader(file_path)
+    return GpsWorkbook(file_path)
+
+
+def is_gps2_csv(file_path):
+    """GPS Система 2 като един CSV файл (камионът е в колона B)"""
+    return is_csv(file_path, max(GPS2_CSV_COLUMNS) + 1)
+
+
+# Колони (0-базирани), които парсерите ползват
+GPS1_COLUMNS = (0, 1, 2, 3, 4)   # A–E
+GPS2_COLUMNS = (2, 4, 10, 12)    # C, E, K, M
+GPS2_CSV_COLUMNS = (1,) + GPS2_COLUMNS  # + B: камионът (в .xlsx е името на sheet-а)
+
+# Колоните с координати (по избор) са след колоните по-горе, до HEADER_COLUMNS
+HEADER_COLUMNS = 20
+
+
+def _rows_with_coordinates(wb, sheet_name, header_row, columns):
+    """
+    Редовете след заглавния ред на sheet и колоните с координати по него,
+    в един проход от заглавния ред (без второ отваряне на sheet-а).
+    Returns: (CoordinateColumns или None, генератор на редовете)
+    """
+    if GEO_CLASSIFIER is None:
+        return None, wb.iter_rows(sheet_name, header_row + 1, max(columns) + 1, columns)
+    extra = tuple(range(max(columns) + 1, HEADER_COLUMNS))
+    rows = wb.iter_rows(sheet_name, header_row, HEADER_COLUMNS, columns + extra)
+    return CoordinateColumns.from_header(next(rows, ())), rows
+
+
+class ParseReport:
+    """
+    Отхвърлени редове (с дата, която не може да се разчете) и редове, чиято
+    дата е минала по бавния път на DateDecoder, по източник (GPS1/GPS2).
+    Отхвърлените редове се броят и по камион (за DataQuality).
+    """
+
+    def __init__(self):
+        self.rejected = defaultdict(int)
+        self.date_fallbacks = defaultdict(int)
+        self.rejected_trucks = defaultdict(lambda: defaultdict(int))
+
+    def add(self, source, rejected=0, date_fallbacks=0, trucks=None):
+        """trucks: {камион: отхвърлени редове} (включени в rejected)"""
+        self.rejected[source] += rejected
+        self.date_fallbacks[source] += date_fallbacks
+        if trucks:
+            by_truck = self.rejected_trucks[source]
+            for truck, count in trucks.items():
+                by_truck[truck] += count
+
+    def merge(self, counts):
+        """counts: to_dict() на друг отчет (от process pool или от кеша)"""
+        for source, value in counts.get('rejected_rows', {}).items():
+            self.rejected[source] += value
+        for source, value in counts.get('date_fallbacks', {}).items():
+            self.date_fallbacks[source] += value
+        for source, trucks in counts.get('rejected_trucks', {}).items():
+            self.add(source, trucks=trucks)
+
+    def rejected_by_truck(self):
+        """{камион: отхвърлени редове} от всички източници"""
+        total = defaultdict(int)
+        for trucks in self.rejected_trucks.values():
+            for truck, count in trucks.items():
+                total[truck] += count
+        return total
+
+    def to_dict(self, source=None):
+        """Броячите за всички източници или само за source"""
+        return {
+            'rejected_rows': {s: n for s, n in self.rejected.items() if source in (None, s)},
+            'date_fallbacks': {s: n for s, n in self.date_fallbacks.items() if source in (None, s)},
+            'rejected_trucks': {s: dict(t) for s, t in self.rejected_trucks.items()
+                                if source in (None, s)}
+        }
+
+
+def iter_gps1(file_path, trucks=None, report=None):
+    """
+    Генератор на записи от GPS Система 1 файл (.xlsx или CSV със същите колони)
+    trucks: ако е зададено, връща само записите на тези камиони
+    report: ParseReport за отхвърлените редове
+    """
+    wb = open_gps_file(file_path, GPS1_COLUMNS)
+    # Форматът на датите се определя веднъж за колона
+    start_dates = DateDecoder(GPS1_DATE_FORMATS)
+    end_dates = DateDecoder(GPS1_DATE_FORMATS)
+    rejected = defaultdict(int)  # камион → отхвърлени редове
+    try:
+        # Header е на ред 8, данните започват от ред 9
+        coords, rows = _rows_with_coordinates(wb, wb.active_sheet_name, 8, GPS1_COLUMNS)
+        for row in rows:
+            truck = row[0]
+
+            if not truck or truck == "Общо":
+                continue
+            if trucks is not None and truck not in trucks:
+                continue
+
+            start_time = start_dates.decode(row[1])
+            end_time = end_dates.decode(row[2])
+            if start_time is None or end_time is None:
+                rejected[truck] += 1
+                continue
+
+            if coords is None:
+                yield _gps_record(truck, start_time, end_time, row[3], row[4], 'GPS1')
+            else:
+                yield _gps_record(truck, start_time, end_time, row[3], row[4], 'GPS1',
+                                  *coords.points(row))
+    finally:
+        wb.close()
+        if report is not None:
+            report.add('GPS1', sum(rejected.values()), start_dates.fallbacks + end_dates.fallbacks,
+                       rejected)
+
+
+def parse_gps1(file_path, report=None):
+    """Парсва GPS Система 1 файл (.xlsx или CSV)"""
+    return list(iter_gps1(file_path, report=report))
+
+
+def iter_gps2(file_path, trucks=None, sheet_names=None, report=None, engine=None):
+    """
+    Генератор на записи от GPS Система 2 файл (.xlsx или CSV)
+    Множество sheets, всеки sheet = 1 камион
+    trucks: ако е зададено, чете само sheets на тези камиони
+    sheet_names: ако е зададено, чете само тези sheets (в този ред)
+    report: ParseReport за отхвърлените редове
+    engine: XLSX четец ('native'/'openpyxl'), по подразбиране XLSX_ENGINE
+    CSV експортът е един файл с камиона в колона B (виж _iter_gps2_csv).
+    """
+    if is_gps2_csv(file_path):
+        yield from _iter_gps2_csv(file_path, trucks, sheet_names, report)
+        return
+
+    wb = GpsWorkbook(file_path, engine)
+    rejected = defaultdict(int)  # камион → отхвърлени редове
+    fallbacks = 0
+    try:
+        for sheet_name in (sheet_names or wb.sheetnames):
+            # Sheet name = регистрационен номер на камиона
+            truck = sheet_name.strip()
+            if trucks is not None and truck not in trucks:
+                continue
+
+            # Датите (DD/MM/YYYY HH:MM:SS) - форматът се определя за всеки sheet
+            start_dates = DateDecoder(GPS2_DATE_FORMATS)
+            end_dates = DateDecoder(GPS2_DATE_FORMATS)
+
+            # Header е на ред 1, данните започват от ред 2
+            coords, rows = _rows_with_coordinates(wb, sheet_name, 1, GPS2_COLUMNS)
+            for row in rows:
+                if not row[4]:  # Колона E: Начална дата
+                    continue
+
+                start_addr = row[2]                      # Колона C: Начален адрес
+                start_time = start_dates.decode(row[4])  # Колона E: Начална дата
+                end_addr = row[10]                       # Колона K: Краен адрес
+                end_time = end_dates.decode(row[12])     # Колона M: Крайна дата
+                if start_time is None or end_time is None:
+                    rejected[truck] += 1
+                    continue
+
+                if coords is None:
+                    yield _gps_record(truck, start_time, end_time, start_addr, end_addr, 'GPS2')
+                else:
+                    yield _gps_record(truck, start_time, end_time, start_addr, end_addr, 'GPS2',
+                                      *coords.points(row))
+
+            fallbacks += start_dates.fallbacks + end_dates.fallbacks
+    finally:
+        wb.close()
+        if report is not None:
+            report.add('GPS2', sum(rejected.values()), fallbacks, rejected)
+
+
+def _iter_gps2_csv(file_path, trucks=None, sheet_names=None, report=None):
+    """
+    Записите от GPS Система 2 CSV: колоните на sheet-а, а камионът е в
+    колона B. sheet_names (камиони) работи като trucks. Декодерите на
+    датите са по камион, както по sheet в .xlsx.
+    """
+    if sheet_names is not None:
+        names = {name.strip() for name in sheet_names}
+        trucks = names if trucks is None else names & set(trucks)
+
+    decoders = {}
+    rejected = defaultdict(int)  # камион → отхвърлени редове
+    reader = CsvReader(file_path)
+    try:
+        # Header е на ред 1, данните започват от ред 2
+        coords, rows = _rows_with_coordinates(reader, reader.active_sheet_name, 1, GPS2_CSV_COLUMNS)
+        for row in rows:
+            if not row[4] or not row[1]:
+                continue
+            truck = row[1].strip()
+            if trucks is not None and truck not in trucks:
+                continue
+
+            dates = decoders.get(truck)
+            if dates is None:
+                dates = decoders[truck] = (DateDecoder(GPS2_DATE_FORMATS),
+                                           DateDecoder(GPS2_DATE_FORMATS))
+            start_time = dates[0].decode(row[4])
+            end_time = dates[1].decode(row[12])
+            if start_time is None or end_time is None:
+                rejected[truck] += 1
+                continue
+
+            if coords is None:
+                yield _gps_record(truck, start_time, end_time, row[2], row[10], 'GPS2')
+            else:
+                yield _gps_record(truck, start_time, end_time, row[2], row[10], 'GPS2',
+                                  *coords.points(row))
+    finally:
+        reader.close()
+        if report is not None:
+            fallbacks = sum(d.fallbacks for pair in decoders.values() for d in pair)
+            report.add('GPS2', sum(rejected.values()), fallbacks, rejected)
+
+
+def parse_gps2(file_path, report=None):
+    """
+    Парсва GPS Система 2 файл (.xlsx или CSV)
+    Множество sheets, всеки sheet = 1 камион
+    """
+    return list(iter_gps2(file_path, report=report))
+
+
+def gps2_sheet_names(file_path):
+    """Имената на sheets в GPS Система 2 файл (за CSV - камионите, по реда им)"""
+    if is_gps2_csv(file_path):
+        with CsvReader(file_path) as reader:
+            trucks = (row[1] for row in reader.iter_rows(min_row=2, max_col=2, columns=(1,)))
+            return list(dict.fromkeys(truck.strip() for truck in trucks if truck))
+
+    # native четецът чете само workbook.xml, openpyxl сканира всички sheets
+    wb = GpsWorkbook(file_path, 'native')
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def _parse_gps1_task(file_path, trucks=None):
+    """Задача за process pool: целият GPS1 файл. Returns: (записи, отчет)"""
+    report = ParseReport()
+    records = list(iter_gps1(file_path, trucks, report=report))
+    return records, report.to_dict()
+
+
+def _parse_gps2_sheets_task(file_path, sheet_names, trucks=None):
+    """
+    Задача за process pool: порция sheets (камиони) от GPS2 файл с едно
+    отваряне на workbook-а. Чете се с native четеца (openpyxl остава
+    резервен), защото openpyxl при всяко отваряне сканира размерите на
+    всички sheets, а не само на тези от порцията. Returns: (записи, отчет)
+    """
+    report = ParseReport()
+    records = list(iter_gps2(file_path, trucks, sheet_names=sheet_names, report=report,
+                             engine='native'))
+    return records, report.to_dict()
+
+
+def _chunks(items, count):
+    """items на count последователни порции с почти равна дължина (без празни)"""
+    size, extra = divmod(len(items), count)
+    chunks = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+_parse_pools = {}
+
+
+def get_parse_pool(workers):
+    """
+    Process pool за паралелно парсване (един на брой workers, преизползва се
+    между заявките). spawn вместо fork, защото процесът може да има нишки.
+    """
+    pool = _parse_pools.get(workers)
+    if pool is None:
+        pool = _parse_pools[workers] = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return pool
+
+
+def _drain(futures, report=None):
+    try:
+        while futures:
+            # popleft освобождава резултата веднага след като е консумиран
+            records, counts = futures.popleft().result()
+            if report is not None:
+                report.merge(counts)
+            yield from records
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def parallel_record_streams(gps1_path=None, gps2_path=None, trucks=None, workers=None,
+                            report=None):
+    """
+    Паралелно парсване в process pool: GPS1 файлът е една задача, а GPS2
+    sheets се делят на последователни порции (по една на worker, но не
+    повече от процесорите) - всяка задача отваря workbook-а веднъж.
+    CSV, GPS2 с по-малко от PARALLEL_MIN_SHEETS sheets и машина с един
+    процесор четат GPS2 серийно в текущия процес, докато GPS1 се парсва в
+    пула. Връщаните
+    потоци (gps1, gps2) дават записите в реда на серийното парсване,
+    независимо кога завършва всяка задача. Отчетите на задачите се
+    добавят в report (ParseReport).
+    """
+    workers = workers or PARSE_WORKERS
+    pool = get_parse_pool(workers)
+
+    gps1_futures = deque()
+    if gps1_path:
+        gps1_futures.append(pool.submit(_parse_gps1_task, gps1_path, trucks))
+
+    if not gps2_path:
+        return _drain(gps1_futures, report), iter(())
+    chunks = min(workers, os.cpu_count() or 1)
+    if chunks <= 1 or is_gps2_csv(gps2_path):
+        return _drain(gps1_futures, report), iter_gps2(gps2_path, trucks, report=report)
+
+    sheet_names = [name for name in gps2_sheet_names(gps2_path)
+                   if trucks is None or name.strip() in trucks]
+    if len(sheet_names) < PARALLEL_MIN_SHEETS:
+        return _drain(gps1_futures, report), iter_gps2(gps2_path, trucks, sheet_names, report)
+
+    gps2_futures = deque(pool.submit(_parse_gps2_sheets_task, gps2_path, chunk, trucks)
+                         for chunk in _chunks(sheet_names, chunks))
+    return _drain(gps1_futures, report), _drain(gps2_futures, report)
+
+
+def iter_records_parallel(gps1_path, gps2_path=None, trucks=None, workers=None, report=None):
+    """Паралелно парсване на GPS1 и GPS2 като един поток (GPS1, после GPS2)"""
+    return chain(*parallel_record_streams(gps1_path, gps2_path, trucks, workers, report))
+
+
+def _record_to_tuple(rec):
+    return (rec.truck, rec.start_time, rec.end_time, rec.from_addr, rec.to_addr,
+            rec.from_country, rec.to_country, rec.source)
+
+
+def _records_from_cache(items, trucks=None):
+    for truck, start_time, end_time, from_addr, to_addr, from_country, to_country, source in items:
+        if trucks is not None and truck not in trucks:
+            continue
+        yield GpsRecord(_intern(truck), start_time, end_time, _intern(from_addr), _intern(to_addr),
+                        from_country, to_country, source)
+
+
+def _write_through(stream, cache, key, trailer=None):
+    """
+    Подава записите нататък и едновременно ги пише в кеша.
+    Кешът се потвърждава само ако потокът е изчерпан докрай.
+    trailer(): данни за целия файл, записват се след записите
+    """
+    try:
+        writer = cache.writer(key)
+    except OSError:
+        traceback.print_exc()
+        yield from stream
+        return
+
+    completed = False
+    try:
+        for rec in stream:
+            writer.add(_record_to_tuple(rec))
+            yield rec
+        completed = True
+    finally:
+        try:
+            if completed:
+                writer.commit(trailer() if trailer else None)
+            else:
+                writer.abort()
+        except OSError:
+            traceback.print_exc()
+
+
+class _NoProgress:
+    """Прогрес, който не се отчита никъде (синхронните заявки)"""
+
+    def start(self, stage):
+        pass
+
+    def advance(self, stage, records):
+        pass
+
+    def done(self, stage, records=None):
+        pass
+
+
+NO_PROGRESS = _NoProgress()
+
+# Етапи на обработката, които се отчитат в прогреса на фоновите задачи
+PIPELINE_STAGES = [
+    ('parse_gps1', 'Парсване GPS1'),
+    ('parse_gps2', 'Парсване GPS2'),
+    ('build_blocks', 'Travel blocks'),
+    ('group', 'Групиране по шофьори'),
+]
+
+
+def _track(stream, progress, stage, every=1000):
+    """Отчита броя записи, минали през потока, като прогрес на етап"""
+    progress.start(stage)
+    count = 0
+    for rec in stream:
+        count += 1
+        if count % every == 0:
+            progress.advance(stage, count)
+        yield rec
+    progress.done(stage, count)
+
+
+def make_record_source(gps1_path, gps2_path=None, workers=None, cache=None, progress=NO_PROGRESS,
+                       report=None):
+    """
+    Връща open_records(trucks=None) за build_travel_blocks_streaming:
+    серийно поточно парсване или паралелно при workers > 1. Файловете,
+    които вече са в кеша на парсера, се четат от него, а останалите се
+    парсват и записват в кеша (само при пълен проход без филтър).
+    Пълният проход отчита етапите parse_gps1/parse_gps2 в progress и
+    отхвърлените редове в report (ParseReport; пази се и в кеша).
+    """
+    workers = PARSE_WORKERS if workers is None else workers
+    cache = PARSE_CACHE if cache is None else cache
+
+    files = [(kind, path) for kind, path in (('gps1', gps1_path), ('gps2', gps2_path)) if path]
+    keys = {}
+    if cache:
+        for kind, path in files:
+            keys[kind] = cache.make_key(path, kind, PARSER_VERSION, COUNTRY_CLASSIFIER.fingerprint,
+                                        GEO_CLASSIFIER.fingerprint if GEO_CLASSIFIER else None)
+
+    def open_records(trucks=None):
+        # Повторните проходи за част от камионите не броят редовете отново
+        full_report = report if trucks is None else None
+        streams = {}
+        for kind, path in files:
+            if kind in keys:
+                cached = cache.read(keys[kind], full_report.merge if full_report else None)
+                if cached is not None:
+                    streams[kind] = _records_from_cache(cached, trucks)
+
+        to_parse = {kind: path for kind, path in files if kind not in streams}
+        if to_parse:
+            if workers > 1:
+                gps1_stream, gps2_stream = parallel_record_streams(
+                    to_parse.get('gps1'), to_parse.get('gps2'), trucks, workers, full_report)
+                parsed = {'gps1': gps1_stream, 'gps2': gps2_stream}
+            else:
+                parsed = {}
+                if 'gps1' in to_parse:
+                    parsed['gps1'] = iter_gps1(to_parse['gps1'], trucks, full_report)
+                if 'gps2' in to_parse:
+                    parsed['gps2'] = iter_gps2(to_parse['gps2'], trucks, report=full_report)
+
+            for kind in to_parse:
+                stream = parsed[kind]
+                if kind in keys and trucks is None:
+                    trailer = None
+                    if full_report is not None:
+                        source = kind.upper()
+                        trailer = lambda source=source: full_report.to_dict(source)
+                    stream = _write_through(stream, cache, keys[kind], trailer)
+                streams[kind] = stream
+
+        if trucks is None:
+            for kind in streams:
+                streams[kind] = _track(streams[kind], progress, 'parse_' + kind)
+
+        return chain(*(streams[kind] for kind, _ in files))
+
+    return open_records
+
+
+def parse_mapping(file_path, report=None):
+    """
+    Парсва mapping CSV (Камион;Шофьор и по избор От;До) от път или файлов обект
+    Колоните От/До се търсят по заглавието; други колони се пренебрегват.
+    Редовете с невалидни дати се броят в report като източник 'mapping'.
+    Returns: DriverMapping
+    """
+    mapping = DriverMapping()
+
+    def date_at(row, idx):
+        if idx is None or idx >= len(row):
+            return None
+        return parse_mapping_date(row[idx] or '')
+
+    try:
+        with CsvReader(file_path) as reader:
+            rows = reader.iter_rows()
+            # Ред 1 е header: колоните От/До се намират по име, другите се пренебрегват
+            from_idx, to_idx = date_columns(next(rows, ()))
+            for row in rows:
+                if len(row) < 2:
+                    continue
+                truck = (row[0] or '').strip()
+                driver = (row[1] or '').strip()
+                try:
+                    valid_from = date_at(row, from_idx)
+                    valid_to = date_at(row, to_idx)
+                except ValueError:
+                    if report is not None:
+                        report.add('mapping', rejected=1)
+                    continue
+                mapping.add(truck, driver, valid_from, valid_to)
+
+    except Exception as e:
+        print(f"Error parsing mapping: {e}")
+
+    return mapping
+
+
+class TravelBlock:
+    """
+    Travel block на един камион.
+    Записите не се копират в блока: first_record/last_record са индекси в
+    подредената по start_time поредица от записи на камиона, а records_count
+    е колко от тях принадлежат на блока. country е код от COUNTRY_CLASSIFIER.
+    day_countries е държавата (код) за всеки календарен ден от start_date
+    нататък - къде е бил камионът в края на деня (виж visit); bytearray,
+    защото кодовете на държавите са под 256.
+    """
+
+    __slots__ = ('truck', 'start_date', 'end_date', 'country',
+                 'first_record', 'last_record', 'records_count', 'days', 'day_countries')
+
+    def __init__(self, truck, start_date, end_date, country, first_record):
+        self.truck = truck
+        self.start_date = start_date
+        self.end_date = end_date
+        self.country = country
+        self.first_record = first_record
+        self.last_record = first_record
+        self.records_count = 1
+        self.days = 1
+        self.day_countries = bytearray()
+
+    @property
+    def country_name(self):
+        return country_name(self.country)
+
+    @property
+    def start_date_formatted(self):
+        if isinstance(self.start_date, datetime):
+            return self.start_date.strftime('%d.%m.%Y')
+
+    @property
+    def end_date_formatted(self):
+        if isinstance(self.end_date, datetime):
+            return self.end_date.strftime('%d.%m.%Y')
+
+    def visit(self, when, country):
+        """
+        Камионът е в country (чужбина) в момента when. Денят получава
+        последната държава за деня, а дните без записи - държавата от
+        предишния ден. Записите идват по време, затова всеки запис е O(1),
+        плюс дните, които прескача.
+        """
+        try:
+            offset = when.toordinal() - self.start_date.toordinal()
+        except AttributeError:
+            return  # без дата
+        day_countries = self.day_countries
+        last = len(day_countries) - 1
+        if offset < last or offset < 0:
+            return  # по-ранен момент от вече отбелязан ден
+        if offset == last:
+            day_countries[offset] = country
+        else:
+            if offset > last + 1:
+                day_countries.extend((day_countries[-1:] or bytes((country,))) * (offset - last - 1))
+            day_countries.append(country)
+
+    def finalize(self):
+        """Изчислява дните на затворен блок"""
+        start = self.start_date
+        end = self.end_date
+
+        if isinstance(start, datetime) and isinstance(end, datetime):
+            days = (end.date() - start.date()).days + 1
+            self.days = max(1, days)
+        else:
+            self.days = 1
+
+        # day_countries има точно days елемента
+        day_countries = self.day_countries
+        if not day_countries:
+            day_countries.append(self.country)
+        del day_countries[self.days:]
+        day_countries.extend(day_countries[-1:] * (self.days - len(day_countries)))
+        return self
+
+    def part(self, start, end):
+        """Затворена част от блока от start до end (datetime) с дните ѝ"""
+        part = TravelBlock(self.truck, start, end, self.country, self.first_record)
+        part.last_record = self.last_record
+        offset = (start.date() - self.start_date.date()).days
+        part.day_countries = self.day_countries[offset:offset + (end.date() - start.date()).days + 1]
+        return part.finalize()
+
+
+class TravelBlockBuilder:
+    """
+    Инкрементално построяване на travel blocks за един камион.
+    Записите се подават подредени по start_time; в паметта остава само
+    отвореният блок.
+    """
+
+    def __init__(self, truck):
+        self.truck = truck
+        self.blocks = []
+        self.current_block = None
+        self.position = 0
+
+    @classmethod
+    def resume(cls, truck, position, current_block):
+        """Продължава след position записа с отворен блок current_block (или None)"""
+        builder = cls(truck)
+        builder.position = position
+        builder.current_block = current_block
+        return builder
+
+    def _close(self):
+        self.blocks.append(self.current_block.finalize())
+        self.current_block = None
+
+    def feed(self, rec):
+        idx = self.position
+        self.position += 1
+
+        from_country = rec.from_country
+        to_country = rec.to_country
+
+        # България → Чужбина = START
+        if from_country == BULGARIA and to_country != BULGARIA:
+            if self.current_block:
+                self._close()
+            block = self.current_block = TravelBlock(self.truck, rec.start_time, rec.end_time,
+                                                     to_country, idx)
+            block.visit(rec.end_time, to_country)
+
+        # Чужбина → Чужбина = CONTINUE
+        elif from_country != BULGARIA and to_country != BULGARIA:
+            block = self.current_block
+            if block:
+                # Обикновено курсът тръгва оттам, където е свършил предишният,
+                # и дните до тръгването вече са в тази държава
+                if from_country != block.country:
+                    block.visit(rec.start_time, from_country)
+                block.end_date = rec.end_time
+                block.country = to_country
+                block.last_record = idx
+                block.records_count += 1
+            else:
+                block = self.current_block = TravelBlock(self.truck, rec.start_time, rec.end_time,
+                                                         to_country, idx)
+                block.visit(rec.start_time, from_country)
+            block.visit(rec.end_time, to_country)
+
+        # Чужбина → България = END
+        elif from_country != BULGARIA and to_country == BULGARIA:
+            block = self.current_block
+            if block:
+                block.end_date = rec.start_time
+                block.last_record = idx
+                block.records_count += 1
+                if from_country != block.country:
+                    block.visit(rec.start_time, from_country)
+                self._close()
+
+    def finish(self):
+        if self.current_block:
+            self._close()
+        return self.blocks
+
+
+_by_start_time = attrgetter('start_time')
+
+
+def _is_sorted(records):
+    return all(a.start_time <= b.start_time for a, b in zip(records, islice(records, 1, None)))
+
+
+def _same_trip(prev, rec, tolerance):
+    """rec (по-късен по start_time) дублира или застъпва prev"""
+    if not (isinstance(prev.end_time, datetime) and isinstance(rec.end_time, datetime)):
+        return False
+    if rec.start_time - prev.start_time <= tolerance and abs(rec.end_time - prev.end_time) <= tolerance:
+        return True
+    return rec.start_time < prev.end_time - tolerance
+
+
+def merge_truck_records(runs, tolerance=None):
+    """
+    Слива записите на един камион от няколко източника (по един списък на
+    източник, както ги групира _runs_by_source) в един поток по start_time.
+    Списъците обикновено вече са подредени, затова се сортира само
+    разбъркан списък, а сливането е k-way merge. Запис, който дублира
+    последния слят запис от друг източник или се застъпва с него с повече
+    от tolerance, се слива с него в един запис, така че верига от
+    застъпвания (GPS1, GPS2, GPS1, ...) става едно пътуване. Застъпващи се
+    записи от един източник не се сливат.
+    Returns: (records, merged_count)
+    """
+    tolerance = MERGE_TOLERANCE if tolerance is None else tolerance
+    for run in runs:
+        if not _is_sorted(run):
+            run.sort(key=_by_start_time)
+    if len(runs) <= 1:
+        return (runs[0] if runs else []), 0
+
+    merged = []
+    merged_count = 0
+    parts = {}  # източник → последният му запис, слят в merged[-1]
+    for rec in heapq.merge(*runs, key=_by_start_time):
+        if any(source != rec.source and _same_trip(part, rec, tolerance)
+               for source, part in parts.items()):
+            merged_count += 1
+            parts[rec.source] = rec
+            prev = merged[-1]
+            if rec.end_time > prev.end_time:
+                # Застъпване: пътуването продължава до края на rec
+                merged[-1] = GpsRecord(prev.truck, prev.start_time, rec.end_time,
+                                       prev.from_addr, rec.to_addr, prev.from_country,
+                                       rec.to_country, prev.source)
+            continue
+        merged.append(rec)
+        parts = {rec.source: rec}
+    return merged, merged_count
+
+
+def _runs_by_source(records):
+    runs = {}
+    for rec in records:
+        runs.setdefault(rec.source, []).append(rec)
+    return list(runs.values())
+
+
+def build_travel_blocks(records, stats=None):
+    """
+    Построява travel blocks от GPS записи
+    stats: ако е подаден dict, в него се записват merged_records и
+    data_quality (DataQuality с проверките на записите)
+    """
+    by_truck = defaultdict(list)
+    for rec in records:
+        by_truck[rec.truck].append(rec)
+
+    all_blocks = {}
+    merged_records = 0
+    quality = new_data_quality()
+
+    for truck, truck_records in by_truck.items():
+        truck_records, merged_count = merge_truck_records(_runs_by_source(truck_records))
+        merged_records += merged_count
+
+        builder = TravelBlockBuilder(truck)
+        for rec in truck_records:
+            builder.feed(rec)
+        quality.truck(truck).feed_all(truck_records)
+
+        all_blocks[truck] = builder.finish()
+
+    if stats is not None:
+        stats['merged_records'] = merged_records
+        stats['data_quality'] = quality
+    return all_blocks
+
+
+def iter_travel_blocks_streaming(open_records, stats, hold=None):
+    """
+    Поточен вариант на build_travel_blocks.
+    open_records(trucks=None) връща нов итератор върху записите (напр. chain
+    от iter_gps1/iter_gps2), по избор само за дадени камиони. Всеки камион
+    се обработва инкрементално, докато записите му идват подредени по
+    start_time и от един източник. Камион с разбъркани записи или със
+    записи и от GPS1, и от GPS2 се маркира и при втори проход се четат само
+    неговите записи и се сливат с merge_truck_records.
+
+    Генератор на (truck, blocks). Без hold всички камиони излизат след
+    първия проход. С hold (множество камиони, които още може да дойдат от
+    следващ източник, напр. sheets на GPS2) камионът излиза, щом потокът
+    мине на друг камион, т.е. при файлове, групирани по камиони, блоковете
+    му са готови преди края на парсването. hold важи само докато трае
+    първият източник: след него камионите от hold излизат като всички
+    останали. Ако такъв камион се появи отново, той минава през втория
+    проход и излиза повторно - последното (truck, blocks) е окончателното.
+    В stats се записват броячите на записите и data_quality (DataQuality)
+    след изчерпване на генератора.
+    """
+    builders = {}
+    checks = {}
+    quality = new_data_quality()
+    last_start = {}
+    sources = {}
+    unsorted_trucks = set()
+    emitted = set()
+    total_records = 0
+    abroad_records = 0
+    merged_records = 0
+    current = None
+    first_source = None
+
+    for rec in open_records():
+        total_records += 1
+        if rec.to_country != BULGARIA:
+            abroad_records += 1
+
+        if hold and rec.source != first_source:
+            if first_source is None:
+                first_source = rec.source
+            else:
+                # Първият източник е изчерпан - нататък камионите идват само от текущия
+                hold = frozenset()
+
+        truck = rec.truck
+        if hold is not None and truck != current:
+            # Потокът мина на друг камион - предишният е готов
+            if current is not None and current not in hold and builders.get(current):
+                builder = builders[current]
+                builders[current] = None
+                emitted.add(current)
+                yield current, builder.finish()
+            current = truck
+            if truck in emitted and truck not in unsorted_trucks:
+                unsorted_trucks.add(truck)
+
+        if truck in unsorted_trucks:
+            continue
+
+        builder = builders.get(truck)
+        if builder is None:
+            builder = builders[truck] = TravelBlockBuilder(truck)
+            checks[truck] = quality.truck(truck)
+            sources[truck] = rec.source
+        elif rec.start_time < last_start[truck] or rec.source != sources[truck]:
+            unsorted_trucks.add(truck)
+            builders[truck] = None
+            continue
+
+        last_start[truck] = rec.start_time
+        builder.feed(rec)
+        checks[truck].feed(rec)
+
+    for truck, builder in builders.items():
+        if truck not in emitted and truck not in unsorted_trucks:
+            yield truck, builder.finish()
+
+    # Втори проход само за маркираните камиони
+    if unsorted_trucks:
+        pending = defaultdict(list)
+        for rec in open_records(unsorted_trucks):
+            pending[rec.truck].append(rec)
+
+        for truck, truck_records in pending.items():
+            truck_records, merged_count = merge_truck_records(_runs_by_source(truck_records))
+            merged_records += merged_count
+            builder = TravelBlockBuilder(truck)
+            for rec in truck_records:
+                builder.feed(rec)
+            quality.truck(truck).feed_all(truck_records)
+            yield truck, builder.finish()
+
+    stats.update(total_records=total_records, abroad_records=abroad_records,
+                 merged_records=merged_records, data_quality=quality)
+
+
+def build_travel_blocks_streaming(open_records):
+    """
+    Всички блокове от iter_travel_blocks_streaming
+    Returns: (blocks, record_stats)
+    """
+    record_stats = {}
+    all_blocks = dict(iter_travel_blocks_streaming(open_records, record_stats))
+    return all_blocks, record_stats
+
+
+def _block_to_history(block):
+    return (block.start_date, block.end_date, country_name(block.country),
+            block.first_record, block.last_record, block.records_count, block.days,
+            [country_name(code) for code in block.day_countries])
+
+
+def _country_code(name):
+    try:
+        return COUNTRY_CLASSIFIER.code_of(name)
+    except KeyError:
+        return COUNTRY_CLASSIFIER.fallback_code
+
+
+def _history_record(truck, row):
+    """GpsRecord от ред на HistorySession.truck_records"""
+    start_time, end_time, from_addr, to_addr, source, from_country, to_country = row
+    if from_country is None or to_country is None:
+        # История отпреди държавите на записите - по адресите
+        return _gps_record(truck, start_time, end_time, from_addr, to_addr, source)
+    return GpsRecord(_intern(truck), start_time, end_time, _intern(from_addr), _intern(to_addr),
+                     _country_code(from_country), _country_code(to_country), source)
+
+
+def _block_from_history(truck, row):
+    start_date, end_date, country, first_record, last_record, records_count, days, day_countries = row
+    block = TravelBlock(truck, start_date, end_date, _country_code(country), first_record)
+    block.last_record = last_record
+    block.records_count = records_count
+    block.days = days
+    # Блоковете от по-стара история са без дни - те остават в държавата на блока
+    block.day_countries = bytearray(_country_code(name) for name in day_countries or ())
+    return block
+
+
+def build_travel_blocks_incremental(records, history):
+    """
+    Travel blocks с история от предишни обработки (HistoryStore).
+    Записите, които вече са в историята, се пропускат. Новите записи след
+    watermark-а на камиона продължават от запазения му отворен блок, така
+    че работата е пропорционална на новите данни. Камион с нов запис преди
+    watermark-а (закъснели данни) се преизчислява от цялата си история.
+    Дублираните пътувания от GPS1 и GPS2 се сливат (merge_truck_records).
+
+    Връща затворените блокове, завършили след най-ранния качен запис, плюс
+    отворения блок (затворен към края на данните, както в build_travel_blocks).
+    Записите (поток от парсерите) се прочитат преди транзакцията, така че
+    заключването за запис в SQLite не се държи по време на парсването.
+    Returns: (blocks, record_stats)
+    """
+    by_truck = defaultdict(list)
+    states = {}
+    pending = defaultdict(list)
+    rebuild = set()
+    total_records = 0
+    abroad_records = 0
+    merged_records = 0
+    since = None
+    quality = new_data_quality()
+
+    for rec in records:
+        total_records += 1
+        if rec.to_country != BULGARIA:
+            abroad_records += 1
+        if since is None or rec.start_time < since:
+            since = rec.start_time
+        by_truck[rec.truck].append(rec)
+
+    with history.session() as session:
+        for truck, uploaded in by_truck.items():
+            state = states[truck] = session.truck_state(truck)
+            for rec in uploaded:
+                if not session.add_record(truck, rec.start_time, rec.end_time,
+                                          rec.from_addr, rec.to_addr, rec.source,
+                                          country_name(rec.from_country),
+                                          country_name(rec.to_country)):
+                    continue  # вече е обработен
+                if state is not None and rec.start_time <= state.watermark:
+                    rebuild.add(truck)
+                    pending.pop(truck, None)
+                elif truck not in rebuild:
+                    pending[truck].append(rec)
+
+        all_blocks = {}
+        for truck, state in states.items():
+            if truck in rebuild:
+                session.clear_truck(truck)
+                builder = TravelBlockBuilder(truck)
+                truck_records = [_history_record(truck, row) for row in session.truck_records(truck)]
+                truck_records, merged_count = merge_truck_records(_runs_by_source(truck_records))
+            else:
+                if state is None:
+                    builder = TravelBlockBuilder(truck)
+                else:
+                    open_block = (_block_from_history(truck, state.open_block)
+                                  if state.open_block else None)
+                    builder = TravelBlockBuilder.resume(truck, state.position, open_block)
+                truck_records, merged_count = merge_truck_records(
+                    _runs_by_source(pending.pop(truck, [])))
+            merged_records += merged_count
+
+            for rec in truck_records:
+                builder.feed(rec)
+            # Проверяват се подадените записи - при преизчисляване цялата история
+            quality.truck(truck).feed_all(truck_records)
+
+            if truck_records:
+                session.add_blocks(truck, [_block_to_history(b) for b in builder.blocks])
+                current = builder.current_block
+                session.save_state(truck, truck_records[-1].start_time, builder.position,
+                                   _block_to_history(current) if current else None)
+
+            blocks = [_block_from_history(truck, row) for row in session.blocks_since(truck, since)]
+            if builder.current_block:
+                blocks.append(builder.current_block.finalize())
+            all_blocks[truck] = blocks
+
+        new_records = session.new_records
+
+    record_stats = {
+        'total_records': total_records,
+        'abroad_records': abroad_records,
+        'new_records': new_records,
+        'rebuilt_trucks': len(rebuild),
+        'merged_records': merged_records,
+        'data_quality': quality
+    }
+    return all_blocks, record_stats
+
+
+UNMAPPED_DRIVER = '⚠️ Неразпределени'
+
+
+def split_block_by_driver(block, mapping):
+    """
+    Разделя блок при смяна на шофьора по време на блока.
+    Частите завършват минута преди смяната (смените са в 00:00), за да не
+    се брои денят на смяната и на двамата шофьори. Записите не са в паметта
+    при групирането, затова records_count се разпределя по времето на частите.
+    Returns: [(блок, шофьор или None)]
+    """
+    start, end = block.start_date, block.end_date
+    if not (isinstance(start, datetime) and isinstance(end, datetime)):
+        return [(block, mapping.driver_at(block.truck, start) if isinstance(start, datetime) else None)]
+
+    segments = mapping.segments(block.truck, start, end)
+    if len(segments) == 1:
+        return [(block, segments[0][2])]
+
+    total_seconds = (end - start).total_seconds() or 1
+    remaining = block.records_count
+    parts = []
+    for i, (seg_start, seg_end, driver) in enumerate(segments):
+        last = i == len(segments) - 1
+        part = block.part(seg_start, seg_end if last else seg_end - timedelta(minutes=1))
+        if last:
+            part.records_count = remaining
+        else:
+            share = round(block.records_count * (seg_end - seg_start).total_seconds() / total_seconds)
+            part.records_count = min(remaining, max(1, share))
+        remaining -= part.records_count
+        parts.append((part, driver))
+    return parts
+
+
+def price_block(block):
+    """
+    Ставките на блок по дните му (day_countries): всеки ден се плаща по
+    ставката за държавата и датата си. Блокът се разделя там, където се
+    сменят държавата или ставката - частите завършват в 23:59 преди
+    следващата, а records_count се разпределя по дните им.
+    Returns: [(блок, код на държава, EUR ставка)]
+    ValueError за блок без начална дата - ставката зависи от датата.
+    """
+    start = block.start_date
+    if not isinstance(start, datetime):
+        raise ValueError(f'Блок без начална дата (камион {block.truck}): {start!r}')
+
+    if not block.day_countries:
+        # Блок от по-стара история без дни
+        return [(block, block.country, PER_DIEM_RATES.rate(block.country, start))]
+
+    day_countries = block.day_countries
+    first_day = start.toordinal()
+    if day_countries.count(day_countries[0]) == len(day_countries):
+        # Целият блок в една държава (обичайният случай)
+        code = day_countries[0]
+        runs = [(offset, code, rate)
+                for offset, rate in PER_DIEM_RATES.rates(code, first_day, len(day_countries))]
+    else:
+        runs = []  # (отместване на първия ден, държава, ставка)
+        offset = 0
+        for code, days in groupby(day_countries):
+            count = sum(1 for _ in days)
+            for rate_offset, rate in PER_DIEM_RATES.rates(code, first_day + offset, count):
+                if not runs or runs[-1][1] != code or runs[-1][2] != rate:
+                    runs.append((offset + rate_offset, code, rate))
+            offset += count
+    if len(runs) == 1:
+        return [(block, runs[0][1], runs[0][2])]
+
+    remaining = block.records_count
+    parts = []
+    for i, (offset, code, rate) in enumerate(runs):
+        last = i == len(runs) - 1
+        part_start = start if i == 0 else datetime.fromordinal(first_day + offset)
+        if last:
+            part_end = block.end_date
+        else:
+            part_end = datetime.fromordinal(first_day + runs[i + 1][0]) - timedelta(minutes=1)
+        part = block.part(part_start, part_end)
+        if last:
+            part.records_count = remaining
+        else:
+            part.records_count = min(remaining, max(1, round(block.records_count * part.days / block.days)))
+        remaining -= part.records_count
+        parts.append((part, code, rate))
+    return parts
+
+
+def group_by_driver(blocks, mapping):
+    """
+    Групира travel blocks по шофьор
+    mapping: DriverMapping (или стария dict { truck: driver })
+    Returns: dict { driver: [blocks] }
+    """
+    if isinstance(mapping, dict):
+        mapping = DriverMapping.from_dict(mapping)
+    by_driver = defaultdict(list)
+    unmapped_trucks = []
+
+    # Блоковете вече знаят камиона си, затова се групират без копиране
+    for truck, truck_blocks in blocks.items():
+        driver = mapping.single_driver(truck)
+
+        if driver:
+            by_driver[driver].extend(truck_blocks)
+        elif truck not in mapping:
+            unmapped_trucks.append(truck)
+            # Добавяме към "Неразпределени"
+            by_driver[UNMAPPED_DRIVER].extend(truck_blocks)
+        else:
+            # Шофьорът зависи от датата: блоковете се разделят при смяна
+            unmapped = False
+            for block in truck_blocks:
+                for part, part_driver in split_block_by_driver(block, mapping):
+                    if not part_driver:
+                        unmapped = True
+                        part_driver = UNMAPPED_DRIVER
+                    by_driver[part_driver].append(part)
+            if unmapped:
+                unmapped_trucks.append(truck)
+
+    # Сортираме блоковете по дата за всеки шофьор
+    by_start_date = attrgetter('start_date')
+    for driver in by_driver:
+        by_driver[driver].sort(key=by_start_date)
 
-# Константи
-EUR_TO_BGN = 1.95583
-DEFAULT_EUR_RATE = {
-    'Гърция': 43,
-    'Румъния': 46,
-    'Турция': 43,
-    'Чужбина (неопределена)': 43
-}
-
-
-def detect_country(address):
-    """Детекция на държава от адрес"""
-    if not address:
-        return "Неизвестна"
-    
-    addr = str(address)
-    
-    # България — на кирилица
-    if "България" in addr:
-        return "България"
-    
-    # Гърция — на гръцки
-    greek_markers = ["Δήμος", "Περιφερ", "Ελληνικ", "Δημοτικ", "Κοινότητα"]
-    if any(m in addr for m in greek_markers):
-        return "Гърция"
-    
-    # Румъния
-    if "Румъния" in addr or "România" in addr or "Romania" in addr:
-        return "Румъния"
-    
-    # Турция
-    if "Турция" in addr or "Türkiye" in addr or "Turkey" in addr:
-        return "Турция"
-    
-    return "Чужбина (неопределена)"
+    return dict(by_driver), unmapped_trucks
 
 
-def parse_gps1(file_path):
-    """Парсва GPS Система 1 файл (.xlsx)"""
-    wb = openpyxl.load_workbook(file_path)
-    ws = wb.active
-    
-    records = []
-    
-    for row in ws.iter_rows(min_row=9, values_only=True):
-        truck = row[0]
-        
-        if not truck or truck == "Общо":
-            continue
-            
-        start_time = row[1]
-        end_time = row[2]
-        from_addr = row[3]
-        to_addr = row[4]
-        
-        # Конвертираме датите
-        if isinstance(start_time, str):
-            start_time = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-        if isinstance(end_time, str):
-            end_time = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S')
-        
-        from_country = detect_country(from_addr)
-        to_country = detect_country(to_addr)
-        
-        records.append({
-            'truck': truck,
-            'start_time': start_time,
-            'end_time': end_time,
-            'from_addr': from_addr,
-            'to_addr': to_addr,
-            'from_country': from_country,
-            'to_country': to_country,
-            'source': 'GPS1'
-        })
-    
-    return records
+def record_stats(records):
+    """Брой записи и записи в чужбина за списък от GPS записи"""
+    return {
+        'total_records': len(records),
+        'abroad_records': sum(1 for r in records if r.to_country != BULGARIA)
+    }
+
+
+def _format_block_date(value):
+    return value.strftime('%d.%m.%Y %H:%M') if isinstance(value, datetime) else str(value)
+
+
+def _block_row(driver, block_num, block, country, eur_rate):
+    return {
+        'driver': driver,
+        'truck': block.truck,
+        'block_num': block_num,
+        'start_date': _format_block_date(block.start_date),
+        'end_date': _format_block_date(block.end_date),
+        'country': country_name(country),
+        'days': block.days,
+        'eur_rate': eur_rate,
+        'records_count': block.records_count
+    }
+
 
+def _block_rows(driver, block_num, block):
+    """Редовете на блок - по един за всяка държава/ставка (price_block)"""
+    return [_block_row(driver, block_num, part, country, rate)
+            for part, country, rate in price_block(block)]
 
-def parse_gps2(file_path):
+
+def serialize_result(blocks, mapping, rec_stats, progress=NO_PROGRESS):
     """
-    Парсва GPS Система 2 файл (.xlsx)
-    Множество sheets, всеки sheet = 1 камион
+    Подготвя редовете и статистиката за отговора на /process
+    В progress приключва етапа group (започнат от извикващия) и отчита serialize.
+    Returns: (result_data, stats)
     """
-    wb = openpyxl.load_workbook(file_path)
-    records = []
-    
-    for sheet_name in wb.sheetnames:
-        # Sheet name = регистрационен номер на камиона
-        truck = sheet_name.strip()
-        ws = wb[sheet_name]
-        
-        # Header е на ред 1, данните започват от ред 2
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if not row[4]:  # Колона E: Начална дата
-                continue
-            
-            start_addr = row[2]  # Колона C: Начален адрес
-            start_time = row[4]  # Колона E: Начална дата
-            end_addr = row[10]   # Колона K: Краен адрес
-            end_time = row[12]   # Колона M: Крайна дата
-            
-            # Парсваме датите (формат: DD/MM/YYYY HH:MM:SS)
-            if isinstance(start_time, str):
-                try:
-                    start_time = datetime.strptime(start_time, '%d/%m/%Y %H:%M:%S')
-                except:
-                    try:
-                        start_time = datetime.strptime(start_time, '%d/%m/%Y %H:%M')
-                    except:
-                        continue
-            
-            if isinstance(end_time, str):
-                try:
-                    end_time = datetime.strptime(end_time, '%d/%m/%Y %H:%M:%S')
-                except:
-                    try:
-                        end_time = datetime.strptime(end_time, '%d/%m/%Y %H:%M')
-                    except:
-                        continue
-            
-            from_country = detect_country(start_addr)
-            to_country = detect_country(end_addr)
-            
-            records.append({
-                'truck': truck,
-                'start_time': start_time,
-                'end_time': end_time,
-                'from_addr': start_addr,
-                'to_addr': end_addr,
-                'from_country': from_country,
-                'to_country': to_country,
-                'source': 'GPS2'
-            })
-    
-    return records
+    total_records = rec_stats['total_records']
+    abroad_records = rec_stats['abroad_records']
+
+    stats = {
+        'total_records': total_records,
+        'abroad_records': abroad_records,
+        'abroad_percentage': round(abroad_records / total_records * 100, 1) if total_records > 0 else 0,
+        'total_trucks': len(blocks),
+        'trucks_with_travel': len([t for t, b in blocks.items() if len(b) > 0]),
+        'total_blocks': sum(len(b) for b in blocks.values()),
+    }
+    # Слети дублирани пътувания от GPS1/GPS2 и (при обработка с история) колко
+    # записа са нови и колко камиона са преизчислени
+    for key in ('new_records', 'rebuilt_trucks', 'merged_records'):
+        if key in rec_stats:
+            stats[key] = rec_stats[key]
+
+    result_data = []
 
+    # Ако има mapping, групираме по шофьор
+    if mapping:
+        by_driver, unmapped = group_by_driver(blocks, mapping)
+        progress.done('group', stats['total_blocks'])
 
-def parse_mapping(file_path):
+        progress.start('serialize')
+        for driver in sorted(by_driver.keys()):
+            for i, block in enumerate(by_driver[driver], 1):
+                result_data.extend(_block_rows(driver, i, block))
+
+        stats['total_drivers'] = len([d for d in by_driver.keys() if d != UNMAPPED_DRIVER])
+        stats['unmapped_trucks'] = unmapped
+        stats['has_mapping'] = True
+
+    else:
+        # Без mapping - показваме по камиони
+        progress.done('group', stats['total_blocks'])
+
+        progress.start('serialize')
+        for truck in sorted(blocks.keys()):
+            for i, block in enumerate(blocks[truck], 1):
+                result_data.extend(_block_rows(None, i, block))
+
+        stats['has_mapping'] = False
+
+    progress.done('serialize', len(result_data))
+    return result_data, stats
+
+
+@contextmanager
+def parse_pool_paths(gps1_path, gps2_path=None):
     """
-    Парсва mapping CSV (Камион;Шофьор)
-    Returns: dict { truck: driver_name }
+    Източниците за парсването. Process pool-ът приема само пътища, затова
+    при PARSE_WORKERS > 1 файловите обекти (качените файлове) се записват
+    във временни файлове, които се трият на изхода, и при грешка.
     """
-    mapping = {}
-    
-    # Опитваме се да отворим като CSV
+    sources = (gps1_path, gps2_path)
+    if PARSE_WORKERS <= 1 or not any(hasattr(source, 'read') for source in sources):
+        yield sources
+        return
+
+    created = []
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        # Детектираме delimiter (';' или ',')
-        delimiter = ';' if ';' in content.split('\n')[0] else ','
-        
-        lines = content.strip().split('\n')
-        for i, line in enumerate(lines):
-            if i == 0:  # Skip header
-                continue
-            
-            parts = line.split(delimiter)
-            if len(parts) >= 2:
-                truck = parts[0].strip()
-                driver = parts[1].strip()
-                mapping[truck] = driver
-    
-    except Exception as e:
-        print(f"Error parsing mapping: {e}")
-    
-    return mapping
+        paths = []
+        for source in sources:
+            if hasattr(source, 'read'):
+                fd, path = tempfile.mkstemp(prefix='jetom-upload-', suffix='.xlsx')
+                created.append(path)
+                with os.fdopen(fd, 'wb') as f:
+                    source.seek(0)
+                    shutil.copyfileobj(source, f)
+                source = path
+            paths.append(source)
+        yield paths
+    finally:
+        for path in created:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
 
-def build_travel_blocks(records):
-    """Построява travel blocks от GPS записи"""
-    by_truck = defaultdict(list)
-    for rec in records:
-        by_truck[rec['truck']].append(rec)
+def _report_stats(stats, rec_stats, report):
+    """
+    Добавя в stats отхвърлените редове и датите по бавния път по източник
+    (ParseReport) и data_quality - краткия отчет на проверките на записите
+    """
+    counts = report.to_dict()
+    quality = rec_stats.get('data_quality')
+    # По камиони отхвърлените редове влизат само в data_quality
+    counts.pop('rejected_trucks')
+    stats.update(counts)
+    if quality is not None:
+        quality.add_rejected(report.rejected_by_truck())
+        stats['data_quality'] = quality.summary()
+
+
+def run_pipeline(gps1_path, gps2_path=None, mapping_path=None, progress=NO_PROGRESS):
+    """
+    parse_* → build_travel_blocks → group_by_driver → редове за отговора
+    Файловете са пътища или seekable файлови обекти (качените файлове).
+    Returns: (result_data, stats)
+    """
+    # Парсваме и строим travel blocks
+    progress.start('build_blocks')
+    report = ParseReport()
+    with parse_pool_paths(gps1_path, gps2_path) as (gps1_path, gps2_path):
+        if HISTORY is not None:
+            open_records = make_record_source(gps1_path, gps2_path, progress=progress, report=report)
+            blocks, rec_stats = build_travel_blocks_incremental(open_records(), HISTORY)
+        elif STREAMING_INGEST or PARSE_WORKERS > 1:
+            open_records = make_record_source(gps1_path, gps2_path, progress=progress, report=report)
+            blocks, rec_stats = build_travel_blocks_streaming(open_records)
+        else:
+            progress.start('parse_gps1')
+            records = parse_gps1(gps1_path, report)
+            progress.done('parse_gps1', len(records))
+            if gps2_path:
+                progress.start('parse_gps2')
+                gps2_records = parse_gps2(gps2_path, report)
+                progress.done('parse_gps2', len(gps2_records))
+                records.extend(gps2_records)
+            rec_stats = record_stats(records)
+            blocks = build_travel_blocks(records, rec_stats)
+        if not gps2_path:
+            progress.done('parse_gps2', 0)
+    progress.done('build_blocks', sum(len(b) for b in blocks.values()))
+
+    # Парсваме mapping ако е качен
+    progress.start('parse_mapping')
+    mapping = parse_mapping(mapping_path, report) if mapping_path else DriverMapping()
+    progress.done('parse_mapping', len(mapping))
+
+    progress.start('group')
+    result_data, stats = serialize_result(blocks, mapping, rec_stats, progress)
+    _report_stats(stats, rec_stats, report)
+
+    return result_data, stats
+
+
+def _truck_rows(truck, blocks, mapping):
+    """
+    Редовете на един камион за поточния отговор (номерата са по камион),
+    със сумите eur_sum/bgn_sum като в /results
+    """
+    rows = []
+    for i, block in enumerate(blocks, 1):
+        if mapping:
+            for part, driver in split_block_by_driver(block, mapping):
+                rows.extend(_block_rows(driver or UNMAPPED_DRIVER, i, part))
+        else:
+            rows.extend(_block_rows(None, i, block))
+    for row in rows:
+        row['eur_sum'] = round(row['days'] * row['eur_rate'], 2)
+        row['bgn_sum'] = round(row['eur_sum'] * EUR_TO_BGN, 2)
+    return rows
+
+
+def stream_pipeline(gps1_path, gps2_path=None, mapping_path=None, progress=NO_PROGRESS):
+    """
+    Пайплайнът на run_pipeline като поток от съобщения за /process?stream=1:
+    {'type': 'start'}, после {'type': 'truck', 'truck', 'rows'} за всеки
+    камион, щом блоковете му са готови (повторно съобщение за същия камион
+    замества предишното), и накрая {'type': 'done', 'result_id', 'stats'}.
+    Окончателните редове (групирани и номерирани по шофьор) са в RESULTS
+    под result_id; целият отговор не се сглобява в паметта.
+    """
+    report = ParseReport()
+    progress.start('parse_mapping')
+    mapping = parse_mapping(mapping_path, report) if mapping_path else DriverMapping()
+    progress.done('parse_mapping', len(mapping))
+    yield {'type': 'start', 'has_mapping': bool(mapping)}
+
+    progress.start('build_blocks')
+    with parse_pool_paths(gps1_path, gps2_path) as (gps1_path, gps2_path):
+        open_records = make_record_source(gps1_path, gps2_path, progress=progress, report=report)
+        if HISTORY is not None:
+            # Инкременталното построяване дава блоковете накрая
+            blocks, rec_stats = build_travel_blocks_incremental(open_records(), HISTORY)
+            ready = sorted(blocks.items())
+        else:
+            # Камионите от GPS2 може да имат записи и в GPS1 - задържат се до края на GPS1
+            hold = set()
+            if gps1_path and gps2_path:
+                hold = {name.strip() for name in gps2_sheet_names(gps2_path)}
+            rec_stats = {}
+            blocks = {}
+            ready = iter_travel_blocks_streaming(open_records, rec_stats, hold)
+
+        for truck, truck_blocks in ready:
+            blocks[truck] = truck_blocks
+            yield {'type': 'truck', 'truck': truck, 'rows': _truck_rows(truck, truck_blocks, mapping)}
+    if not gps2_path:
+        progress.done('parse_gps2', 0)
+    progress.done('build_blocks', sum(len(b) for b in blocks.values()))
+
+    progress.start('group')
+    result_data, stats = serialize_result(blocks, mapping, rec_stats, progress)
+    _report_stats(stats, rec_stats, report)
+    result_id = RESULTS.put(result_data, stats)
+    yield {'type': 'done', 'result_id': result_id, 'result_url': f'/results/{result_id}', 'stats': stats}
+
+
+def _cache_counters():
+    """(hits, misses) на кешовете за RequestMetrics"""
+    country = COUNTRY_CLASSIFIER.cache_stats()
+    counters = {'country_cache': (country['hits'], country['misses'])}
+    if PARSE_CACHE:
+        counters['parse_cache'] = (PARSE_CACHE.hits, PARSE_CACHE.misses)
+    return counters
+
+
+def _result_response(result_data, stats, timings=None, paged=False):
+    """
+    Тялото на отговора на /process; резултатът се пази и в RESULTS за експорт
+    timings: RequestMetrics, ако клиентът е поискал timings=1
+    paged: без data - редовете се четат по страници от /results/<result_id>
+    """
+    result_id = RESULTS.put(result_data, stats)
+    response = {
+        'success': True,
+        'result_id': result_id,
+        'stats': stats
+    }
+    if paged:
+        response['result_url'] = f'/results/{result_id}'
+    else:
+        response['data'] = result_data
+    if timings is not None:
+        response['timings'] = timings.to_dict()
+    return response
+
+
+def _run_job(job, metrics, with_timings, paged, gps1_file, gps2_file, mapping_file):
+    """Фонова обработка; качените файлове (от _detach_upload) се затварят и при грешка"""
+    metrics.progress = job
+    try:
+        result_data, stats = run_pipeline(gps1_file, gps2_file, mapping_file, progress=metrics)
+    except Exception:
+        METRICS.observe('process', 'error', metrics.finish())
+        raise
+    finally:
+        for upload in (gps1_file, gps2_file, mapping_file):
+            if upload is not None:
+                upload.close()
+
+    METRICS.observe('process', 'ok', metrics.finish())
+    return _result_response(result_data, stats, metrics if with_timings else None, paged)
+
+
+def build_export_workbook(rows, has_mapping, engine=None):
+    """
+    Excel с командировките от редовете на /process (dicts с driver, truck,
+    start_date, end_date, days, eur_rate)
+    Returns: BytesIO
+    """
+    if (engine or EXPORT_ENGINE) == 'legacy':
+        return _build_export_workbook_legacy(rows, has_mapping)
+    return write_export(rows, has_mapping, EUR_TO_BGN)
+
+
+def _build_export_workbook_legacy(rows, has_mapping):
+    """Старият експорт: нормален workbook с целия sheet в паметта"""
+    # Създаваме workbook
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Командировки"
     
-    all_blocks = {}
+    # Header
+    if has_mapping:
+        headers = ['№', 'Шофьор', 'Камион', 'Дата от', 'Дата до', 'Дни', 'EUR/ден', 'Сума EUR', 'Сума BGN']
+    else:
+        headers = ['№', 'Камион', 'Дата от', 'Дата до', 'Дни', 'EUR/ден', 'Сума EUR', 'Сума BGN']
     
-    for truck, truck_records in by_truck.items():
-        truck_records.sort(key=lambda x: x['start_time'])
-        
-        blocks = []
-        current_block = None
+    # Стилизация на header
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+
+    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF", size=11)
+    border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+
+    # Пишем header
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = border
+
+    # Данни
+    row_num = 2
+    current_driver = None
+    driver_start_row = 2
+    row_counter = 1
+
+    driver_totals = defaultdict(lambda: {'days': 0, 'eur': 0, 'bgn': 0, 'blocks': 0})
+
+    for block in rows:
+        driver = block.get('driver') or block.get('truck')
+        truck = block.get('truck', '')
+        start_date = block.get('start_date', '').split(' ')[0]  # Само датата
+        end_date = block.get('end_date', '').split(' ')[0]
+        days = block.get('days', 0)
+        eur_rate = block.get('eur_rate', 43)
+        eur_sum = days * eur_rate
+        bgn_sum = eur_sum * EUR_TO_BGN
         
-        for rec in truck_records:
-            from_country = rec['from_country']
-            to_country = rec['to_country']
+        # Ако сменяме шофьор, добавяме подсума
+        if current_driver and driver != current_driver:
+            # Подсума за предишния шофьор
+            ws.merge_cells(f'A{row_num}:B{row_num}' if has_mapping else f'A{row_num}:A{row_num}')
+            subtotal_cell = ws.cell(row=row_num, column=1, value='За получаване')
+            subtotal_cell.font = Font(bold=True, size=11)
+            subtotal_cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
             
-            # България → Чужбина = START
-            if from_country == "България" and to_country != "България":
-                if current_block:
-                    blocks.append(current_block)
-                
-                current_block = {
-                    'start_date': rec['start_time'],
-                    'end_date': rec['end_time'],
-                    'country': to_country,
-                    'records': [rec]
-                }
+            col_offset = 3 if has_mapping else 2
+            totals = driver_totals[current_driver]
+            ws.cell(row=row_num, column=col_offset+2, value=totals['days']).font = Font(bold=True)
+            ws.cell(row=row_num, column=col_offset+4, value=totals['eur']).font = Font(bold=True)
+            ws.cell(row=row_num, column=col_offset+5, value=totals['bgn']).font = Font(bold=True)
             
-            # Чужбина → Чужбина = CONTINUE
-            elif from_country != "България" and to_country != "България":
-                if current_block:
-                    current_block['end_date'] = rec['end_time']
-                    current_block['country'] = to_country
-                    current_block['records'].append(rec)
-                else:
-                    current_block = {
-                        'start_date': rec['start_time'],
-                        'end_date': rec['end_time'],
-                        'country': to_country,
-                        'records': [rec]
-                    }
+            # Apply styling
+            for col in range(1, len(headers) + 1):
+                cell = ws.cell(row=row_num, column=col)
+                cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
+                cell.border = border
             
-            # Чужбина → България = END
-            elif from_country != "България" and to_country == "България":
-                if current_block:
-                    current_block['end_date'] = rec['start_time']
-                    current_block['records'].append(rec)
-                    blocks.append(current_block)
-                    current_block = None
+            row_num += 1
+            row_counter = 1
         
-        if current_block:
-            blocks.append(current_block)
+        # Данни за реда
+        if has_mapping:
+            values = [row_counter, driver if driver != current_driver else '', truck, start_date, end_date,
+                      days, eur_rate, eur_sum, bgn_sum]
+        else:
+            values = [row_counter, truck if driver != current_driver else '', start_date, end_date,
+                      days, eur_rate, eur_sum, bgn_sum]
         
-        # Изчисляваме дни
-        for block in blocks:
-            start = block['start_date']
-            end = block['end_date']
+        for col, value in enumerate(values, 1):
+            cell = ws.cell(row=row_num, column=col, value=value)
+            cell.border = border
             
-            if isinstance(start, datetime) and isinstance(end, datetime):
-                start_date = start.date()
-                end_date = end.date()
-                days = (end_date - start_date).days + 1
-                block['days'] = max(1, days)
+            # Bold за име на шофьор/камион
+            if col == 2 and value:
+                cell.font = Font(bold=True, size=11)
+
+            # Alignment
+            if col <= (3 if has_mapping else 2):
+                cell.alignment = Alignment(horizontal='left')
             else:
-                block['days'] = 1
+                cell.alignment = Alignment(horizontal='center')
             
-            if isinstance(start, datetime):
-                block['start_date_formatted'] = start.strftime('%d.%m.%Y')
-            if isinstance(end, datetime):
-                block['end_date_formatted'] = end.strftime('%d.%m.%Y')
+            # Format numbers
+            if col >= len(headers) - 1:  # EUR и BGN колони
+                cell.number_format = '#,##0.00'
         
-        all_blocks[truck] = blocks
-    
-    return all_blocks
-
+        # Accumulate totals
+        driver_totals[driver]['days'] += days
+        driver_totals[driver]['eur'] += eur_sum
+        driver_totals[driver]['bgn'] += bgn_sum
+        driver_totals[driver]['blocks'] += 1
 
-def group_by_driver(blocks, mapping):
-    """
-    Групира travel blocks по шофьор
-    Returns: dict { driver: [blocks] }
-    """
-    by_driver = defaultdict(list)
-    unmapped_trucks = []
+        current_driver = driver
+        row_num += 1
+        row_counter += 1
     
-    for truck, truck_blocks in blocks.items():
-        driver = mapping.get(truck)
+    # Последна подсума
+    if current_driver:
+        ws.merge_cells(f'A{row_num}:B{row_num}' if has_mapping else f'A{row_num}:A{row_num}')
+        subtotal_cell = ws.cell(row=row_num, column=1, value='За получаване')
+        subtotal_cell.font = Font(bold=True, size=11)
+        subtotal_cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
         
-        if driver:
-            for block in truck_blocks:
-                block_copy = block.copy()
-                block_copy['truck'] = truck
-                by_driver[driver].append(block_copy)
-        else:
-            unmapped_trucks.append(truck)
-            # Добавяме към "Неразпределени"
-            for block in truck_blocks:
-                block_copy = block.copy()
-                block_copy['truck'] = truck
-                by_driver['⚠️ Неразпределени'].append(block_copy)
+        col_offset = 3 if has_mapping else 2
+        totals = driver_totals[current_driver]
+        ws.cell(row=row_num, column=col_offset+2, value=totals['days']).font = Font(bold=True)
+        ws.cell(row=row_num, column=col_offset+4, value=totals['eur']).font = Font(bold=True)
+        ws.cell(row=row_num, column=col_offset+5, value=totals['bgn']).font = Font(bold=True)
+
+        for col in range(1, len(headers) + 1):
+            cell = ws.cell(row=row_num, column=col)
+            cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
+            cell.border = border
     
-    # Сортираме блоковете по дата за всеки шофьор
-    for driver in by_driver:
-        by_driver[driver].sort(key=lambda x: x['start_date'])
+    # Adjust column widths
+    ws.column_dimensions['A'].width = 5
+    ws.column_dimensions['B'].width = 20
+    if has_mapping:
+        ws.column_dimensions['C'].width = 12
+        ws.column_dimensions['D'].width = 12
+        ws.column_dimensions['E'].width = 12
+    else:
+        ws.column_dimensions['C'].width = 12
+        ws.column_dimensions['D'].width = 12
     
-    return dict(by_driver), unmapped_trucks
+    # Save to BytesIO
+    excel_file = io.BytesIO()
+    wb.save(excel_file)
+    excel_file.seek(0)
+
+    return excel_file
 
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', stream_uploads=STREAM_UPLOADS)
+
+
+@app.route('/cache-stats')
+def cache_stats():
+    """Статистика на кеша на парсера, кеша на държавите и историята"""
+    return jsonify({
+        'parse_cache': PARSE_CACHE.stats() if PARSE_CACHE else None,
+        'country_cache': COUNTRY_CLASSIFIER.cache_stats(),
+        'history': HISTORY.stats() if HISTORY else None
+    })
 
 
 @app.route('/process', methods=['POST'])
 def process_files():
-    """Обработка на качените файлове"""
+    """
+    Обработка на качените файлове
+    С async=1 (form или query) обработката минава във фонов режим и
+    отговорът е само job_id за /jobs/<job_id>.
+    С timings=1 отговорът съдържа и времената по етапи (блок timings).
+    С paged=1 отговорът е без data; редовете са в /results/<result_id>.
+    Със stream=1 отговорът е NDJSON (stream_pipeline): редовете на всеки
+    камион идват, щом са готови, а последният ред е статистиката.
+    Заявка над MAX_UPLOAD_MB се отказва с 413, преди да се парсва, а GPS
+    файл, който не е нито .xlsx, нито CSV - с 400.
+    """
+    metrics = RequestMetrics(caches=_cache_counters)
     try:
-        # Проверка за файлове
+        # Приемането на multipart тялото (файловете остават в паметта до
+        # UPLOAD_SPOOL_MB на файл)
+        metrics.start('receive_upload')
         if 'gps1_file' not in request.files:
             return jsonify({'error': 'Моля качете GPS Система 1 файл'}), 400
-        
+
         gps1_file = request.files['gps1_file']
         gps2_file = request.files.get('gps2_file')
         mapping_file = request.files.get('mapping_file')
-        
+
         if gps1_file.filename == '':
             return jsonify({'error': 'Моля качете GPS Система 1 файл'}), 400
-        
-        # Записваме временно файловете
-        temp_dir = tempfile.mkdtemp()
-        
-        gps1_path = os.path.join(temp_dir, 'gps1.xlsx')
-        gps1_file.save(gps1_path)
-        
-        # Парсваме GPS1
-        records = parse_gps1(gps1_path)
-        
-        # Парсваме GPS2 ако е качен
-        if gps2_file and gps2_file.filename:
-            gps2_path = os.path.join(temp_dir, 'gps2.xlsx')
-            gps2_file.save(gps2_path)
-            records.extend(parse_gps2(gps2_path))
-        
-        # Парсваме mapping ако е качен
-        mapping = {}
-        if mapping_file and mapping_file.filename:
-            mapping_path = os.path.join(temp_dir, 'mapping.csv')
-            mapping_file.save(mapping_path)
-            mapping = parse_mapping(mapping_path)
-        
-        # Строим travel blocks
-        blocks = build_travel_blocks(records)
-        
-        # Ако има mapping, групираме по шофьор
-        if mapping:
-            by_driver, unmapped = group_by_driver(blocks, mapping)
-            result_data = []
-            
-            for driver in sorted(by_driver.keys()):
-                driver_blocks = by_driver[driver]
-                
-                for i, block in enumerate(driver_blocks, 1):
-                    result_data.append({
-                        'driver': driver,
-                        'truck': block['truck'],
-                        'block_num': i,
-                        'start_date': block['start_date'].strftime('%d.%m.%Y %H:%M') if isinstance(block['start_date'], datetime) else str(block['start_date']),
-                        'end_date': block['end_date'].strftime('%d.%m.%Y %H:%M') if isinstance(block['end_date'], datetime) else str(block['end_date']),
-                        'country': block['country'],
-                        'days': block['days'],
-                        'eur_rate': DEFAULT_EUR_RATE.get(block['country'], 43),
-                        'records_count': len(block['records'])
-                    })
-            
-            # Статистика
-            total_drivers = len([d for d in by_driver.keys() if d != '⚠️ Неразпределени'])
-            total_blocks_mapped = sum(len(b) for d, b in by_driver.items() if d != '⚠️ Неразпределени')
-            
-            stats = {
-                'total_records': len(records),
-                'abroad_records': sum(1 for r in records if r['to_country'] != 'България'),
-                'abroad_percentage': round(sum(1 for r in records if r['to_country'] != 'България') / len(records) * 100, 1) if len(records) > 0 else 0,
-                'total_trucks': len(blocks),
-                'trucks_with_travel': len([t for t, b in blocks.items() if len(b) > 0]),
-                'total_blocks': sum(len(b) for b in blocks.values()),
-                'total_drivers': total_drivers,
-                'unmapped_trucks': unmapped,
-                'has_mapping': True
-            }
-        
-        else:
-            # Без mapping - показваме по камиони
-            result_data = []
-            for truck in sorted(blocks.keys()):
-                truck_blocks = blocks[truck]
-                if len(truck_blocks) == 0:
-                    continue
-                
-                for i, block in enumerate(truck_blocks, 1):
-                    result_data.append({
-                        'driver': None,
-                        'truck': truck,
-                        'block_num': i,
-                        'start_date': block['start_date'].strftime('%d.%m.%Y %H:%M') if isinstance(block['start_date'], datetime) else str(block['start_date']),
-                        'end_date': block['end_date'].strftime('%d.%m.%Y %H:%M') if isinstance(block['end_date'], datetime) else str(block['end_date']),
-                        'country': block['country'],
-                        'days': block['days'],
-                        'eur_rate': DEFAULT_EUR_RATE.get(block['country'], 43),
-                        'records_count': len(block['records'])
-                    })
-            
-            stats = {
-                'total_records': len(records),
-                'abroad_records': sum(1 for r in records if r['to_country'] != 'България'),
-                'abroad_percentage': round(sum(1 for r in records if r['to_country'] != 'България') / len(records) * 100, 1) if len(records) > 0 else 0,
-                'total_trucks': len(blocks),
-                'trucks_with_travel': len([t for t, b in blocks.items() if len(b) > 0]),
-                'total_blocks': sum(len(b) for b in blocks.values()),
-                'has_mapping': False
-            }
-        
-        # Почистваме временните файлове
-        import shutil
-        shutil.rmtree(temp_dir)
-        
-        return jsonify({
-            'success': True,
-            'stats': stats,
-            'data': result_data
-        })
-        
+
+        # Непознат формат се отказва веднага, а не с грешката на openpyxl
+        for label, upload in (('GPS Система 1', gps1_file), ('GPS Система 2', gps2_file)):
+            stream = _upload_stream(upload)
+            if stream is not None and not (is_xlsx(stream) or is_csv(stream)):
+                return jsonify({'error': f'{label}: файлът {upload.filename} не е .xlsx '
+                                         f'или CSV експорт'}), 400
+
+        run_async = (request.form.get('async') or request.args.get('async')) == '1'
+        with_timings = (request.form.get('timings') or request.args.get('timings')) == '1'
+        paged = (request.form.get('paged') or request.args.get('paged')) == '1'
+        stream = (request.form.get('stream') or request.args.get('stream')) == '1'
+        metrics.done('receive_upload')
+
+        # Файловете се парсват направо от потоците на заявката (UploadRequest)
+        if run_async:
+            # Request-ът затваря файловете си в края на заявката
+            gps1_source, gps2_source, mapping_source = (
+                _detach_upload(f) for f in (gps1_file, gps2_file, mapping_file))
+            job = JOBS.submit(PIPELINE_STAGES, _run_job, metrics, with_timings, paged,
+                              gps1_source, gps2_source, mapping_source)
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status_url': f'/jobs/{job.id}',
+                'result_url': f'/jobs/{job.id}/result'
+            }), 202
+
+        gps1_source, gps2_source, mapping_source = (
+            _upload_stream(f) for f in (gps1_file, gps2_file, mapping_file))
+
+        if stream:
+            return Response(stream_with_context(_stream_process(
+                metrics, with_timings, gps1_source, gps2_source, mapping_source)),
+                mimetype='application/x-ndjson')
+
+        result_data, stats = run_pipeline(gps1_source, gps2_source, mapping_source, progress=metrics)
+
+        METRICS.observe('process', 'ok', metrics.finish())
+        return jsonify(_result_response(result_data, stats, metrics if with_timings else None, paged))
+
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Файловете са по-големи от {MAX_UPLOAD_MB} MB'}), 413
+
     except Exception as e:
         traceback.print_exc()
+        METRICS.observe('process', 'error', metrics.finish())
         return jsonify({'error': f'Грешка при обработка: {str(e)}'}), 500
 
 
+def _upload_stream(file_storage):
+    """Потокът на качен файл в началото си или None, ако файлът не е качен"""
+    if file_storage is None or not file_storage.filename:
+        return None
+    file_storage.stream.seek(0)
+    return file_storage.stream
+
+
+def _detach_upload(file_storage):
+    """
+    Потокът на качен файл за фонова задача. Request-ът затваря файловете си
+    в края на заявката, затова на мястото на потока остава празен буфер, а
+    потокът се затваря от задачата.
+    """
+    stream = _upload_stream(file_storage)
+    if stream is not None:
+        file_storage.stream = io.BytesIO()
+    return stream
+
+
+def _stream_process(metrics, with_timings, gps1_path, gps2_path, mapping_path):
+    """NDJSON редовете на /process?stream=1; грешката е последен ред {'type': 'error'}"""
+    try:
+        for message in stream_pipeline(gps1_path, gps2_path, mapping_path, progress=metrics):
+            if message['type'] == 'done':
+                METRICS.observe('process', 'ok', metrics.finish())
+                if with_timings:
+                    message['timings'] = metrics.to_dict()
+            yield app.json.dumps(message) + '\n'
+    except Exception as e:
+        traceback.print_exc()
+        METRICS.observe('process', 'error', metrics.finish())
+        yield app.json.dumps({'type': 'error', 'error': f'Грешка при обработка: {str(e)}'}) + '\n'
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Статус и прогрес по етапи на фонова обработка"""
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Няма такава задача'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Резултатът на фонова обработка (202, докато не е готов)"""
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Няма такава задача'}), 404
+    if job.status == ERROR:
+        return jsonify({'error': f'Грешка при обработка: {job.error}'}), 500
+    if job.status != DONE:
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.result)
+
+
+def _stored_result_query(result_id):
+    """(StoredResult, ResultQuery) от URL-а или (None, отговор с грешка)"""
+    result = RESULTS.get(result_id)
+    if result is None:
+        return None, (jsonify({'error': 'Резултатът е изтекъл. Моля обработете файловете отново.'}), 404)
+    try:
+        return result, ResultQuery.from_args(request.args)
+    except ValueError as e:
+        return None, (jsonify({'error': f'Невалидни параметри: {str(e)}'}), 400)
+
+
+@app.route('/results/<result_id>')
+def result_page(result_id):
+    """
+    Страница от редовете на резултат от /process
+    Параметри: page, per_page (до 500), sort (поле, с "-" за обратен ред),
+    driver, truck, country, date_from, date_to (YYYY-MM-DD).
+    Сумите по шофьор са за шофьорите от страницата, totals - за всички
+    филтрирани редове.
+    """
+    result, query = _stored_result_query(result_id)
+    if result is None:
+        return query
+    page = result.query(query, EUR_TO_BGN)
+    page['countries'] = result.countries()
+    page['has_mapping'] = result.stats.get('has_mapping', False)
+    return jsonify(page)
+
+
+@app.route('/results/<result_id>/drivers')
+def result_drivers(result_id):
+    """Сумите по шофьор (дни, EUR, BGN) за всички филтрирани редове"""
+    result, query = _stored_result_query(result_id)
+    if result is None:
+        return query
+    return jsonify({'result_id': result.id, 'drivers': result.driver_totals(query, EUR_TO_BGN)})
+
+
+def _with_rate(row, number):
+    """
+    Ред от клиента без eur_rate получава ставката за държавата си и началната дата.
+    ValueError с номера на реда (number), ако датата липсва или е невалидна.
+    """
+    if row.get('eur_rate') is not None:
+        return row
+    start_date = row.get('start_date')
+    try:
+        day = datetime.strptime(str(start_date or '').split(' ')[0], '%d.%m.%Y')
+    except ValueError:
+        raise ValueError(f'ред {number}: невалидна начална дата {start_date!r}') from None
+    return dict(row, eur_rate=PER_DIEM_RATES.rate(_country_code(row.get('country')), day))
+
+
 @app.route('/export-excel', methods=['POST'])
 def export_excel():
-    """Генерира Excel файл с командировките"""
+    """
+    Генерира Excel файл с командировките
+    Очаква result_id от /process (+ edits: [{index, days, eur_rate}]);
+    старият формат с целия масив data също се приема.
+    """
+    metrics = RequestMetrics()
     try:
-        data = request.json.get('data', [])
-        has_mapping = request.json.get('has_mapping', False)
-        
-        # Създаваме workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Командировки"
-        
-        # Header
-        if has_mapping:
-            headers = ['№', 'Шофьор', 'Камион', 'Дата от', 'Дата до', 'Дни', 'EUR/ден', 'Сума EUR', 'Сума BGN']
-        else:
-            headers = ['№', 'Камион', 'Дата от', 'Дата до', 'Дни', 'EUR/ден', 'Сума EUR', 'Сума BGN']
-        
-        # Стилизация на header
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=11)
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        # Пишем header
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = border
-        
-        # Данни
-        row_num = 2
-        current_driver = None
-        driver_start_row = 2
-        row_counter = 1
-        
-        driver_totals = defaultdict(lambda: {'days': 0, 'eur': 0, 'bgn': 0, 'blocks': 0})
-        
-        for block in data:
-            driver = block.get('driver') or block.get('truck')
-            truck = block.get('truck', '')
-            start_date = block.get('start_date', '').split(' ')[0]  # Само датата
-            end_date = block.get('end_date', '').split(' ')[0]
-            days = block.get('days', 0)
-            eur_rate = block.get('eur_rate', 43)
-            eur_sum = days * eur_rate
-            bgn_sum = eur_sum * EUR_TO_BGN
-            
-            # Ако сменяме шофьор, добавяме подсума
-            if current_driver and driver != current_driver:
-                # Подсума за предишния шофьор
-                ws.merge_cells(f'A{row_num}:B{row_num}' if has_mapping else f'A{row_num}:A{row_num}')
-                subtotal_cell = ws.cell(row=row_num, column=1, value='За получаване')
-                subtotal_cell.font = Font(bold=True, size=11)
-                subtotal_cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-                
-                col_offset = 3 if has_mapping else 2
-                ws.cell(row=row_num, column=col_offset+2, value=driver_totals[current_driver]['days']).font = Font(bold=True)
-                ws.cell(row=row_num, column=col_offset+4, value=driver_totals[current_driver]['eur']).font = Font(bold=True)
-                ws.cell(row=row_num, column=col_offset+5, value=driver_totals[current_driver]['bgn']).font = Font(bold=True)
-                
-                # Apply styling
-                for col in range(1, len(headers) + 1):
-                    cell = ws.cell(row=row_num, column=col)
-                    cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-                    cell.border = border
-                
-                row_num += 1
-                row_counter = 1
-            
-            # Данни за реда
-            if has_mapping:
-                values = [row_counter, driver if driver != current_driver else '', truck, start_date, end_date, days, eur_rate, eur_sum, bgn_sum]
-            else:
-                values = [row_counter, truck if driver != current_driver else '', start_date, end_date, days, eur_rate, eur_sum, bgn_sum]
-            
-            for col, value in enumerate(values, 1):
-                cell = ws.cell(row=row_num, column=col, value=value)
-                cell.border = border
-                
-                # Bold за име на шофьор/камион
-                if col == 2 and value:
-                    cell.font = Font(bold=True, size=11)
-                
-                # Alignment
-                if col <= (3 if has_mapping else 2):
-                    cell.alignment = Alignment(horizontal='left')
-                else:
-                    cell.alignment = Alignment(horizontal='center')
-                
-                # Format numbers
-                if col >= len(headers) - 1:  # EUR и BGN колони
-                    cell.number_format = '#,##0.00'
-            
-            # Accumulate totals
-            driver_totals[driver]['days'] += days
-            driver_totals[driver]['eur'] += eur_sum
-            driver_totals[driver]['bgn'] += bgn_sum
-            driver_totals[driver]['blocks'] += 1
-            
-            current_driver = driver
-            row_num += 1
-            row_counter += 1
-        
-        # Последна подсума
-        if current_driver:
-            ws.merge_cells(f'A{row_num}:B{row_num}' if has_mapping else f'A{row_num}:A{row_num}')
-            subtotal_cell = ws.cell(row=row_num, column=1, value='За получаване')
-            subtotal_cell.font = Font(bold=True, size=11)
-            subtotal_cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-            
-            col_offset = 3 if has_mapping else 2
-            ws.cell(row=row_num, column=col_offset+2, value=driver_totals[current_driver]['days']).font = Font(bold=True)
-            ws.cell(row=row_num, column=col_offset+4, value=driver_totals[current_driver]['eur']).font = Font(bold=True)
-            ws.cell(row=row_num, column=col_offset+5, value=driver_totals[current_driver]['bgn']).font = Font(bold=True)
-            
-            for col in range(1, len(headers) + 1):
-                cell = ws.cell(row=row_num, column=col)
-                cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-                cell.border = border
-        
-        # Adjust column widths
-        ws.column_dimensions['A'].width = 5
-        ws.column_dimensions['B'].width = 20
-        if has_mapping:
-            ws.column_dimensions['C'].width = 12
-            ws.column_dimensions['D'].width = 12
-            ws.column_dimensions['E'].width = 12
+        payload = request.json or {}
+
+        if payload.get('result_id'):
+            result = RESULTS.get(payload['result_id'])
+            if result is None:
+                return jsonify({'error': 'Резултатът е изтекъл. Моля обработете файловете отново.'}), 404
+            try:
+                edits = parse_edits(payload.get('edits'), len(result.rows))
+            except (KeyError, TypeError, ValueError) as e:
+                return jsonify({'error': f'Невалидни корекции: {str(e)}'}), 400
+            rows = result.iter_rows(edits)
+            row_count = len(result.rows)
+            has_mapping = result.stats.get('has_mapping', False)
         else:
-            ws.column_dimensions['C'].width = 12
-            ws.column_dimensions['D'].width = 12
-        
-        # Save to BytesIO
-        excel_file = io.BytesIO()
-        wb.save(excel_file)
-        excel_file.seek(0)
-        
+            try:
+                rows = [_with_rate(row, number)
+                        for number, row in enumerate(payload.get('data', []), 1)]
+            except ValueError as e:
+                return jsonify({'error': f'Невалидни данни: {str(e)}'}), 400
+            row_count = len(rows)
+            has_mapping = payload.get('has_mapping', False)
+
+        metrics.start('export')
+        excel_file = build_export_workbook(rows, has_mapping)
+        metrics.done('export', row_count)
+        METRICS.observe('export', 'ok', metrics.finish())
+
         # Генерираме име на файл с дата
         from datetime import datetime as dt
         filename = f"Командировки_{dt.now().strftime('%Y_%m')}.xlsx"
@@ -581,8 +2146,25 @@ def export_excel():
         
     except Exception as e:
         traceback.print_exc()
+        METRICS.observe('export', 'error', metrics.finish())
         return jsonify({'error': f'Грешка при генериране на Excel: {str(e)}'}), 500
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики по етапи, заявки и кешове във формата на Prometheus"""
+    country = COUNTRY_CLASSIFIER.cache_stats()
+    gauges = {
+        'country_cache_entries': country['size'],
+        'jobs_active': JOBS.active_count(),
+        'results_stored_rows': RESULTS.stats()['rows'],
+    }
+    if PARSE_CACHE:
+        parse_cache = PARSE_CACHE.stats()
+        gauges['parse_cache_entries'] = parse_cache['entries']
+        gauges['parse_cache_bytes'] = parse_cache['bytes']
+    return METRICS.render(gauges), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
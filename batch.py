@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Обработка на много комплекти GPS файлове без уеб интерфейса.
+
+Комплект е GPS1 файл (задължителен), GPS2 файл и mapping CSV (по избор) -
+напр. един клон за един месец. Комплектите се подават като:
+- директория: всяка поддиректория (или самата директория) с файл gps1*
+  (.xlsx или .csv) е комплект с име на поддиректорията; gps2* до него е
+  GPS2, а друг *.csv - mapping;
+- manifest (.json): списък от {"name", "gps1", "gps2", "mapping"}, пътищата
+  са спрямо manifest-а.
+
+Всеки комплект минава през run_pipeline (parse_* → build_travel_blocks →
+group_by_driver) в отделен процес от пула, а експортът му (Excel и/или
+CSV) се записва в --out. Накрая се записва summary.csv с по един ред на
+комплект (блокове, шофьори, дни, EUR, BGN, грешка). Историята
+(JETOM_HISTORY_DB) не се ползва - всеки комплект е самостоятелен.
+
+Код на изход: 0 при успех, 1 ако някой комплект е с грешка.
+
+    python batch.py /data/2025-11 --out /data/reports --workers 4 --format both
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+FORMATS = ('xlsx', 'csv', 'both')
+
+# Разширения на GPS файловете в директория с комплект
+GPS_SUFFIXES = ('.xlsx', '.csv')
+
+SUMMARY_FIELDS = ('set', 'status', 'blocks', 'drivers', 'trucks', 'days', 'eur', 'bgn',
+                  'rejected_rows', 'quality_issues', 'seconds', 'outputs', 'error')
+
+CSV_FIELDS = ('driver', 'truck', 'block_num', 'start_date', 'end_date', 'country',
+              'days', 'eur_rate', 'eur_sum', 'bgn_sum', 'records_count')
+
+
+class FileSet:
+    __slots__ = ('name', 'gps1', 'gps2', 'mapping')
+
+    def __init__(self, name, gps1, gps2=None, mapping=None):
+        self.name = name
+        self.gps1 = gps1
+        self.gps2 = gps2
+        self.mapping = mapping
+
+
+def _pick(directory, files, prefix, suffixes):
+    matches = sorted(f for f in files if f.lower().startswith(prefix) and f.lower().endswith(suffixes))
+    return os.path.join(directory, matches[0]) if matches else None
+
+
+def _dir_set(name, directory):
+    files = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
+    gps1 = _pick(directory, files, 'gps1', GPS_SUFFIXES)
+    if gps1 is None:
+        return None
+    # Mapping е CSV, което не е GPS файл
+    others = [f for f in files if not f.lower().startswith(('gps1', 'gps2'))]
+    return FileSet(name, gps1, _pick(directory, files, 'gps2', GPS_SUFFIXES),
+                   _pick(directory, others, '', ('.csv',)))
+
+
+def discover_sets(path):
+    """
+    Комплектите от директория или manifest (.json)
+    ValueError при празен или невалиден вход
+    """
+    if os.path.isdir(path):
+        sets = []
+        own = _dir_set(os.path.basename(os.path.abspath(path)), path)
+        if own is not None:
+            sets.append(own)
+        for entry in sorted(os.listdir(path)):
+            directory = os.path.join(path, entry)
+            if os.path.isdir(directory):
+                found = _dir_set(entry, directory)
+                if found is not None:
+                    sets.append(found)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        resolve = lambda value: os.path.join(base, value) if value else None
+        sets = []
+        for i, entry in enumerate(entries, 1):
+            if not entry.get('gps1'):
+                raise ValueError(f'Комплект {i} в {path} е без gps1')
+            sets.append(FileSet(entry.get('name') or f'set{i}', resolve(entry['gps1']),
+                                resolve(entry.get('gps2')), resolve(entry.get('mapping'))))
+
+    if not sets:
+        raise ValueError(f'Няма комплекти с gps1*.xlsx или gps1*.csv в {path}')
+    names = [s.name for s in sets]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f'Повтарящи се имена на комплекти: {", ".join(duplicates)}')
+    return sets
+
+
+def write_rows_csv(path, rows, eur_to_bgn):
+    """Редовете на комплекта като CSV (';', UTF-8 с BOM за Excel)"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(CSV_FIELDS)
+        for row in rows:
+            eur_sum = row['days'] * row['eur_rate']
+            writer.writerow([row['driver'] or '', row['truck'], row['block_num'],
+                             row['start_date'], row['end_date'], row['country'], row['days'],
+                             row['eur_rate'], f'{eur_sum:.2f}', f'{eur_sum * eur_to_bgn:.2f}',
+                             row['records_count']])
+
+
+def _init_worker():
+    # Комплектите са независими - без обща история между тях
+    os.environ.pop('JETOM_HISTORY_DB', None)
+
+
+def process_set(file_set, out_dir, fmt):
+    """Обработва един комплект и записва експорта му. Returns: ред за summary"""
+    import app
+
+    started = time.perf_counter()
+    summary = {'set': file_set.name, 'status': 'ok', 'outputs': []}
+    try:
+        rows, stats = app.run_pipeline(file_set.gps1, file_set.gps2, file_set.mapping)
+
+        if fmt in ('xlsx', 'both'):
+            path = os.path.join(out_dir, f'{file_set.name}.xlsx')
+            excel_file = app.build_export_workbook(rows, stats.get('has_mapping', False))
+            with open(path, 'wb') as f:
+                f.write(excel_file.getbuffer())
+            summary['outputs'].append(path)
+        if fmt in ('csv', 'both'):
+            path = os.path.join(out_dir, f'{file_set.name}.csv')
+            write_rows_csv(path, rows, app.EUR_TO_BGN)
+            summary['outputs'].append(path)
+
+        eur = sum(row['days'] * row['eur_rate'] for row in rows)
+        summary.update(
+            blocks=stats['total_blocks'],
+            drivers=stats.get('total_drivers', ''),
+            trucks=stats['trucks_with_travel'],
+            days=sum(row['days'] for row in rows),
+            eur=round(eur, 2),
+            bgn=round(eur * app.EUR_TO_BGN, 2),
+            rejected_rows=sum(stats.get('rejected_rows', {}).values()),
+            quality_issues=sum(stats.get('data_quality', {}).get('issues', {}).values()))
+    except Exception as e:
+        traceback.print_exc()
+        summary.update(status='error', error=f'{type(e).__name__}: {e}')
+    summary['seconds'] = round(time.perf_counter() - started, 2)
+    return summary
+
+
+def write_summary(path, summaries):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, SUMMARY_FIELDS, delimiter=';', restval='')
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow(dict(summary, outputs=' '.join(summary['outputs'])))
+
+
+def run_batch(sets, out_dir, workers=1, fmt='xlsx'):
+    """
+    Обработва комплектите (в process pool при workers > 1)
+    Returns: редовете за summary по реда на sets
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if workers <= 1:
+        _init_worker()
+        return [process_set(file_set, out_dir, fmt) for file_set in sets]
+
+    by_name = {}
+    # spawn, както пула за парсване в app.py
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker) as pool:
+        futures = {pool.submit(process_set, file_set, out_dir, fmt): file_set for file_set in sets}
+        for future in as_completed(futures):
+            file_set = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                # Процесът е умрял (напр. без памет) - комплектът е с грешка
+                summary = {'set': file_set.name, 'status': 'error', 'outputs': [],
+                           'error': f'{type(e).__name__}: {e}'}
+            by_name[file_set.name] = summary
+            print(f'{summary["set"]}: {summary["status"]}', file=sys.stderr)
+    return [by_name[file_set.name] for file_set in sets]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help='директория с комплекти или manifest (.json)')
+    parser.add_argument('--out', required=True, help='директория за експортите и summary.csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--format', choices=FORMATS, default='xlsx')
+    args = parser.parse_args(argv)
+
+    try:
+        sets = discover_sets(args.input)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    summaries = run_batch(sets, args.out, min(args.workers, len(sets)), args.format)
+    summary_path = os.path.join(args.out, 'summary.csv')
+    write_summary(summary_path, summaries)
+
+    print(f'{"set":<24} {"status":<7} {"blocks":>7} {"days":>7} {"EUR":>12} {"BGN":>12}')
+    for s in summaries:
+        print(f'{s["set"]:<24} {s["status"]:<7} {s.get("blocks", ""):>7} {s.get("days", ""):>7} '
+              f'{s.get("eur", ""):>12} {s.get("bgn", ""):>12}')
+    failed = [s for s in summaries if s['status'] != 'ok']
+    for s in failed:
+        print(f'FAIL {s["set"]}: {s["error"]}')
+    print(f'Summary: {summary_path}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
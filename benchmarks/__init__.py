@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Бенчмаркове на калкулатора (python -m benchmarks.<име>)"""
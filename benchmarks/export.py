@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк на Excel експорта: стария (legacy) срещу поточния (streaming).
+
+Всеки експорт върви в отделен процес, за да е пикът на паметта (ru_maxrss)
+само негов. Редовете се генерират поточно, така че в паметта остава само
+това, което задържа самият експорт.
+
+    python -m benchmarks.export --rows 100000
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+
+ENGINES = ('legacy', 'streaming')
+
+
+def synthetic_rows(count, blocks_per_driver=12, has_mapping=True):
+    """Генератор на редове като тези от /process"""
+    rates = (43, 46, 43.5)
+    for i in range(count):
+        driver_idx = i // blocks_per_driver
+        day = 1 + i % 28
+        yield {
+            'driver': f'Шофьор {driver_idx}' if has_mapping else None,
+            'truck': f'CB{1000 + driver_idx}AB',
+            'start_date': f'{day:02d}.11.2025',
+            'end_date': f'{min(day + 2, 30):02d}.11.2025',
+            'days': 1 + i % 5,
+            'eur_rate': rates[i % len(rates)],
+        }
+
+
+def _peak_rss_mb():
+    # На Linux ru_maxrss е в KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_engine(engine, rows, has_mapping):
+    from app import build_export_workbook
+
+    before = _peak_rss_mb()
+    started = time.perf_counter()
+    excel_file = build_export_workbook(synthetic_rows(rows, has_mapping=has_mapping), has_mapping, engine)
+    seconds = time.perf_counter() - started
+    return {
+        'engine': engine,
+        'seconds': round(seconds, 2),
+        'rows_per_sec': round(rows / seconds),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'rss_growth_mb': round(_peak_rss_mb() - before, 1),
+        'file_kb': len(excel_file.getbuffer()) // 1024,
+    }
+
+
+def run(rows, engines=ENGINES, has_mapping=True):
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for engine in engines:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(_run_engine, (engine, rows, has_mapping)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--engine', choices=ENGINES, action='append')
+    parser.add_argument('--no-mapping', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.engine or ENGINES, not args.no_mapping)
+    print(f'{"engine":<10} {"sec":>8} {"rows/s":>9} {"peak MB":>9} {"+MB":>8} {"KB":>8}')
+    for r in results:
+        print(f'{r["engine"]:<10} {r["seconds"]:>8} {r["rows_per_sec"]:>9} '
+              f'{r["peak_rss_mb"]:>9} {r["rss_growth_mb"]:>8} {r["file_kb"]:>8}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
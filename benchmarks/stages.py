@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк на етапите на /process поотделно.
+
+Данните се генерират с benchmarks.synthetic (или се подават готови с
+--data-dir), после всеки етап се мери отделно: parse_gps1, parse_gps2,
+detect_country (с изчистен кеш), build_travel_blocks, group_by_driver,
+сериализацията на отговора на /process и export_excel. За всеки етап се
+отчита най-доброто време от --repeat изпълнения и пикът на паметта
+(tracemalloc) при едно допълнително изпълнение.
+
+С --workers N > 1 се мери и parse_gps2_parallel (GPS2 в process pool с N
+workers, виж app.parallel_record_streams) и се отпечатва ускорението
+спрямо parse_gps2. Етапът зависи от броя процесори, затова не влиза в
+baseline; пикът на паметта е само за основния процес.
+
+С --check резултатите се сравняват с baseline.json за същия мащаб и
+командата завършва с код 1, ако някой етап е по-бавен или по-тежък от
+допустимото. --save-baseline записва текущите резултати като baseline.
+
+    python -m benchmarks.stages --trucks 100 --trips 10 --months 2 --check
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import synthetic
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Допустимо превишение спрямо baseline (0.5 = до 50% повече) плюс абсолютен
+# толеранс, за да не падат много кратките етапи от шум
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.2
+TIME_SLACK = 0.005
+MEMORY_SLACK_MB = 0.1
+
+
+def _stage_parse_gps1(app, ctx):
+    ctx['gps1_records'] = app.parse_gps1(ctx['gps1'])
+
+
+def _stage_parse_gps2(app, ctx):
+    ctx['gps2_records'] = app.parse_gps2(ctx['gps2'])
+
+
+def _stage_parse_gps2_parallel(app, ctx):
+    records = list(app.iter_records_parallel(None, ctx['gps2'], workers=ctx['workers']))
+    if len(records) != len(ctx['gps2_records']):
+        raise AssertionError(f'parse_gps2_parallel: {len(records)} записа вместо '
+                             f'{len(ctx["gps2_records"])}')
+
+
+def _stage_detect_country(app, ctx):
+    app.COUNTRY_CLASSIFIER.clear_cache()
+    detect_country = app.detect_country
+    for addr in ctx['addresses']:
+        detect_country(addr)
+
+
+def _stage_build_travel_blocks(app, ctx):
+    ctx['blocks'] = app.build_travel_blocks(ctx['records'])
+
+
+def _stage_group_by_driver(app, ctx):
+    app.group_by_driver(ctx['blocks'], ctx['mapping'])
+
+
+def _stage_serialize(app, ctx):
+    result_data, stats = app.serialize_result(ctx['blocks'], ctx['mapping'], ctx['record_stats'])
+    app.app.json.dumps({'success': True, 'stats': stats, 'data': result_data})
+    ctx['rows'] = result_data
+
+
+def _stage_export_excel(app, ctx):
+    app.build_export_workbook(ctx['rows'], bool(ctx['mapping']))
+
+
+def _prepare_records(app, ctx):
+    ctx['records'] = ctx['gps1_records'] + ctx['gps2_records']
+    ctx['record_stats'] = app.record_stats(ctx['records'])
+    ctx['addresses'] = [addr for rec in ctx['records'] for addr in (rec.from_addr, rec.to_addr)]
+    ctx['mapping'] = app.parse_mapping(ctx['mapping_path'])
+
+
+# (име, етап, подготовка след етапа); редът е редът на пайплайна
+STAGES = [
+    ('parse_gps1', _stage_parse_gps1, None),
+    ('parse_gps2', _stage_parse_gps2, _prepare_records),
+    ('detect_country', _stage_detect_country, None),
+    ('build_travel_blocks', _stage_build_travel_blocks, None),
+    ('group_by_driver', _stage_group_by_driver, None),
+    ('serialize', _stage_serialize, None),
+    ('export_excel', _stage_export_excel, None),
+]
+
+
+def _measure(stage, app, ctx, repeat):
+    seconds = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        stage(app, ctx)
+        elapsed = time.perf_counter() - started
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    try:
+        stage(app, ctx)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': round(seconds, 4), 'peak_mb': round(peak / (1024 * 1024), 2)}
+
+
+def run(paths, repeat=1, workers=1):
+    """
+    paths: {'gps1', 'gps2', 'mapping'} от synthetic.generate
+    workers: > 1 добавя етапа parse_gps2_parallel след parse_gps2
+    Returns: {етап: {'seconds', 'peak_mb'}}
+    """
+    import app
+
+    ctx = {'gps1': paths['gps1'], 'gps2': paths['gps2'], 'mapping_path': paths['mapping'],
+           'workers': workers}
+    results = {}
+    for name, stage, prepare in STAGES:
+        results[name] = _measure(stage, app, ctx, repeat)
+        if name == 'parse_gps2' and workers > 1:
+            # Едно изпълнение извън мерките стартира процесите на пула
+            _stage_parse_gps2_parallel(app, ctx)
+            results['parse_gps2_parallel'] = _measure(_stage_parse_gps2_parallel, app, ctx, repeat)
+        if prepare:
+            prepare(app, ctx)
+    results['_records'] = len(ctx['records'])
+    return results
+
+
+def scale_key(trucks, trips, months, seed):
+    return f'trucks={trucks},trips={trips},months={months},seed={seed}'
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(key, results, path=BASELINE_PATH):
+    baseline = load_baseline(path)
+    stages = {name for name, _, _ in STAGES}
+    baseline[key] = {name: value for name, value in results.items() if name in stages}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def check(results, expected, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """Returns: списък с превишенията спрямо baseline (празен = OK)"""
+    failures = []
+    for name, limits in expected.items():
+        actual = results.get(name)
+        if actual is None:
+            continue
+        allowed_seconds = limits['seconds'] * (1 + time_tolerance) + TIME_SLACK
+        if actual['seconds'] > allowed_seconds:
+            failures.append(f'{name}: {actual["seconds"]} s > {allowed_seconds:.4f} s '
+                            f'(baseline {limits["seconds"]} s)')
+        allowed_mb = limits['peak_mb'] * (1 + memory_tolerance) + MEMORY_SLACK_MB
+        if actual['peak_mb'] > allowed_mb:
+            failures.append(f'{name}: {actual["peak_mb"]} MB > {allowed_mb:.2f} MB '
+                            f'(baseline {limits["peak_mb"]} MB)')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--trucks', type=int, default=100)
+    parser.add_argument('--trips', type=int, default=10, help='курсове на камион на месец')
+    parser.add_argument('--months', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='> 1 мери и parse_gps2_parallel с толкова workers')
+    parser.add_argument('--data-dir', help='готови gps1.xlsx, gps2.xlsx и mapping.csv')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--check', action='store_true', help='код 1 при превишен baseline')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.data_dir:
+        paths = {kind: os.path.join(args.data_dir, name) for kind, name in
+                 (('gps1', 'gps1.xlsx'), ('gps2', 'gps2.xlsx'), ('mapping', 'mapping.csv'))}
+        key = None
+        results = run(paths, args.repeat, args.workers)
+    else:
+        key = scale_key(args.trucks, args.trips, args.months, args.seed)
+        with tempfile.TemporaryDirectory() as data_dir:
+            paths = synthetic.generate(data_dir, args.trucks, args.trips, args.months, args.seed)
+            results = run(paths, args.repeat, args.workers)
+
+    print(f'{results["_records"]} записа' + (f' ({key})' if key else ''))
+    print(f'{"stage":<22} {"sec":>9} {"peak MB":>9}')
+    for name, _, _ in STAGES:
+        print(f'{name:<22} {results[name]["seconds"]:>9} {results[name]["peak_mb"]:>9}')
+        if name == 'parse_gps2' and 'parse_gps2_parallel' in results:
+            parallel = results['parse_gps2_parallel']
+            speedup = results[name]['seconds'] / max(parallel['seconds'], 1e-9)
+            print(f'{"parse_gps2_parallel":<22} {parallel["seconds"]:>9} {parallel["peak_mb"]:>9}'
+                  f'  x{speedup:.2f} ({args.workers} workers, {os.cpu_count()} CPU)')
+
+    if args.save_baseline:
+        if key is None:
+            parser.error('--save-baseline изисква синтетични данни (без --data-dir)')
+        save_baseline(key, results, args.baseline)
+        print(f'Baseline записан в {args.baseline}')
+
+    if args.check:
+        expected = load_baseline(args.baseline).get(key) if key else None
+        if not expected:
+            print(f'Няма baseline за {key or "--data-dir"} в {args.baseline}')
+            return 2
+        failures = check(results, expected, args.time_tolerance, args.memory_tolerance)
+        for failure in failures:
+            print('FAIL ' + failure)
+        if failures:
+            return 1
+        print('OK: в рамките на baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Синтетични GPS данни за бенчмарковете.
+
+Генерира файлове във формата, който парсерите в app.py очакват:
+- GPS1: един sheet, заглавна част до ред 8, данни от ред 9 (A–E) и ред
+  "Общо" след записите на всеки камион и в края;
+- GPS2: по един sheet на камион, header на ред 1, данни от ред 2 (начален
+  адрес в C, начална дата в E, краен адрес в K, крайна дата в M);
+- mapping CSV "Камион;Шофьор" (част от камионите остават без шофьор).
+
+Обемът е камиони × курсове × месеци. Всеки курс е България → чужбина →
+(чужбина → чужбина)* → България с по някой вътрешен превоз между курсовете,
+с адреси от България, Гърция, Румъния и Турция. Генераторът е детерминиран
+за даден seed.
+
+    python -m benchmarks.synthetic --trucks 50 --trips 8 --months 1 --out /tmp/jetom-data
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import openpyxl
+
+ADDRESSES = {
+    'България': [
+        'ул. Цар Симеон 12, 1000 София, България',
+        'бул. Христо Ботев 58, 4000 Пловдив, България',
+        'Индустриална зона, 7000 Русе, България',
+        'Пристанище Варна Запад, 9000 Варна, България',
+        'Складова база Север, 8000 Бургас, България',
+        'ГКПП Кулата, 2868 Кулата, България',
+        'ГКПП Капитан Андреево, 6570 Свиленград, България',
+        'Дунав мост 2, 3700 Видин, България',
+    ],
+    'Гърция': [
+        'Εθνική Οδός Θεσσαλονίκης, Δήμος Θεσσαλονίκης, Περιφερειακή Ενότητα Θεσσαλονίκης',
+        'Λιμάνι Πειραιά, Δήμος Πειραιώς, Περιφέρεια Αττικής',
+        'Βιομηχανική Περιοχή, Δήμος Λαρισαίων, Περιφέρεια Θεσσαλίας',
+        'Οδός Αγίου Δημητρίου 4, Δημοτική Ενότητα Σερρών',
+        'Κοινότητα Προμαχώνα, Δήμος Σιντικής',
+    ],
+    'Румъния': [
+        'Strada Mihai Viteazu 5, București, România',
+        'Drumul Național 1, Ploiești, Romania',
+        'Port Constanța Sud, Constanța, România',
+        'Calea Severinului 20, Craiova, România',
+        'Румъния, Гюргево, Пункт Гюргево',
+    ],
+    'Турция': [
+        'Kapıkule Sınır Kapısı, Edirne, Türkiye',
+        'Halkalı Gümrük, İstanbul, Türkiye',
+        'Organize Sanayi Bölgesi, Çorlu, Tekirdağ, Turkey',
+        'Ambarlı Limanı, Avcılar, İstanbul, Türkiye',
+    ],
+}
+
+FOREIGN = ('Гърция', 'Румъния', 'Турция')
+
+FIRST_NAMES = ('Иван', 'Георги', 'Димитър', 'Петър', 'Христо', 'Николай', 'Стоян', 'Тодор',
+               'Васил', 'Атанас', 'Калоян', 'Емил', 'Красимир', 'Йордан', 'Михаил')
+LAST_NAMES = ('Иванов', 'Георгиев', 'Димитров', 'Петров', 'Христов', 'Николов', 'Стоянов',
+              'Тодоров', 'Василев', 'Атанасов', 'Костов', 'Маринов', 'Попов', 'Колев')
+PLATE_PREFIXES = ('CB', 'CA', 'PB', 'PA', 'B', 'BH', 'P', 'E')
+PLATE_SUFFIX_LETTERS = 'ABEKMHOPCTX'
+
+GPS1_HEADER = ['Обект', 'Начало', 'Край', 'Начален адрес', 'Краен адрес']
+GPS2_HEADER = ['№', 'Обект', 'Начален адрес', 'Начален пробег', 'Начална дата',
+               'Продължителност', 'Пробег, км', 'Макс. скорост', 'Ср. скорост', 'Престой',
+               'Краен адрес', 'Краен пробег', 'Крайна дата']
+
+START = datetime(2025, 1, 1)
+DAYS_PER_MONTH = 30
+
+
+def truck_plates(count, rng):
+    """Уникални български регистрационни номера"""
+    plates = []
+    seen = set()
+    while len(plates) < count:
+        plate = (rng.choice(PLATE_PREFIXES) + f'{rng.randint(1000, 9999)}'
+                 + rng.choice(PLATE_SUFFIX_LETTERS) + rng.choice(PLATE_SUFFIX_LETTERS))
+        if plate not in seen:
+            seen.add(plate)
+            plates.append(plate)
+    return plates
+
+
+def truck_trips(rng, trips, months):
+    """
+    Пътуванията на един камион, подредени по време:
+    (начало, край, начален адрес, краен адрес)
+    """
+    slot = timedelta(days=DAYS_PER_MONTH) / trips
+    for month in range(months):
+        month_start = START + timedelta(days=DAYS_PER_MONTH * month)
+        for trip in range(trips):
+            t = month_start + slot * trip + timedelta(minutes=rng.randint(0, 240))
+            legs = []
+            addr = rng.choice(ADDRESSES['България'])
+            if rng.random() < 0.5:
+                # Вътрешен превоз преди курса
+                nxt = rng.choice(ADDRESSES['България'])
+                legs.append((addr, nxt))
+                addr = nxt
+
+            country = rng.choice(FOREIGN)
+            nxt = rng.choice(ADDRESSES[country])
+            legs.append((addr, nxt))
+            addr = nxt
+            for _ in range(rng.randint(1, 3)):
+                if rng.random() < 0.25:
+                    country = rng.choice(FOREIGN)
+                nxt = rng.choice(ADDRESSES[country])
+                legs.append((addr, nxt))
+                addr = nxt
+            legs.append((addr, rng.choice(ADDRESSES['България'])))
+
+            # Курсът заема най-много 80% от своя слот
+            leg = slot * 0.8 / len(legs)
+            for from_addr, to_addr in legs:
+                end = t + leg * rng.uniform(0.3, 0.9)
+                yield t.replace(microsecond=0), end.replace(microsecond=0), from_addr, to_addr
+                t = t + leg
+
+
+def _gps1_header_rows(months):
+    end = START + timedelta(days=DAYS_PER_MONTH * months - 1)
+    return [
+        ['Отчет за пътувания'],
+        ['Период:', f'{START:%d.%m.%Y} - {end:%d.%m.%Y}'],
+        ['Фирма:', 'ЖЕТОМ ТРАНС'],
+        [],
+        ['Генериран:', f'{datetime.now():%d.%m.%Y %H:%M}'],
+        [],
+        [],
+        GPS1_HEADER,
+    ]
+
+
+def write_gps1(path, trucks, trips, months, rng):
+    """GPS1 workbook; дати като datetime клетки. Returns: брой записи"""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Пътувания')
+    for row in _gps1_header_rows(months):
+        ws.append(row)
+
+    count = 0
+    for truck in trucks:
+        truck_count = 0
+        for start_time, end_time, from_addr, to_addr in truck_trips(rng, trips, months):
+            ws.append([truck, start_time, end_time, from_addr, to_addr])
+            truck_count += 1
+        ws.append(['Общо', None, None, f'{truck}: {truck_count} пътувания', None])
+        count += truck_count
+    ws.append(['Общо', None, None, f'{count} пътувания', None])
+
+    wb.save(path)
+    return count
+
+
+def write_gps2(path, trucks, trips, months, rng):
+    """GPS2 workbook, по един sheet на камион; дати като текст DD/MM/YYYY HH:MM:SS"""
+    wb = openpyxl.Workbook(write_only=True)
+    count = 0
+    for truck in trucks:
+        ws = wb.create_sheet(truck)
+        ws.append(GPS2_HEADER)
+        mileage = rng.randint(100000, 900000)
+        for i, (start_time, end_time, from_addr, to_addr) in enumerate(
+                truck_trips(rng, trips, months), 1):
+            km = rng.randint(20, 900)
+            # Част от експортите са без секунди
+            fmt = '%d/%m/%Y %H:%M' if i % 7 == 0 else '%d/%m/%Y %H:%M:%S'
+            ws.append([i, truck, from_addr, mileage, start_time.strftime(fmt),
+                       str(end_time - start_time), km, rng.randint(80, 90), rng.randint(55, 75),
+                       '00:00:00', to_addr, mileage + km, end_time.strftime(fmt)])
+            mileage += km
+            count += 1
+    wb.save(path)
+    return count
+
+
+def write_mapping(path, trucks, rng, unmapped=0.05):
+    """Mapping CSV; някои шофьори карат по два камиона"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('Камион;Шофьор\n')
+        driver = None
+        for truck in trucks:
+            if rng.random() < unmapped:
+                continue
+            if driver is None or rng.random() < 0.8:
+                driver = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.randint(1, 99)}'
+            f.write(f'{truck};{driver}\n')
+
+
+def generate(out_dir, trucks=50, trips=8, months=1, seed=1):
+    """
+    Записва gps1.xlsx, gps2.xlsx и mapping.csv в out_dir.
+    Половината камиони са в GPS1, другата половина - в GPS2.
+    Returns: dict с пътищата и броя записи
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    plates = truck_plates(trucks, rng)
+    gps1_trucks = plates[:(trucks + 1) // 2]
+    gps2_trucks = plates[(trucks + 1) // 2:]
+
+    paths = {
+        'gps1': os.path.join(out_dir, 'gps1.xlsx'),
+        'gps2': os.path.join(out_dir, 'gps2.xlsx'),
+        'mapping': os.path.join(out_dir, 'mapping.csv'),
+    }
+    gps1_records = write_gps1(paths['gps1'], gps1_trucks, trips, months, rng)
+    gps2_records = write_gps2(paths['gps2'], gps2_trucks, trips, months, rng)
+    write_mapping(paths['mapping'], plates, rng)
+
+    return dict(paths, gps1_records=gps1_records, gps2_records=gps2_records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--trucks', type=int, default=50)
+    parser.add_argument('--trips', type=int, default=8, help='курсове на камион на месец')
+    parser.add_argument('--months', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args(argv)
+
+    info = generate(args.out, args.trucks, args.trips, args.months, args.seed)
+    print(f'GPS1: {info["gps1"]} ({info["gps1_records"]} записа)')
+    print(f'GPS2: {info["gps2"]} ({info["gps2_records"]} записа)')
+    print(f'Mapping: {info["mapping"]}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
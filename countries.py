@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Класификация на държава по адрес.
+
+Маркерите са в таблица (data/country_markers.json), подредена по приоритет:
+при няколко съвпадения печели държавата, която е по-напред в таблицата.
+Всички маркери се компилират в един regex, така че нова държава не добавя
+нов проход по адреса, а резултатите се кешират по адрес (LRU).
+
+Държавите имат и малки целочислени кодове (индекс в names), които GPS
+записите пазят вместо низове.
+"""
+
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+
+DEFAULT_MARKERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'data', 'country_markers.json')
+
+
+def load_marker_table(path=DEFAULT_MARKERS_PATH):
+    """Зарежда таблицата с маркери от JSON файл"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class CountryClassifier:
+    """
+    Адрес → държава по таблица с маркери.
+    classify() връща table['empty'] за празен адрес и table['fallback'],
+    когато нито един маркер не съвпада; code() връща кода на същата държава.
+    """
+
+    def __init__(self, table, cache_size=65536):
+        self.empty = table['empty']
+        self.fallback = table['fallback']
+        self.countries = [entry['country'] for entry in table['countries']]
+
+        # Кодове: държавите от таблицата по ред, после fallback и empty
+        self.names = self.countries + [self.fallback, self.empty]
+        self.fallback_code = len(self.countries)
+        self.empty_code = len(self.countries) + 1
+        self._codes = {name: code for code, name in enumerate(self.names)}
+
+        # Отпечатък на таблицата: кодовете зависят от нея (напр. за кеш ключове)
+        self.fingerprint = hashlib.sha256(
+            json.dumps(table, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+        # маркер → приоритет (индекс на държавата в таблицата)
+        self._priority = {}
+        for idx, entry in enumerate(table['countries']):
+            for marker in entry['markers']:
+                self._priority.setdefault(marker, idx)
+
+        # Lookahead позволява застъпващи се съвпадения, така че по-къс маркер
+        # с по-нисък приоритет не може да „скрие“ по-важен маркер
+        alternation = '|'.join(re.escape(m) for m in
+                               sorted(self._priority, key=len, reverse=True))
+        self._pattern = re.compile(f'(?=({alternation}))')
+
+        self._lookup = lru_cache(maxsize=cache_size)(self._match)
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_MARKERS_PATH, cache_size=65536):
+        return cls(load_marker_table(path), cache_size)
+
+    def _match(self, addr):
+        best = None
+        for m in self._pattern.finditer(addr):
+            priority = self._priority[m.group(1)]
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+        return self.fallback_code if best is None else best
+
+    def code(self, address):
+        """Код на държавата за адрес"""
+        if not address:
+            return self.empty_code
+        return self._lookup(str(address))
+
+    def classify(self, address):
+        """Име на държавата за адрес"""
+        return self.names[self.code(address)]
+
+    def code_of(self, name):
+        """Код по име на държава"""
+        return self._codes[name]
+
+    def cache_stats(self):
+        """Статистика на кеша: hits, misses, size, maxsize"""
+        info = self._lookup.cache_info()
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'maxsize': info.maxsize
+        }
+
+    def clear_cache(self):
+        self._lookup.cache_clear()
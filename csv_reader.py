@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Поточен четец на CSV експорти с интерфейса на xlsx_reader.
+
+GPS системите дават същите таблици и като CSV. CsvReader чете файла ред
+по ред с модула csv (без да го зарежда целия) и връща редовете като
+XlsxReader.iter_rows: tuple с max_col стойности, празните клетки са None.
+Файлът има един "sheet". Кодировката (UTF-8, с или без BOM, или
+Windows-1251) и разделителят (';', ',' или таб) се определят по началото
+на файла. Всички стойности са низове - датите се декодират от DateDecoder,
+както текстовите дати в .xlsx.
+"""
+
+import codecs
+import csv
+
+SHEET_NAME = 'csv'
+DELIMITERS = ';,\t'
+SNIFF_BYTES = 64 * 1024
+
+_ZIP_MAGIC = b'PK\x03\x04'
+_OLE_MAGIC = b'\xd0\xcf\x11\xe0'
+
+
+def _head(file_path, size):
+    """Първите size байта на път или seekable файлов обект"""
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+        head = file_path.read(size)
+        file_path.seek(0)
+        return head
+    with open(file_path, 'rb') as f:
+        return f.read(size)
+
+
+def is_xlsx(file_path):
+    """.xlsx файл (zip архив) по първите байтове"""
+    return _head(file_path, len(_ZIP_MAGIC)) == _ZIP_MAGIC
+
+
+def is_csv(file_path, min_columns=2):
+    """
+    CSV експорт: текстов файл (не .xlsx/zip, не стар .xls/OLE), в чието
+    начало има ред с поне min_columns колони, от които поне две непразни
+    (заглавният ред може да има и колони без заглавие). Всичко останало
+    се отваря като .xlsx и дава неговата грешка.
+    """
+    head = _head(file_path, SNIFF_BYTES)
+    if head.startswith((_ZIP_MAGIC, _OLE_MAGIC)) or b'\0' in head:
+        return False
+    text = head.decode(_detect_encoding(head), errors='ignore')
+    lines = text.splitlines()
+    if len(head) == SNIFF_BYTES:
+        lines = lines[:-1]  # последният ред може да е отрязан
+    for row in csv.reader(lines, delimiter=_detect_delimiter(text)):
+        if len(row) >= min_columns and sum(1 for value in row if value.strip()) >= 2:
+            return True
+    return False
+
+
+def _detect_encoding(head):
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # Непълен символ в края на прочетеното не е грешка
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1251'
+
+
+def _detect_delimiter(text):
+    first_line = text.split('\n', 1)[0]
+    counts = {d: first_line.count(d) for d in DELIMITERS}
+    delimiter = max(DELIMITERS, key=lambda d: counts[d])
+    return delimiter if counts[delimiter] else DELIMITERS[0]
+
+
+class CsvReader:
+    """CSV файл (път или двоичен файлов обект), отворен за поточно четене"""
+
+    sheetnames = [SHEET_NAME]
+    active_sheet_name = SHEET_NAME
+
+    def __init__(self, file_path):
+        head = _head(file_path, SNIFF_BYTES)
+        self.encoding = _detect_encoding(head)
+        self.delimiter = _detect_delimiter(head.decode(self.encoding, errors='ignore'))
+        self._owns_file = not hasattr(file_path, 'read')
+        self._file = open(file_path, 'rb') if self._owns_file else file_path
+
+    def _lines(self):
+        # Двоичните редове се декодират поотделно: '\n' не е част от
+        # многобайтов символ в UTF-8, а utf-8-sig маха BOM само в началото
+        decode = codecs.getincrementaldecoder(self.encoding)().decode
+        self._file.seek(0)
+        for line in self._file:
+            yield decode(line)
+
+    def iter_rows(self, sheet_name=SHEET_NAME, min_row=1, max_col=None, columns=None):
+        """
+        Генератор на редовете от min_row (1-базиран) нататък; всеки ред е
+        tuple с точно max_col стойности. columns е за съвместимост с
+        XlsxReader - CSV редът се разделя целият.
+        """
+        for row_idx, row in enumerate(csv.reader(self._lines(), delimiter=self.delimiter), 1):
+            if row_idx < min_row:
+                continue
+            if max_col is not None:
+                row = row[:max_col] + [''] * (max_col - len(row))
+            yield tuple(value if value != '' else None for value in row)
+
+    def close(self):
+        # Качен файл (файлов обект) остава отворен за извикващия
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
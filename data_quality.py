@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Проверки на качеството на GPS записите по камиони.
+
+Записите на всеки камион минават веднъж, подредени по start_time, през
+TruckChecks - същия ред, в който ги получава TravelBlockBuilder. Пазят се
+само краят и държавата на предишния запис и броячите, затова паметта е по
+камион, а не по запис, и проверките не добавят проход през данните.
+
+Видове проблеми (ISSUES):
+- overlaps: пътуване, започнало преди края на предишното;
+- negative_durations: пътуване с край преди началото;
+- location_gaps: пътуване, започнало в друга държава, а не там, където е
+  свършило предишното - между тях липсват записи;
+- unknown_countries: пътуване с начало или край в неопределена държава;
+- rejected_dates: ред с дата, която не може да се разчете (от ParseReport).
+
+summary() е кратък отчет за /process: общ брой по вид, брой камиони с
+проблеми и до max_trucks камиона с най-много проблеми.
+"""
+
+import heapq
+from datetime import datetime
+
+ISSUES = ('overlaps', 'negative_durations', 'location_gaps', 'unknown_countries',
+          'rejected_dates')
+
+
+class TruckChecks:
+    """
+    Проверките за един камион: feed() за всеки запис или feed_all() за
+    списък, по start_time
+    """
+
+    __slots__ = ('overlaps', 'negative_durations', 'location_gaps', 'unknown_countries',
+                 'first_issue', '_unknown', '_last_end', '_last_country')
+
+    def __init__(self, unknown):
+        self.overlaps = 0
+        self.negative_durations = 0
+        self.location_gaps = 0
+        self.unknown_countries = 0
+        self.first_issue = None
+        self._unknown = unknown
+        self._last_end = None
+        self._last_country = None
+
+    def feed(self, rec):
+        self.feed_all((rec,))
+
+    def feed_all(self, records):
+        """Записите на камиона по start_time, след вече подадените"""
+        unknown = self._unknown
+        last_end = self._last_end
+        last_country = self._last_country
+        first_issue = self.first_issue
+        overlaps = negative_durations = location_gaps = unknown_countries = 0
+
+        for rec in records:
+            start_time = rec.start_time
+            end_time = rec.end_time
+            from_country = rec.from_country
+            to_country = rec.to_country
+            issue = False
+
+            if end_time < start_time:
+                negative_durations += 1
+                issue = True
+
+            if last_end is not None:
+                if start_time < last_end:
+                    overlaps += 1
+                    issue = True
+                elif (from_country != last_country and from_country not in unknown
+                      and last_country not in unknown):
+                    location_gaps += 1
+                    issue = True
+
+            if from_country in unknown or to_country in unknown:
+                unknown_countries += 1
+                issue = True
+
+            if issue and first_issue is None:
+                first_issue = start_time
+            if last_end is None or end_time > last_end:
+                last_end = end_time
+            last_country = to_country
+
+        self.overlaps += overlaps
+        self.negative_durations += negative_durations
+        self.location_gaps += location_gaps
+        self.unknown_countries += unknown_countries
+        self.first_issue = first_issue
+        self._last_end = last_end
+        self._last_country = last_country
+
+
+class DataQuality:
+    """
+    TruckChecks по камиони и отхвърлените редове от парсерите.
+    unknown: кодовете на държави, които се броят като неопределени.
+    """
+
+    def __init__(self, unknown, max_trucks=50):
+        self._unknown = frozenset(unknown)
+        self.max_trucks = max_trucks
+        self._trucks = {}
+        self._rejected = {}
+
+    def truck(self, truck):
+        """
+        Нов TruckChecks за камиона. Заменя предишния - при повторен проход
+        (разбъркани записи, записи и от двата източника) камионът се
+        проверява отначало.
+        """
+        checks = self._trucks[truck] = TruckChecks(self._unknown)
+        return checks
+
+    def add_rejected(self, rejected):
+        """rejected: {камион: брой редове с нечетими дати}"""
+        for truck, count in rejected.items():
+            self._rejected[truck] = self._rejected.get(truck, 0) + count
+
+    def _truck_counts(self, truck):
+        checks = self._trucks.get(truck)
+        counts = {name: getattr(checks, name) for name in ISSUES[:-1]} if checks else {}
+        counts['rejected_dates'] = self._rejected.get(truck, 0)
+        return counts
+
+    def summary(self):
+        """{'issues': {вид: брой}, 'trucks_with_issues', 'trucks': [...]}"""
+        totals = dict.fromkeys(ISSUES, 0)
+        ranked = []
+        for truck in self._trucks.keys() | self._rejected.keys():
+            counts = self._truck_counts(truck)
+            issues = sum(counts.values())
+            if not issues:
+                continue
+            for name, count in counts.items():
+                totals[name] += count
+            ranked.append((issues, truck))
+
+        trucks = []
+        for issues, truck in heapq.nsmallest(self.max_trucks, ranked, key=lambda t: (-t[0], str(t[1]))):
+            entry = {'truck': truck, 'issues': issues}
+            entry.update((name, count) for name, count in self._truck_counts(truck).items() if count)
+            checks = self._trucks.get(truck)
+            if checks is not None and isinstance(checks.first_issue, datetime):
+                entry['first_issue'] = checks.first_issue.strftime('%d.%m.%Y %H:%M')
+            trucks.append(entry)
+
+        return {'issues': totals, 'trucks_with_issues': len(ranked), 'trucks': trucks}
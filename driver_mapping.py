@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Разпределение камион → шофьор с период на валидност.
+
+Mapping CSV-то е "Камион;Шофьор" и по избор "От;До" (дати YYYY-MM-DD или
+DD.MM.YYYY, включително; празно = без граница). Колоните с дати се намират
+по заглавието им (DATE_HEADERS), а други колони (напр. "Телефон") се
+пренебрегват. Ред без дати важи за целия период, така че старият формат
+с две колони работи както преди.
+
+За всеки камион периодите се пазят като подредени списъци (начала, краища,
+шофьори) и се търсят с bisect, затова търсенето е O(log n) и при години
+история. Периодите са полуотворени [от, до), до е началото на деня след
+"До". Ако периоди на камион се застъпват, важи по-късно започналият (при
+еднакво начало - по-късният ред), а след края му - отново предишният.
+Така ред без дати е шофьорът по подразбиране, а редове с дати - смените.
+"""
+
+import heapq
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+
+# Заглавия на колоните с дати (casefold)
+DATE_HEADERS = {
+    'from': ('от', 'валиден от', 'from', 'valid from', 'valid_from'),
+    'to': ('до', 'валиден до', 'to', 'valid to', 'valid_to'),
+}
+
+
+def parse_mapping_date(value):
+    """Дата от колоните От/До; None за празна стойност, ValueError за невалидна"""
+    value = value.strip()
+    if not value:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f'Невалидна дата: {value!r}')
+
+
+def date_columns(header):
+    """(индекс на От или None, индекс на До или None) по заглавния ред"""
+    found = {}
+    for idx, value in enumerate(header):
+        if not isinstance(value, str):
+            continue
+        name = value.strip().casefold()
+        for key, names in DATE_HEADERS.items():
+            if name in names:
+                found.setdefault(key, idx)
+    return found.get('from'), found.get('to')
+
+
+def _build_index(periods):
+    """
+    Непресичащи се периоди от периоди, които може да се застъпват.
+    periods: [(начало или None, край или None, шофьор)] по реда в CSV-то
+    Returns: (начала, краища, шофьори), подредени по начало
+    """
+    events = sorted(((start or datetime.min, order, end or datetime.max, driver)
+                     for order, (start, end, driver) in enumerate(periods)),
+                    key=lambda e: (e[0], e[1]))
+    boundaries = sorted({e[0] for e in events} | {e[2] for e in events})
+
+    starts, ends, drivers = [], [], []
+    active = []  # heap по (-начало, -ред): отгоре е периодът, който важи
+    e = 0
+    for t, next_t in zip(boundaries, boundaries[1:]):
+        while e < len(events) and events[e][0] <= t:
+            start, order, end, driver = events[e]
+            heapq.heappush(active, (datetime.min - start, -order, end, driver))
+            e += 1
+        # Изтеклите периоди под върха се махат, когато стигнат до върха
+        while active and active[0][2] <= t:
+            heapq.heappop(active)
+        if not active:
+            continue
+        driver = active[0][3]
+        if drivers and drivers[-1] == driver and ends[-1] == t:
+            ends[-1] = next_t
+        else:
+            starts.append(t)
+            ends.append(next_t)
+            drivers.append(driver)
+    return starts, ends, drivers
+
+
+class DriverMapping:
+    """
+    Периодите на шофьорите по камиони.
+    add() събира периодите, а търсенията подреждат индекса при нужда.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._index = {}
+
+    @classmethod
+    def from_dict(cls, mapping):
+        """От стария {truck: driver} (без дати)"""
+        result = cls()
+        for truck, driver in mapping.items():
+            result.add(truck, driver)
+        return result
+
+    def add(self, truck, driver, valid_from=None, valid_to=None):
+        """valid_from/valid_to: datetime (дати от CSV-то, valid_to включително) или None"""
+        end = valid_to + timedelta(days=1) if valid_to is not None else None
+        self._pending.setdefault(truck, []).append((valid_from, end, driver))
+        self._index.pop(truck, None)
+
+    def _truck_index(self, truck):
+        index = self._index.get(truck)
+        if index is None:
+            periods = self._pending.get(truck)
+            if not periods:
+                return None
+            index = self._index[truck] = _build_index(periods)
+        return index
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, truck):
+        return truck in self._pending
+
+    def trucks(self):
+        return self._pending.keys()
+
+    def single_driver(self, truck):
+        """Шофьорът, ако камионът има един период без граници (старият формат), иначе None"""
+        index = self._truck_index(truck)
+        if index is None:
+            return None
+        starts, ends, drivers = index
+        if len(drivers) == 1 and starts[0] == datetime.min and ends[0] == datetime.max:
+            return drivers[0]
+        return None
+
+    def driver_at(self, truck, when):
+        """Шофьорът на камиона в момента when или None"""
+        index = self._truck_index(truck)
+        if index is None:
+            return None
+        starts, ends, drivers = index
+        i = bisect_right(starts, when) - 1
+        if i >= 0 and when < ends[i]:
+            return drivers[i]
+        return None
+
+    def segments(self, truck, start, end):
+        """
+        Разделя [start, end] по смените на шофьора.
+        Returns: [(начало, край на частта, шофьор или None)]; краят на
+        частта е границата на следващата (полуотворено), освен за последната
+        """
+        index = self._truck_index(truck)
+        if index is None:
+            return [(start, end, None)]
+        starts, ends, drivers = index
+
+        result = []
+        i = max(bisect_right(starts, start) - 1, 0)
+        t = start
+        while True:
+            while i < len(starts) and ends[i] <= t:
+                i += 1
+            if i < len(starts) and starts[i] <= t:
+                boundary, driver = ends[i], drivers[i]
+            else:
+                # Празнина без шофьор до следващия период
+                boundary = starts[i] if i < len(starts) else datetime.max
+                driver = None
+            if boundary >= end:
+                result.append((t, end, driver))
+                break
+            result.append((t, boundary, driver))
+            t = boundary
+
+        # Съседни части с един и същ шофьор се сливат
+        merged = [result[0]]
+        for part in result[1:]:
+            if part[2] == merged[-1][2]:
+                merged[-1] = (merged[-1][0], part[1], part[2])
+            else:
+                merged.append(part)
+        return merged
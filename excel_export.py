@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Поточен Excel експорт на командировките.
+
+Workbook-ът е в write-only режим: редовете се записват веднага във
+временния XML на sheet-а и не се пазят в паметта. Стиловете са именувани
+(NamedStyle) и се регистрират веднъж за workbook, вместо за всяка клетка
+да се създават нови Font/PatternFill/Border/Alignment обекти. Подсумите
+"За получаване" се пишат в същото минаване по редовете.
+"""
+
+import io
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.worksheet.cell_range import CellRange
+
+HEADERS_WITH_MAPPING = ['№', 'Шофьор', 'Камион', 'Дата от', 'Дата до', 'Дни', 'EUR/ден', 'Сума EUR',
+                        'Сума BGN']
+HEADERS_WITHOUT_MAPPING = ['№', 'Камион', 'Дата от', 'Дата до', 'Дни', 'EUR/ден', 'Сума EUR', 'Сума BGN']
+
+SUBTOTAL_LABEL = 'За получаване'
+MONEY_FORMAT = '#,##0.00'
+
+
+def _named_styles():
+    """Стиловете на експорта (същите като в стария експорт от app.py)"""
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    subtotal_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
+    # Клетките без собствен шрифт остават с шрифта по подразбиране на workbook-а
+
+    return [
+        NamedStyle('jetom_header', border=border,
+                   font=Font(bold=True, color="FFFFFF", size=11),
+                   fill=PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"),
+                   alignment=Alignment(horizontal='center', vertical='center')),
+        NamedStyle('jetom_text', border=border, font=DEFAULT_FONT, alignment=Alignment(horizontal='left')),
+        NamedStyle('jetom_name', border=border, alignment=Alignment(horizontal='left'),
+                   font=Font(bold=True, size=11)),
+        NamedStyle('jetom_number', border=border, font=DEFAULT_FONT,
+                   alignment=Alignment(horizontal='center')),
+        NamedStyle('jetom_money', border=border, font=DEFAULT_FONT,
+                   alignment=Alignment(horizontal='center'),
+                   number_format=MONEY_FORMAT),
+        NamedStyle('jetom_subtotal', border=border, font=DEFAULT_FONT, fill=subtotal_fill),
+        NamedStyle('jetom_subtotal_label', border=border, fill=subtotal_fill,
+                   font=Font(bold=True, size=11)),
+        NamedStyle('jetom_subtotal_value', border=border, fill=subtotal_fill,
+                   font=Font(bold=True)),
+    ]
+
+
+class ExportWriter:
+    """
+    Write-only sheet "Командировки" с поточен запис на редовете.
+    write_rows(rows) пише данните и подсумите, save() връща BytesIO.
+    """
+
+    def __init__(self, has_mapping, eur_to_bgn):
+        self.has_mapping = has_mapping
+        self.eur_to_bgn = eur_to_bgn
+        self.headers = HEADERS_WITH_MAPPING if has_mapping else HEADERS_WITHOUT_MAPPING
+        # Колоните №/Шофьор/Камион са подравнени вляво, EUR/BGN са суми
+        self._text_cols = 3 if has_mapping else 2
+        self._money_from = len(self.headers) - 1
+
+        self.wb = openpyxl.Workbook(write_only=True)
+        for style in _named_styles():
+            self.wb.add_named_style(style)
+        self.ws = self.wb.create_sheet("Командировки")
+
+        # Ширините на колоните трябва да са зададени преди първия ред
+        self.ws.column_dimensions['A'].width = 5
+        self.ws.column_dimensions['B'].width = 20
+        self.ws.column_dimensions['C'].width = 12
+        self.ws.column_dimensions['D'].width = 12
+        if has_mapping:
+            self.ws.column_dimensions['E'].width = 12
+
+        self._row_num = 1
+        self._append([self._cell(header, 'jetom_header') for header in self.headers])
+
+    def _cell(self, value, style):
+        cell = WriteOnlyCell(self.ws, value=value)
+        cell.style = style
+        return cell
+
+    def _append(self, cells):
+        self.ws.append(cells)
+        self._row_num += 1
+
+    def _write_block(self, row_counter, name, truck, start_date, end_date, days, eur_rate, eur_sum, bgn_sum):
+        if self.has_mapping:
+            values = [row_counter, name, truck, start_date, end_date, days, eur_rate, eur_sum, bgn_sum]
+        else:
+            values = [row_counter, name, start_date, end_date, days, eur_rate, eur_sum, bgn_sum]
+
+        cells = []
+        for col, value in enumerate(values, 1):
+            if col == 2 and value:
+                style = 'jetom_name'
+            elif col <= self._text_cols:
+                style = 'jetom_text'
+            elif col >= self._money_from:
+                style = 'jetom_money'
+            else:
+                style = 'jetom_number'
+            cells.append(self._cell(value, style))
+        self._append(cells)
+
+    def _write_subtotal(self, totals):
+        row_num = self._row_num
+        last_merged = 'B' if self.has_mapping else 'A'
+        self.ws.merged_cells.add(CellRange(f'A{row_num}:{last_merged}{row_num}'))
+
+        values = {1: SUBTOTAL_LABEL,
+                  self._text_cols + 2: totals[0],
+                  self._text_cols + 4: totals[1],
+                  self._text_cols + 5: totals[2]}
+        cells = []
+        for col in range(1, len(self.headers) + 1):
+            if col == 1:
+                style = 'jetom_subtotal_label'
+            elif col in values:
+                style = 'jetom_subtotal_value'
+            else:
+                style = 'jetom_subtotal'
+            cells.append(self._cell(values.get(col), style))
+        self._append(cells)
+
+    def write_rows(self, rows):
+        """
+        rows: итерируеми dicts с driver, truck, start_date, end_date, days, eur_rate.
+        Подсумата на шофьор се пише при смяна на шофьора и след последния ред.
+        """
+        current_driver = None
+        row_counter = 1
+        # [дни, EUR, BGN] по шофьор - по брой шофьори, не по брой редове
+        driver_totals = {}
+
+        for block in rows:
+            driver = block.get('driver') or block.get('truck')
+            truck = block.get('truck', '')
+            start_date = block.get('start_date', '').split(' ')[0]  # Само датата
+            end_date = block.get('end_date', '').split(' ')[0]
+            days = block.get('days', 0)
+            eur_rate = block.get('eur_rate', 43)
+            eur_sum = days * eur_rate
+            bgn_sum = eur_sum * self.eur_to_bgn
+
+            if current_driver and driver != current_driver:
+                self._write_subtotal(driver_totals[current_driver])
+                row_counter = 1
+
+            if driver != current_driver:
+                name = driver if self.has_mapping else truck
+            else:
+                name = ''
+            self._write_block(row_counter, name, truck, start_date, end_date, days, eur_rate,
+                              eur_sum, bgn_sum)
+
+            totals = driver_totals.get(driver)
+            if totals is None:
+                totals = driver_totals[driver] = [0, 0, 0]
+            totals[0] += days
+            totals[1] += eur_sum
+            totals[2] += bgn_sum
+
+            current_driver = driver
+            row_counter += 1
+
+        if current_driver:
+            self._write_subtotal(driver_totals[current_driver])
+
+    def save(self):
+        excel_file = io.BytesIO()
+        self.wb.save(excel_file)
+        excel_file.seek(0)
+        return excel_file
+
+
+def write_export(rows, has_mapping, eur_to_bgn):
+    """
+    Excel с командировките от редовете на /process
+    Returns: BytesIO
+    """
+    writer = ExportWriter(has_mapping, eur_to_bgn)
+    writer.write_rows(rows)
+    return writer.save()
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Държава по координати (офлайн), с опростени граници на Балканите.
+
+Границите са в data/country_borders.json: за всяка държава (по име, като в
+таблицата с маркери) един или няколко полигона [[дължина, ширина], ...].
+Общите граници на съседните държави са с едни и същи точки. По сушата
+грешката спрямо истинската граница е до десетина км, Дунав е проследен
+по-точно заради градовете един срещу друг (Видин/Калафат, Русе/Гюргево),
+а бреговете на Черно море са изнесени в морето, за да са вътре
+пристанищата и носовете. Точка извън всички полигони няма държава (None).
+Координатите се ползват само за адреси, които маркерите не познават
+(location_code в app.py).
+
+При зареждане областта се дели на клетки от CELL_DEGREES градуса. Клетка,
+през която не минава граница, е изцяло в една държава (или извън всички) и
+държавата ѝ се изчислява веднъж, затова повечето точки се определят с едно
+индексиране в списък. Само клетките по границите пазят кандидат-полигоните
+си, за които се прави point-in-polygon.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+
+DEFAULT_BORDERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'data', 'country_borders.json')
+
+CELL_DEGREES = 0.25
+
+# "42.6977, 23.3219" (ширина, дължина) в клетка с адрес
+_COORDINATES_RE = re.compile(r'^\s*([-+]?\d{1,2}\.\d+)\s*[,;\s]\s*([-+]?\d{1,3}\.\d+)\s*$')
+
+# Заглавия на колоните с координати в GPS файловете (casefold)
+COORDINATE_HEADERS = {
+    'from_lat': ('начална ширина', 'ширина начало', 'start lat', 'start latitude',
+                 'from lat', 'from latitude'),
+    'from_lon': ('начална дължина', 'дължина начало', 'start lon', 'start lng',
+                 'start longitude', 'from lon', 'from lng', 'from longitude'),
+    'to_lat': ('крайна ширина', 'ширина край', 'end lat', 'end latitude', 'to lat', 'to latitude'),
+    'to_lon': ('крайна дължина', 'дължина край', 'end lon', 'end lng', 'end longitude',
+               'to lon', 'to lng', 'to longitude'),
+    'from': ('начални координати', 'координати начало', 'start coordinates', 'from coordinates'),
+    'to': ('крайни координати', 'координати край', 'end coordinates', 'to coordinates'),
+}
+
+
+def load_border_table(path=DEFAULT_BORDERS_PATH):
+    """Зарежда таблицата с граници от JSON файл"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def to_degrees(value):
+    """Градуси от клетка (число или текст, и с десетична запетая) или None"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip().replace(',', '.'))
+        except ValueError:
+            return None
+    return None
+
+
+def valid_point(lat, lon):
+    """(ширина, дължина) или None за липсваща/невалидна точка (и 0, 0 на някои тракери)"""
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    if lat == 0 and lon == 0:
+        return None
+    return lat, lon
+
+
+def parse_coordinates(text):
+    """(ширина, дължина) от текст "ширина, дължина" или None"""
+    if not isinstance(text, str):
+        return None
+    m = _COORDINATES_RE.match(text)
+    if m is None:
+        return None
+    return valid_point(float(m.group(1)), float(m.group(2)))
+
+
+class CoordinateColumns:
+    """
+    Колоните с координати в таблица, намерени по заглавния ред: отделни
+    колони за ширина и дължина или една колона "ширина, дължина" за
+    началото и края. from_header() връща None, ако няма такива колони.
+    """
+
+    def __init__(self, start, end):
+        # start/end: (индекс на ширина, индекс на дължина) или (индекс,)
+        self.start = start
+        self.end = end
+        self.columns = tuple(sorted(set(start + end)))
+
+    @classmethod
+    def from_header(cls, header):
+        found = {}
+        for idx, value in enumerate(header):
+            if not isinstance(value, str):
+                continue
+            name = value.strip().casefold()
+            for key, names in COORDINATE_HEADERS.items():
+                if name in names:
+                    found.setdefault(key, idx)
+
+        def side(prefix):
+            if f'{prefix}_lat' in found and f'{prefix}_lon' in found:
+                return found[f'{prefix}_lat'], found[f'{prefix}_lon']
+            if prefix in found:
+                return (found[prefix],)
+            return None
+
+        start, end = side('from'), side('to')
+        if start is None or end is None:
+            return None
+        return cls(start, end)
+
+    @staticmethod
+    def _point(row, cols):
+        if len(cols) == 1:
+            value = row[cols[0]]
+            if isinstance(value, str):
+                return parse_coordinates(value)
+            return None
+        return valid_point(to_degrees(row[cols[0]]), to_degrees(row[cols[1]]))
+
+    def points(self, row):
+        """(начална точка, крайна точка) на реда; None за липсваща точка"""
+        return self._point(row, self.start), self._point(row, self.end)
+
+
+def _contains(ring, x, y):
+    """Ray casting: точката (x, y) е в полигона ring"""
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def _segment_hits_box(x1, y1, x2, y2, left, bottom, right, top):
+    """Отсечката пресича правоъгълника (Liang-Barsky)"""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - left), (dx, right - x1), (-dy, y1 - bottom), (dy, top - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+            continue
+        t = q / p
+        if p < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+        if t0 > t1:
+            return False
+    return True
+
+
+class GeoClassifier:
+    """
+    (ширина, дължина) → код на държава от CountryClassifier или None.
+    ValueError при държава, която я няма в класификатора, или невалиден полигон.
+    """
+
+    def __init__(self, table, classifier, cell_degrees=CELL_DEGREES):
+        # Отпечатък на таблицата: държавите на записите зависят от нея
+        self.fingerprint = hashlib.sha256(
+            json.dumps(table, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+        # Полигоните по приоритет (редът в таблицата): (код, точки)
+        self._polygons = []
+        for entry in table['countries']:
+            try:
+                code = classifier.code_of(entry['country'])
+            except KeyError:
+                raise ValueError(f'Непозната държава в границите: {entry["country"]!r}') from None
+            for ring in entry['polygons']:
+                if len(ring) < 3:
+                    raise ValueError(f'Полигон с по-малко от 3 точки за {entry["country"]}')
+                self._polygons.append((code, [(float(x), float(y)) for x, y in ring]))
+
+        xs = [x for _, ring in self._polygons for x, _ in ring]
+        ys = [y for _, ring in self._polygons for _, y in ring]
+        self.cell = cell_degrees
+        self.left = math.floor(min(xs))
+        self.bottom = math.floor(min(ys))
+        self.columns = int(math.ceil((max(xs) - self.left) / cell_degrees)) + 1
+        self.rows = int(math.ceil((max(ys) - self.bottom) / cell_degrees)) + 1
+        self._cells = self._build_index()
+
+    @classmethod
+    def from_file(cls, classifier, path=DEFAULT_BORDERS_PATH):
+        return cls(load_border_table(path), classifier)
+
+    def _edge_cells(self, ring):
+        """Клетките, през които минава някоя страна на полигона"""
+        cell, left, bottom = self.cell, self.left, self.bottom
+        cells = set()
+        x1, y1 = ring[-1]
+        for x2, y2 in ring:
+            cols = range(int((min(x1, x2) - left) // cell), int((max(x1, x2) - left) // cell) + 1)
+            rows = range(int((min(y1, y2) - bottom) // cell), int((max(y1, y2) - bottom) // cell) + 1)
+            for col in cols:
+                for row in rows:
+                    box_left, box_bottom = left + col * cell, bottom + row * cell
+                    if _segment_hits_box(x1, y1, x2, y2, box_left, box_bottom,
+                                         box_left + cell, box_bottom + cell):
+                        cells.add(row * self.columns + col)
+            x1, y1 = x2, y2
+        return cells
+
+    def _inner_cells(self, ring):
+        """Клетките с център в полигона (сканиране ред по ред)"""
+        cell, left, bottom = self.cell, self.left, self.bottom
+        cells = set()
+        for row in range(self.rows):
+            y = bottom + (row + 0.5) * cell
+            crossings = []
+            x1, y1 = ring[-1]
+            for x2, y2 in ring:
+                if (y1 > y) != (y2 > y):
+                    crossings.append(x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+                x1, y1 = x2, y2
+            crossings.sort()
+            for start, end in zip(crossings[::2], crossings[1::2]):
+                first = math.ceil((start - left) / cell - 0.5)
+                last = math.floor((end - left) / cell - 0.5)
+                cols = range(max(first, 0), min(last, self.columns - 1) + 1)
+                cells.update(row * self.columns + col for col in cols)
+        return cells
+
+    def _build_index(self):
+        """
+        По една стойност на клетка: код (клетката е изцяло в държавата),
+        None (извън всички полигони) или tuple от (код, точки, изцяло) -
+        кандидатите по приоритет за point-in-polygon.
+        """
+        edges = [self._edge_cells(ring) for _, ring in self._polygons]
+        inner = [self._inner_cells(ring) for _, ring in self._polygons]
+        cells = [None] * (self.columns * self.rows)
+        for idx in range(len(cells)):
+            candidates = []
+            for (code, ring), edge, full in zip(self._polygons, edges, inner):
+                if idx in edge:
+                    candidates.append((code, ring, False))
+                elif idx in full:
+                    # Без граница в клетката, а центърът е вътре - цялата е вътре
+                    candidates.append((code, ring, True))
+                    break
+            if len(candidates) == 1 and candidates[0][2]:
+                cells[idx] = candidates[0][0]
+            elif candidates:
+                cells[idx] = tuple(candidates)
+        return cells
+
+    def code(self, lat, lon):
+        """Кодът на държавата в точката или None (извън границите)"""
+        col = int((lon - self.left) // self.cell)
+        row = int((lat - self.bottom) // self.cell)
+        if not (0 <= col < self.columns and 0 <= row < self.rows):
+            return None
+        found = self._cells[row * self.columns + col]
+        if found is None or isinstance(found, int):
+            return found
+        for code, ring, full in found:
+            if full or _contains(ring, lon, lat):
+                return code
+        return None
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Декодиране на датите в GPS файловете.
+
+Всяка колона с дати има свой DateDecoder. Форматът на колоната се
+налучква по първата текстова стойност от списък с кандидати и после
+всички стойности минават по бърз път: формат с фиксирана ширина (само
+%d %m %Y %H %M %S) се пренарежда до ISO низ за datetime.fromisoformat,
+вместо strptime за всяка клетка. Бързият път проверява и разделителите,
+за да не парсне по позиция дата в друг формат със същата дължина
+(03-01-2025 при %d/%m/%Y). Само стойностите, които не пасват на
+налучкания формат, минават по бавния път през останалите кандидати.
+Excel серийни номера (клетки без формат на дата) също се приемат.
+Непарснатите стойности се броят, вместо да изчезват безследно.
+"""
+
+from datetime import datetime
+from operator import itemgetter
+
+from xlsx_reader import excel_serial_to_datetime
+
+# Формати на колоните с дати по източник (първият е очакваният)
+GPS1_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M')
+GPS2_DATE_FORMATS = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M')
+
+# Формати, които се пробват след тези на източника
+FALLBACK_FORMATS = ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%Y-%m-%dT%H:%M:%S')
+
+# Excel серийни номера в този диапазон са дати (1954-2119)
+MIN_SERIAL = 20000
+MAX_SERIAL = 80000
+
+_FIELD_WIDTHS = {'d': 2, 'm': 2, 'Y': 4, 'H': 2, 'M': 2, 'S': 2}
+
+
+def _fixed_width_fields(fmt):
+    """
+    ({поле: (начало, край)}, ширина, {позиция: разделител}) за формат с
+    фиксирана ширина или None
+    """
+    fields = {}
+    separators = {}
+    pos = 0
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == '%':
+            if i + 1 >= len(fmt) or fmt[i + 1] not in _FIELD_WIDTHS:
+                return None
+            width = _FIELD_WIDTHS[fmt[i + 1]]
+            fields[fmt[i + 1]] = (pos, pos + width)
+            pos += width
+            i += 2
+        else:
+            separators[pos] = fmt[i]
+            pos += 1
+            i += 1
+    if not {'d', 'm', 'Y', 'H', 'M'} <= fields.keys():
+        return None
+    return fields, pos, separators
+
+
+def compile_format(fmt):
+    """
+    Функция низ → datetime за формат; ValueError, ако низът не пасва.
+    Форматите с фиксирана ширина не минават през strptime.
+    """
+    layout = _fixed_width_fields(fmt)
+    if layout is None:
+        return lambda value: datetime.strptime(value, fmt)
+
+    fields, width, separators = layout
+    y0, y1 = fields['Y']
+    m0, m1 = fields['m']
+    d0, d1 = fields['d']
+    h0, h1 = fields['H']
+    n0, n1 = fields['M']
+    s0, s1 = fields.get('S', (0, 0))
+    has_seconds = 'S' in fields
+    fromisoformat = datetime.fromisoformat
+    # itemgetter с 2+ позиции връща tuple, с 1 - символ; затова очакваните
+    # разделители се вземат със същия getter от шаблон на формата
+    get_separators = itemgetter(*separators) if separators else None
+    if get_separators:
+        template = ''.join(separators.get(pos, '0') for pos in range(width))
+        expected = get_separators(template)
+
+    def parse(value):
+        if len(value) != width:
+            raise ValueError(f'Дата с друга дължина: {value!r}')
+        if get_separators and get_separators(value) != expected:
+            raise ValueError(f'Дата с други разделители: {value!r}')
+        seconds = value[s0:s1] if has_seconds else '00'
+        return fromisoformat(f'{value[y0:y1]}-{value[m0:m1]}-{value[d0:d1]}T'
+                             f'{value[h0:h1]}:{value[n0:n1]}:{seconds}')
+
+    return parse
+
+
+class DateDecoder:
+    """
+    Декодер за една колона с дати.
+    decode() връща datetime или None (стойността се брои в rejected).
+    """
+
+    def __init__(self, formats):
+        self.formats = tuple(formats) + tuple(f for f in FALLBACK_FORMATS if f not in formats)
+        self._parsers = [(fmt, compile_format(fmt)) for fmt in self.formats]
+        self.format = None
+        self._fast = None
+        self.fallbacks = 0
+        self.rejected = 0
+
+    def decode(self, value):
+        if isinstance(value, datetime):
+            return value
+        if isinstance(value, str):
+            fast = self._fast
+            if fast is not None:
+                try:
+                    return fast(value)
+                except ValueError:
+                    pass
+            return self._decode_slow(value.strip())
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if MIN_SERIAL <= value < MAX_SERIAL:
+                return excel_serial_to_datetime(value)
+        self.rejected += 1
+        return None
+
+    def _decode_slow(self, value):
+        for fmt, parse in self._parsers:
+            try:
+                result = parse(value)
+            except ValueError:
+                continue
+            if self._fast is None:
+                # Първият успешен формат става формат на колоната
+                self.format = fmt
+                self._fast = parse
+            else:
+                self.fallbacks += 1
+            return result
+
+        # strptime приема и числа без водеща нула (5/1/2025 7:05)
+        for fmt in self.formats:
+            try:
+                result = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            self.fallbacks += 1
+            return result
+
+        self.rejected += 1
+        return None
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+История на GPS записите и travel blocks по камиони (SQLite).
+
+Месечните GPS експорти се застъпват, а курсовете минават през границата на
+месеца. Хранилището пази вече обработените записи, затворените блокове и
+състоянието на всеки камион: watermark (start_time на последния подаден
+запис), позицията в поредицата му от записи и отворения блок. Така нов
+файл обработва само записите след watermark-а, а курс, започнал миналия
+месец, продължава от запазения отворен блок.
+
+Датите се пазят като ISO низове, за да се сортират правилно в SQL.
+Липсващият адрес се пази като '' (колоните на PRIMARY KEY на WITHOUT ROWID
+таблица не приемат NULL) и се чете обратно като None.
+Държавите се пазят по име, защото кодовете зависят от таблицата с
+маркери; държавите по дни на блока са JSON списък. Пазят се и държавите
+на записите, защото може да са определени по координати, които не са в
+историята. Редовете са tuples; TravelBlock/GpsRecord се сглобяват в app.py.
+
+Всяка обработка е една транзакция за запис (BEGIN IMMEDIATE), затова
+извикващият подготвя данните (парсва файловете) преди session().
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    truck TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT,
+    from_addr TEXT,
+    to_addr TEXT,
+    source TEXT,
+    from_country TEXT,
+    to_country TEXT,
+    PRIMARY KEY (truck, start_time, end_time, from_addr, to_addr)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS blocks (
+    truck TEXT NOT NULL,
+    start_date TEXT,
+    end_date TEXT,
+    country TEXT,
+    first_record INTEGER,
+    last_record INTEGER,
+    records_count INTEGER,
+    days INTEGER,
+    day_countries TEXT
+);
+CREATE INDEX IF NOT EXISTS blocks_truck_end ON blocks (truck, end_date);
+
+CREATE TABLE IF NOT EXISTS truck_state (
+    truck TEXT PRIMARY KEY,
+    watermark TEXT,
+    position INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS open_blocks (
+    truck TEXT PRIMARY KEY,
+    start_date TEXT,
+    end_date TEXT,
+    country TEXT,
+    first_record INTEGER,
+    last_record INTEGER,
+    records_count INTEGER,
+    days INTEGER,
+    day_countries TEXT
+);
+"""
+
+BLOCK_COLUMNS = ('start_date, end_date, country, first_record, last_record, records_count, days, '
+                 'day_countries')
+
+
+def to_db_time(value):
+    return value.isoformat(sep=' ') if isinstance(value, datetime) else value
+
+
+def to_db_addr(value):
+    return '' if value is None else value
+
+
+def from_db_addr(value):
+    return value or None
+
+
+def from_db_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class TruckState:
+    __slots__ = ('watermark', 'position', 'open_block')
+
+    def __init__(self, watermark, position, open_block):
+        self.watermark = watermark
+        self.position = position
+        self.open_block = open_block
+
+
+MIGRATIONS = (
+    ('blocks', 'day_countries'),
+    ('open_blocks', 'day_countries'),
+    ('records', 'from_country'),
+    ('records', 'to_country'),
+)
+
+
+def _migrate(conn):
+    """Колоните, добавени след първата версия (старите редове са с NULL)"""
+    for table, column in MIGRATIONS:
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+
+
+def _block_to_db(truck, block):
+    start_date, end_date, country, first, last, count, days, day_countries = block
+    return (truck, to_db_time(start_date), to_db_time(end_date), country, first, last, count, days,
+            json.dumps(day_countries, ensure_ascii=False))
+
+
+def _block_from_db(row):
+    start_date, end_date, country, first, last, count, days, day_countries = row
+    return (from_db_time(start_date), from_db_time(end_date), country, first, last, count, days,
+            json.loads(day_countries) if day_countries else None)
+
+
+class HistorySession:
+    """Операции в една транзакция (виж HistoryStore.session)"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.new_records = 0
+
+    def add_record(self, truck, start_time, end_time, from_addr, to_addr, source,
+                   from_country=None, to_country=None):
+        """
+        Записва запис; False, ако вече е в историята. Друго нарушение на
+        ограниченията (напр. липсващо време) е sqlite3.IntegrityError.
+        """
+        cur = self._conn.execute(
+            'INSERT INTO records (truck, start_time, end_time, from_addr, to_addr, source, '
+            'from_country, to_country) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (truck, start_time, end_time, from_addr, to_addr) DO NOTHING',
+            (truck, to_db_time(start_time), to_db_time(end_time), to_db_addr(from_addr),
+             to_db_addr(to_addr), source, from_country, to_country))
+        if cur.rowcount:
+            self.new_records += 1
+            return True
+        return False
+
+    def truck_records(self, truck):
+        """
+        Всички записи на камион, подредени по start_time; държавите са
+        None за записи от история отпреди колоните from_country/to_country
+        """
+        cur = self._conn.execute(
+            'SELECT start_time, end_time, from_addr, to_addr, source, from_country, to_country '
+            'FROM records WHERE truck = ? ORDER BY start_time', (truck,))
+        for start_time, end_time, from_addr, to_addr, source, from_country, to_country in cur:
+            yield (from_db_time(start_time), from_db_time(end_time), from_db_addr(from_addr),
+                   from_db_addr(to_addr), source, from_country, to_country)
+
+    def truck_state(self, truck):
+        """TruckState на камион или None, ако камионът е нов"""
+        row = self._conn.execute(
+            'SELECT watermark, position FROM truck_state WHERE truck = ?', (truck,)).fetchone()
+        if row is None:
+            return None
+        open_block = self._conn.execute(
+            f'SELECT {BLOCK_COLUMNS} FROM open_blocks WHERE truck = ?', (truck,)).fetchone()
+        return TruckState(from_db_time(row[0]), row[1],
+                          _block_from_db(open_block) if open_block else None)
+
+    def save_state(self, truck, watermark, position, open_block):
+        """open_block: tuple с полетата от BLOCK_COLUMNS или None"""
+        self._conn.execute('INSERT OR REPLACE INTO truck_state VALUES (?, ?, ?)',
+                           (truck, to_db_time(watermark), position))
+        self._conn.execute('DELETE FROM open_blocks WHERE truck = ?', (truck,))
+        if open_block:
+            self._conn.execute('INSERT INTO open_blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               _block_to_db(truck, open_block))
+
+    def add_blocks(self, truck, blocks):
+        """Затворени блокове (tuples с полетата от BLOCK_COLUMNS)"""
+        self._conn.executemany('INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               [_block_to_db(truck, block) for block in blocks])
+
+    def clear_truck(self, truck):
+        """Трие блоковете и състоянието на камион (за пълно преизчисляване)"""
+        for table in ('blocks', 'open_blocks', 'truck_state'):
+            self._conn.execute(f'DELETE FROM {table} WHERE truck = ?', (truck,))
+
+    def blocks_since(self, truck, since):
+        """Затворените блокове на камион, завършили след since, по start_date"""
+        cur = self._conn.execute(
+            f'SELECT {BLOCK_COLUMNS} FROM blocks WHERE truck = ? AND end_date >= ? '
+            'ORDER BY start_date', (truck, to_db_time(since)))
+        for row in cur:
+            yield _block_from_db(row)
+
+
+class HistoryStore:
+    """
+    SQLite файл с историята. Връзката е една за процеса и се пази с lock;
+    няколко процеса (gunicorn workers) се редуват чрез заключването на SQLite.
+    """
+
+    def __init__(self, path, timeout=60):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        _migrate(self._conn)
+
+    @contextmanager
+    def session(self):
+        """
+        Транзакция за запис: commit при успех, rollback при изключение.
+        Докато е отворена, другите процеси чакат заключването на SQLite -
+        в нея не се парсва.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield HistorySession(self._conn)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def stats(self):
+        with self._lock:
+            count = lambda table: self._conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            return {'records': count('records'), 'blocks': count('blocks'),
+                    'trucks': count('truck_state')}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
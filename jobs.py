@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Фонови задачи за /process.
+
+Задачите се изпълняват в локален пул от нишки в същия процес, а
+състоянието им (етапи, брой записи, резултат) се пази в паметта на
+процеса. Приключилите задачи се пазят ttl секунди и най-много max_jobs.
+"""
+
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+
+class Job:
+    """
+    Една задача и прогресът ѝ по етапи.
+    Пайплайнът отчита прогреса чрез start/advance/done (интерфейс, който
+    приема и run_pipeline в app.py).
+    """
+
+    def __init__(self, stages):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.stages = {name: {'name': name, 'label': label, 'status': QUEUED, 'records': 0}
+                       for name, label in stages}
+
+    # Етапи извън списъка на задачата (напр. тези, които се мерят само в
+    # метриките) се игнорират
+
+    def start(self, stage):
+        if stage in self.stages:
+            self.stages[stage]['status'] = RUNNING
+
+    def advance(self, stage, records):
+        if stage in self.stages:
+            self.stages[stage]['records'] = records
+
+    def done(self, stage, records=None):
+        if stage not in self.stages:
+            return
+        if records is not None:
+            self.stages[stage]['records'] = records
+        self.stages[stage]['status'] = DONE
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stages': [dict(stage) for stage in self.stages.values()],
+            'error': self.error,
+            'elapsed': round((self.finished or time.time()) - self.created, 2)
+        }
+
+
+class JobManager:
+    """Пул от нишки + речник на задачите"""
+
+    def __init__(self, workers=2, ttl=3600, max_jobs=100):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jetom-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+
+    def submit(self, stages, fn, *args, **kwargs):
+        """
+        Пуска fn(job, *args, **kwargs) във фонов режим.
+        Върнатото от fn става job.result; изключение → job.error.
+        """
+        job = Job(stages)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = ERROR
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_count(self):
+        """Брой чакащи и текущи задачи"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.finished is None)
+
+    def _prune(self):
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished is not None]
+        for job in finished:
+            if now - job.finished > self.ttl:
+                del self._jobs[job.id]
+
+        # При твърде много задачи изхвърляме най-старите приключили
+        excess = len(self._jobs) - self.max_jobs + 1
+        if excess > 0:
+            finished = sorted((job for job in self._jobs.values() if job.finished is not None),
+                              key=lambda job: job.finished)
+            for job in finished[:excess]:
+                del self._jobs[job.id]
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики на обработката по етапи.
+
+RequestMetrics мери една заявка: време, брой записи и записи/сек за всеки
+етап, пик на паметта (само ако tracemalloc е пуснат, напр. с
+JETOM_TRACE_MEMORY=1) и попаденията в кешовете по време на заявката.
+Има интерфейса на прогреса (start/advance/done), затова run_pipeline го
+приема направо, а прогресът на фонова задача се препраща нататък.
+
+MetricsRegistry натрупва метриките от всички заявки на процеса и ги дава
+в текстовия формат на Prometheus за /metrics. Както JOBS и RESULTS, и
+регистърът е в паметта на процеса (при няколко gunicorn workers всеки
+има свой).
+"""
+
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+MB = 1024 * 1024
+
+
+def max_rss_bytes():
+    """Пикът на RSS на процеса (ru_maxrss е в KB на Linux и в байтове на macOS)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class RequestMetrics:
+    """
+    Метрики на една заявка.
+    caches: функция, която връща {име: (hits, misses)} за кешовете;
+    разликата между началото и finish() е попаденията на заявката
+    (приблизително, ако няколко заявки вървят едновременно).
+    """
+
+    def __init__(self, progress=None, caches=None):
+        self.progress = progress
+        self._caches = caches
+        self._caches_before = caches() if caches else {}
+        self.created = time.perf_counter()
+        self.stages = {}
+        self._open = {}
+        self.cache_stats = {}
+        self.total_seconds = None
+
+    def _fold_peak(self):
+        # Пикът на tracemalloc е общ: преди всяко нулиране се прехвърля във
+        # всички отворени етапи, за да не се губи при вложени етапи
+        if tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1]
+            for stage in self._open.values():
+                stage['peak'] = max(stage['peak'], peak)
+            return peak
+        return None
+
+    def start(self, stage):
+        if self._fold_peak() is not None:
+            tracemalloc.reset_peak()
+        self._open[stage] = {'started': time.perf_counter(), 'peak': 0}
+        if self.progress is not None:
+            self.progress.start(stage)
+
+    def advance(self, stage, records):
+        if self.progress is not None:
+            self.progress.advance(stage, records)
+
+    def done(self, stage, records=None):
+        self._fold_peak()
+        opened = self._open.pop(stage, None)
+        if opened is not None:
+            seconds = time.perf_counter() - opened['started']
+            entry = {'seconds': round(seconds, 4), 'records': records}
+            if records and seconds > 0:
+                entry['records_per_sec'] = round(records / seconds)
+            if tracemalloc.is_tracing():
+                entry['peak_mb'] = round(opened['peak'] / MB, 2)
+            self.stages[stage] = entry
+        if self.progress is not None:
+            self.progress.done(stage, records)
+
+    def finish(self):
+        """Затваря заявката: общо време и попадения в кешовете"""
+        self.total_seconds = round(time.perf_counter() - self.created, 4)
+        if self._caches:
+            for name, (hits, misses) in self._caches().items():
+                before_hits, before_misses = self._caches_before.get(name, (0, 0))
+                hits -= before_hits
+                misses -= before_misses
+                lookups = hits + misses
+                self.cache_stats[name] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': round(hits / lookups, 3) if lookups else None
+                }
+        return self
+
+    def to_dict(self):
+        """Блокът timings в отговора на /process"""
+        return {
+            'total_seconds': self.total_seconds,
+            'stages': self.stages,
+            'caches': self.cache_stats,
+            'max_rss_mb': round(max_rss_bytes() / MB, 1)
+        }
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    """Натрупани метрики по етапи, заявки и кешове за /metrics"""
+
+    def __init__(self, prefix='jetom'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._requests = {}
+        self._cache_lookups = {}
+
+    def observe(self, endpoint, status, metrics=None):
+        """Отчита приключила заявка и (ако има) метриките ѝ"""
+        with self._lock:
+            key = (endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if metrics is None:
+                return
+
+            for name, entry in metrics.stages.items():
+                stage = self._stages.get(name)
+                if stage is None:
+                    stage = self._stages[name] = {'count': 0, 'seconds': 0.0, 'records': 0,
+                                                  'max_seconds': 0.0, 'peak_mb': None}
+                stage['count'] += 1
+                stage['seconds'] += entry['seconds']
+                stage['records'] += entry['records'] or 0
+                stage['max_seconds'] = max(stage['max_seconds'], entry['seconds'])
+                if 'peak_mb' in entry:
+                    stage['peak_mb'] = max(stage['peak_mb'] or 0, entry['peak_mb'])
+
+            for name, entry in metrics.cache_stats.items():
+                lookups = self._cache_lookups.setdefault(name, {'hits': 0, 'misses': 0})
+                lookups['hits'] += entry['hits']
+                lookups['misses'] += entry['misses']
+
+    def render(self, gauges=None):
+        """
+        Текстов формат на Prometheus.
+        gauges: допълнителни {име: стойност} (заетост на кешове и т.н.)
+        """
+        p = self.prefix
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {p}_{name} {help_text}')
+            lines.append(f'# TYPE {p}_{name} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{p}_{name}{suffix}{labels} {value}')
+
+        with self._lock:
+            metric('requests_total', 'counter', 'Завършени заявки по endpoint и статус',
+                   [('', _labels(endpoint=endpoint, status=status), count)
+                    for (endpoint, status), count in sorted(self._requests.items())])
+
+            stages = sorted(self._stages.items())
+            metric('stage_duration_seconds', 'summary', 'Време на етапите на обработката',
+                   [(suffix, _labels(stage=name), value) for name, stage in stages
+                    for suffix, value in (('_sum', round(stage['seconds'], 4)),
+                                          ('_count', stage['count']))])
+            metric('stage_duration_seconds_max', 'gauge', 'Най-дългото изпълнение на етап',
+                   [('', _labels(stage=name), stage['max_seconds']) for name, stage in stages])
+            metric('stage_records_total', 'counter', 'Обработени записи по етап',
+                   [('', _labels(stage=name), stage['records']) for name, stage in stages])
+            metric('stage_records_per_second', 'gauge', 'Средна пропускливост на етап',
+                   [('', _labels(stage=name), round(stage['records'] / stage['seconds']))
+                    for name, stage in stages if stage['records'] and stage['seconds'] > 0])
+            metric('stage_peak_memory_bytes', 'gauge', 'Пик на паметта на етап (tracemalloc)',
+                   [('', _labels(stage=name), int(stage['peak_mb'] * MB))
+                    for name, stage in stages if stage['peak_mb'] is not None])
+
+            caches = sorted(self._cache_lookups.items())
+            metric('cache_hits_total', 'counter', 'Попадения в кеш при обработка',
+                   [('', _labels(cache=name), c['hits']) for name, c in caches])
+            metric('cache_misses_total', 'counter', 'Пропуски в кеш при обработка',
+                   [('', _labels(cache=name), c['misses']) for name, c in caches])
+
+        metric('process_max_rss_bytes', 'gauge', 'Пик на RSS на процеса',
+               [('', '', max_rss_bytes())])
+        for name, value in sorted((gauges or {}).items()):
+            metric(name, 'gauge', name.replace('_', ' '), [('', '', value)])
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Кеш на парснати файлове на локалния диск.
+
+Ключът е SHA-256 на съдържанието на файла плюс версия на парсера (и всичко
+друго, от което зависи резултатът), затова повторно качване на същия файл
+чете готовите записи, без да отваря openpyxl. Директорията се споделя от
+всички gunicorn workers: записът е атомарен (временен файл + rename), а
+при надхвърляне на лимита се трият най-отдавна ползваните файлове (LRU по
+mtime, който се обновява при всяко попадение).
+
+След елементите файлът може да има и trailer - един обект с данни за
+целия файл (напр. броя отхвърлени редове при парсването).
+
+Кешът се чете с pickle, затова директорията трябва да е само на
+потребителя на приложението: създава се с права 0o700, а съществуваща
+директория на друг потребител (или symlink) е грешка, не кеш.
+"""
+
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+
+CHUNK_SIZE = 5000
+_SUFFIX = '.pkl'
+
+
+def file_digest(file_path):
+    """SHA-256 на съдържанието на файл (път или seekable файлов обект)"""
+    h = hashlib.sha256()
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+        for block in iter(lambda: file_path.read(1 << 20), b''):
+            h.update(block)
+        file_path.seek(0)
+        return h.hexdigest()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class CacheWriter:
+    """
+    Поточно записване на елементи в кеша на порции от CHUNK_SIZE.
+    Файлът се появява под ключа си едва при commit(); abort() го изтрива.
+    """
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._key = key
+        fd, self._tmp_path = tempfile.mkstemp(dir=cache.directory, suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self._chunk = []
+
+    def _flush(self):
+        if self._chunk:
+            pickle.dump(self._chunk, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+            self._chunk = []
+
+    def add(self, item):
+        self._chunk.append(item)
+        if len(self._chunk) >= CHUNK_SIZE:
+            self._flush()
+
+    def commit(self, trailer=None):
+        self._flush()
+        if trailer is not None:
+            # Порциите са списъци, trailer-ът е dict
+            pickle.dump(dict(trailer), self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.close()
+        os.replace(self._tmp_path, self._cache._path(self._key))
+        self._cache._evict()
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+def _private_directory(directory):
+    """
+    Създава directory само за текущия потребител или проверява съществуващата.
+    ValueError, ако е symlink, не е директория или е на друг потребител.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode):
+        raise ValueError(f'Кешът на парсера не е директория: {directory}')
+    if hasattr(os, 'getuid'):
+        if st.st_uid != os.getuid():
+            raise ValueError(f'Кешът на парсера е на друг потребител: {directory}')
+        if stat.S_IMODE(st.st_mode) & 0o077:
+            # Директория от по-стара версия - само за собственика
+            os.chmod(directory, 0o700)
+
+
+class ParseCache:
+    """Content-addressed кеш с LRU изчистване до max_bytes"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        _private_directory(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def make_key(self, file_path, *parts):
+        """Ключ: хеш на съдържанието на файла + parts (версия, вид, ...)"""
+        h = hashlib.sha256(file_digest(file_path).encode())
+        for part in parts:
+            h.update(b'\0' + str(part).encode('utf-8'))
+        return h.hexdigest()
+
+    def read(self, key, on_trailer=None):
+        """
+        Итератор върху кешираните елементи или None при липса.
+        on_trailer(trailer) се вика, когато итераторът стигне до trailer-а.
+        """
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return self._iter_file(f, on_trailer)
+
+    @staticmethod
+    def _iter_file(f, on_trailer=None):
+        with f:
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    return
+                if isinstance(chunk, dict):
+                    if on_trailer is not None:
+                        on_trailer(chunk)
+                    continue
+                yield from chunk
+
+    def writer(self, key):
+        return CacheWriter(self, key)
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(_SUFFIX):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def stats(self):
+        """Попадения/пропуски на този процес и заетост на директорията"""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes
+        }
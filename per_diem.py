@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Дневни (командировъчни) ставки в EUR по държава и дата.
+
+Ставките са в таблица (data/per_diem_rates.json): за всяка държава списък
+от {"from": "YYYY-MM-DD", "rate": ...}, всяка ставка важи от датата си до
+следващата. "default" е за държави без собствени ставки (и за дни преди
+първата им ставка). Държавите са по име, както в таблицата с маркери, а
+търсенето е по кода им от CountryClassifier.
+
+Таблицата се подготвя веднъж: за всеки код на държава подредени дати на
+влизане в сила (вече слети със ставките по подразбиране), така че
+ставката за (държава, ден) е едно bisect търсене, а rates() дава
+ставките за поредица дни в една държава с едно търсене, не по едно на ден.
+"""
+
+import json
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+DEFAULT_RATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'data', 'per_diem_rates.json')
+
+
+def load_rate_table(path=DEFAULT_RATES_PATH):
+    """Зарежда таблицата със ставки от JSON файл"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _periods(entries, label):
+    """[{"from", "rate"}] → (подредени начала като ординали на дати, ставки)"""
+    if not entries:
+        raise ValueError(f'Няма ставки за {label}')
+    try:
+        periods = sorted((date.fromisoformat(entry['from']).toordinal(), entry['rate'])
+                         for entry in entries)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f'Невалидна ставка за {label}: {e}') from None
+    for _, rate in periods:
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate < 0:
+            raise ValueError(f'Невалидна ставка за {label}: {rate!r}')
+    return [start for start, _ in periods], [rate for _, rate in periods]
+
+
+def _with_default(default, own):
+    """Ставките на държава, предхождани от тези по подразбиране преди първата ѝ"""
+    if own is None:
+        return default
+    n = bisect_left(default[0], own[0][0])
+    return default[0][:n] + own[0], default[1][:n] + own[1]
+
+
+class PerDiemRates:
+    """
+    (код на държава, ден) → EUR ставка.
+    ValueError при държава, която я няма в класификатора, или невалиден ред.
+    """
+
+    def __init__(self, table, classifier):
+        default = _periods(table.get('default'), 'default')
+        own = {}
+        for name, entries in table.get('countries', {}).items():
+            try:
+                code = classifier.code_of(name)
+            except KeyError:
+                raise ValueError(f'Непозната държава в ставките: {name!r}') from None
+            own[code] = _periods(entries, name)
+        # По една подредена таблица на всеки код от класификатора
+        self._tables = [_with_default(default, own.get(code)) for code in range(len(classifier.names))]
+
+    @classmethod
+    def from_file(cls, classifier, path=DEFAULT_RATES_PATH):
+        return cls(load_rate_table(path), classifier)
+
+    def rate(self, code, day):
+        """Ставката за държава (код) в ден (date или datetime)"""
+        starts, rates = self._tables[code]
+        # Преди първата ставка важи първата
+        return rates[max(bisect_right(starts, day.toordinal()) - 1, 0)]
+
+    def rates(self, code, first_day, days):
+        """
+        Ставките на държава (код) за days дни от first_day (ординал на дата)
+        Returns: [(отместване в дни, ставка)] - от ден 0 и при всяка смяна
+        """
+        starts, rates = self._tables[code]
+        i = max(bisect_right(starts, first_day) - 1, 0)
+        result = [(0, rates[i])]
+        end = first_day + days
+        for i in range(i + 1, len(starts)):
+            if starts[i] >= end:
+                break
+            result.append((starts[i] - first_day, rates[i]))
+        return result
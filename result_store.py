@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Резултати от /process, пазени на сървъра под result_id.
+
+Редовете се пазят като tuples (ROW_FIELDS), а не като dicts, за да е
+по-малка паметта. Хранилището е LRU с TTL и таван на общия брой редове,
+така че паметта на процеса остава ограничена.
+
+StoredResult.query връща една страница от редовете (филтрирани и
+сортирани на сървъра) заедно със сумите по шофьор, за да не се праща
+целият резултат на браузъра.
+"""
+
+import math
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date
+
+ROW_FIELDS = ('driver', 'truck', 'block_num', 'start_date', 'end_date',
+              'country', 'days', 'eur_rate', 'records_count')
+
+# Полета, които потребителят може да коригира преди експорт
+EDITABLE_FIELDS = {'days': int, 'eur_rate': float}
+
+_FIELD_INDEX = {field: idx for idx, field in enumerate(ROW_FIELDS)}
+DRIVER, TRUCK, BLOCK_NUM, START_DATE, END_DATE, COUNTRY, DAYS, EUR_RATE = (
+    _FIELD_INDEX[f] for f in ('driver', 'truck', 'block_num', 'start_date', 'end_date', 'country',
+                              'days', 'eur_rate'))
+
+# Сортиране: полетата на реда плюс изчислените суми
+SORT_FIELDS = set(ROW_FIELDS) | {'eur_sum', 'bgn_sum'}
+DEFAULT_PER_PAGE = 100
+MAX_PER_PAGE = 500
+
+# Датите в редовете са 'DD.MM.YYYY HH:MM' (_format_block_date в app.py)
+_ROW_DATE_RE = re.compile(r'^(\d{2})\.(\d{2})\.(\d{4})(.*)$')
+
+
+def _date_key(value):
+    """'DD.MM.YYYY HH:MM' → 'YYYY-MM-DD HH:MM' (сравнява се като низ)"""
+    m = _ROW_DATE_RE.match(value or '')
+    if m is None:
+        return value or ''
+    day, month, year, rest = m.groups()
+    return f'{year}-{month}-{day}{rest}'
+
+
+def _nullable_key(value):
+    # None (напр. шофьор без mapping) отива в края при възходящ ред
+    return (value is None, value if value is not None else '')
+
+
+class ResultQuery:
+    """
+    Страница, сортиране и филтри за StoredResult.query.
+    driver/truck търсят подниз (без значение от малки/главни букви),
+    country е точно съвпадение, date_from/date_to (YYYY-MM-DD) оставят
+    блоковете, които се застъпват с периода.
+    """
+
+    __slots__ = ('page', 'per_page', 'sort', 'descending', 'driver', 'truck',
+                 'country', 'date_from', 'date_to')
+
+    def __init__(self, page=1, per_page=DEFAULT_PER_PAGE, sort=None, descending=False,
+                 driver=None, truck=None, country=None, date_from=None, date_to=None):
+        self.page = page
+        self.per_page = per_page
+        self.sort = sort
+        self.descending = descending
+        self.driver = driver
+        self.truck = truck
+        self.country = country
+        self.date_from = date_from
+        self.date_to = date_to
+
+    @classmethod
+    def from_args(cls, args):
+        """От query string (request.args); ValueError при невалидни параметри"""
+        page = int(args.get('page', 1))
+        per_page = int(args.get('per_page', DEFAULT_PER_PAGE))
+        if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+            raise ValueError(f'page >= 1, per_page от 1 до {MAX_PER_PAGE}')
+
+        sort = args.get('sort') or None
+        descending = False
+        if sort and sort.startswith('-'):
+            sort, descending = sort[1:], True
+        if sort is not None and sort not in SORT_FIELDS:
+            raise ValueError(f'Невалидно сортиране: {sort}')
+
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            value = args.get(name)
+            # date.fromisoformat валидира, а за сравнението е нужен низът
+            dates[name] = date.fromisoformat(value).isoformat() if value else None
+
+        text = lambda name: (args.get(name) or '').strip() or None
+        driver = text('driver')
+        truck = text('truck')
+        return cls(page, per_page, sort, descending,
+                   driver.casefold() if driver else None,
+                   truck.casefold() if truck else None,
+                   text('country'), dates['date_from'], dates['date_to'])
+
+    def matches(self, row):
+        if self.driver is not None and self.driver not in (row[DRIVER] or '').casefold():
+            return False
+        if self.truck is not None and self.truck not in (row[TRUCK] or '').casefold():
+            return False
+        if self.country is not None and row[COUNTRY] != self.country:
+            return False
+        if self.date_from is not None and _date_key(row[END_DATE])[:10] < self.date_from:
+            return False
+        if self.date_to is not None and _date_key(row[START_DATE])[:10] > self.date_to:
+            return False
+        return True
+
+
+class StoredResult:
+    __slots__ = ('id', 'rows', 'stats', 'created', 'last_access')
+
+    def __init__(self, rows, stats):
+        self.id = uuid.uuid4().hex
+        self.rows = [tuple(row[field] for field in ROW_FIELDS) for row in rows]
+        self.stats = stats
+        self.created = self.last_access = time.time()
+
+    def _sort_key(self, field, eur_to_bgn):
+        if field in ('start_date', 'end_date'):
+            idx = _FIELD_INDEX[field]
+            return lambda i: _date_key(self.rows[i][idx])
+        if field == 'eur_sum':
+            return lambda i: self.rows[i][DAYS] * self.rows[i][EUR_RATE]
+        if field == 'bgn_sum':
+            return lambda i: self.rows[i][DAYS] * self.rows[i][EUR_RATE] * eur_to_bgn
+        idx = _FIELD_INDEX[field]
+        return lambda i: _nullable_key(self.rows[i][idx])
+
+    def query(self, q, eur_to_bgn):
+        """
+        Една страница от редовете по ResultQuery.
+        Всеки ред има и index (позицията му в резултата, за edits при експорт)
+        и сумите eur_sum/bgn_sum. totals е за всички филтрирани редове, а
+        driver_totals - за шофьорите от страницата (по всички техни
+        филтрирани редове). Шофьор без mapping е камионът, както в експорта.
+        """
+        rows = self.rows
+        indexes = [i for i, row in enumerate(rows) if q.matches(row)]
+        if q.sort is not None:
+            indexes.sort(key=self._sort_key(q.sort, eur_to_bgn), reverse=q.descending)
+
+        total = len(indexes)
+        pages = max(1, math.ceil(total / q.per_page))
+        start = (q.page - 1) * q.per_page
+        page_indexes = indexes[start:start + q.per_page]
+
+        page_rows = []
+        for i in page_indexes:
+            row = dict(zip(ROW_FIELDS, rows[i]))
+            row['index'] = i
+            row['eur_sum'] = round(row['days'] * row['eur_rate'], 2)
+            row['bgn_sum'] = round(row['eur_sum'] * eur_to_bgn, 2)
+            page_rows.append(row)
+
+        page_drivers = {rows[i][DRIVER] or rows[i][TRUCK] for i in page_indexes}
+        all_totals = _new_totals()
+        driver_totals = {driver: _new_totals() for driver in page_drivers}
+        for i in indexes:
+            row = rows[i]
+            _add_totals(all_totals, row, eur_to_bgn)
+            key = row[DRIVER] or row[TRUCK]
+            if key in driver_totals:
+                _add_totals(driver_totals[key], row, eur_to_bgn)
+
+        return {
+            'result_id': self.id,
+            'page': q.page,
+            'per_page': q.per_page,
+            'pages': pages,
+            'total': total,
+            'rows': page_rows,
+            'totals': _round_totals(all_totals),
+            'driver_totals': {driver: _round_totals(t) for driver, t in sorted(driver_totals.items())},
+        }
+
+    def driver_totals(self, q, eur_to_bgn):
+        """Сумите по шофьор за всички филтрирани редове, по име"""
+        totals = {}
+        for row in self.rows:
+            if q.matches(row):
+                key = row[DRIVER] or row[TRUCK]
+                _add_totals(totals.setdefault(key, _new_totals()), row, eur_to_bgn)
+        return [dict(_round_totals(t), driver=driver) for driver, t in sorted(totals.items())]
+
+    def countries(self):
+        return sorted({row[COUNTRY] for row in self.rows})
+
+    def iter_rows(self, edits=None):
+        """
+        Редовете като dicts, с приложени корекции.
+        edits: { индекс на ред: { поле: стойност } }
+        """
+        edits = edits or {}
+        for idx, values in enumerate(self.rows):
+            row = dict(zip(ROW_FIELDS, values))
+            if idx in edits:
+                row.update(edits[idx])
+            yield row
+
+
+def _new_totals():
+    # blocks: блок с няколко държави/ставки е на няколко реда - брои се веднъж
+    return {'blocks': set(), 'days': 0, 'eur': 0.0, 'bgn': 0.0}
+
+
+def _add_totals(totals, row, eur_to_bgn):
+    eur = row[DAYS] * row[EUR_RATE]
+    totals['blocks'].add((row[DRIVER], row[TRUCK], row[BLOCK_NUM]))
+    totals['days'] += row[DAYS]
+    totals['eur'] += eur
+    totals['bgn'] += eur * eur_to_bgn
+
+
+def _round_totals(totals):
+    return dict(totals, blocks=len(totals['blocks']), eur=round(totals['eur'], 2),
+                bgn=round(totals['bgn'], 2))
+
+
+def parse_edits(raw_edits, row_count):
+    """
+    Валидира корекциите от клиента: [{'index': i, 'days': ..., 'eur_rate': ...}]
+    Returns: { index: { поле: стойност } }; ValueError при невалидни данни
+    """
+    edits = {}
+    for raw in raw_edits or []:
+        idx = int(raw['index'])
+        if not 0 <= idx < row_count:
+            raise ValueError(f'Невалиден ред: {idx}')
+        changes = {}
+        for field, cast in EDITABLE_FIELDS.items():
+            if field in raw:
+                changes[field] = cast(raw[field])
+        edits.setdefault(idx, {}).update(changes)
+    return edits
+
+
+class ResultStore:
+    """LRU хранилище с TTL и таван max_rows на общия брой редове"""
+
+    def __init__(self, ttl=3600, max_rows=500000):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._results = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def put(self, rows, stats):
+        result = StoredResult(rows, stats)
+        with self._lock:
+            self._results[result.id] = result
+            self._rows += len(result.rows)
+            self._prune()
+        return result.id
+
+    def get(self, result_id):
+        with self._lock:
+            self._prune()
+            result = self._results.get(result_id)
+            if result is not None:
+                result.last_access = time.time()
+                self._results.move_to_end(result_id)
+            return result
+
+    def _drop(self, result_id):
+        result = self._results.pop(result_id)
+        self._rows -= len(result.rows)
+
+    def _prune(self):
+        now = time.time()
+        expired = [rid for rid, r in self._results.items() if now - r.last_access > self.ttl]
+        for rid in expired:
+            self._drop(rid)
+
+        # Най-отдавна ползваните отпадат първи; последният добавен остава
+        while self._rows > self.max_rows and len(self._results) > 1:
+            self._drop(next(iter(self._results)))
+
+    def stats(self):
+        with self._lock:
+            return {'results': len(self._results), 'rows': self._rows, 'max_rows': self.max_rows}
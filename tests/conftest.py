@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""Общи настройки на тестовете: модулите са в корена на репото."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# app.py чете настройките при import - без кеш на диска и без история
+os.environ.setdefault('JETOM_PARSE_CACHE_MB', '0')
+os.environ.pop('JETOM_HISTORY_DB', None)
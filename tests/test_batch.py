@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Комплектите на batch.py: откриване в директория и грешка за невалиден файл."""
+
+import batch
+from test_csv_reader import GPS1_CSV
+
+
+def make_set(directory, files):
+    directory.mkdir()
+    for name, data in files.items():
+        (directory / name).write_bytes(data)
+    return directory
+
+
+def test_csv_set_keeps_gps_files_out_of_the_mapping(tmp_path):
+    make_set(tmp_path / 'march', {'gps1.csv': b'', 'gps2.csv': b'', 'drivers.csv': b''})
+    (found,) = batch.discover_sets(str(tmp_path))
+    assert found.name == 'march'
+    assert found.gps1.endswith('gps1.csv')
+    assert found.gps2.endswith('gps2.csv')
+    assert found.mapping.endswith('drivers.csv')
+
+
+def test_set_without_mapping(tmp_path):
+    make_set(tmp_path / 'april', {'gps1_april.xlsx': b'', 'gps2_april.csv': b''})
+    (found,) = batch.discover_sets(str(tmp_path))
+    assert found.gps2.endswith('gps2_april.csv')
+    assert found.mapping is None
+
+
+def test_set_with_invalid_gps_file_fails(tmp_path):
+    good = make_set(tmp_path / 'good', {'gps1.csv': GPS1_CSV.encode('utf-8')})
+    bad = make_set(tmp_path / 'bad', {'gps1.csv': b'hello world\nthis is not a csv\n'})
+    out = tmp_path / 'out'
+    assert batch.main([str(good), '--out', str(out), '--workers', '1', '--format', 'csv']) == 0
+    assert batch.main([str(bad), '--out', str(out), '--workers', '1', '--format', 'csv']) == 1
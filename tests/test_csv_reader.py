@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Разпознаване на CSV експортите (is_csv) и грешката за други файлове."""
+
+import io
+
+import app
+from csv_reader import is_csv
+
+GPS1_CSV = ('Отчет за пътувания\nПериод:;01.03.2025 - 31.03.2025\n\n\n\n\n\n'
+            'Обект;Начало;Край;Начален адрес;Краен адрес\n'
+            'CA1234AB;2025-03-01 08:00:00;2025-03-01 18:00:00;София, България;Bucuresti, Romania\n')
+
+
+def upload(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_gps1_export_is_csv(tmp_path):
+    path = upload(tmp_path, 'gps1.csv', GPS1_CSV.encode('utf-8-sig'))
+    assert is_csv(path, 5)
+    assert [rec.truck for rec in app.iter_gps1(path)] == ['CA1234AB']
+
+
+def test_text_without_columns_is_not_csv(tmp_path):
+    assert not is_csv(upload(tmp_path, 'notes.txt', 'hello world\nthis is not a csv\n'.encode()))
+    # Разделители без стойности не са колони
+    assert not is_csv(upload(tmp_path, 'empty.csv', b';;;;;\n;;;;;\n'), 5)
+    assert not is_csv(upload(tmp_path, 'zip.csv', b'PK\x03\x04' + b'x' * 100))
+
+
+def test_header_may_have_untitled_columns(tmp_path):
+    header = (['№', 'Обект', 'Начален адрес', '', 'Начална дата'] + [''] * 5
+              + ['Краен адрес', '', 'Крайна дата'])
+    assert app.is_gps2_csv(upload(tmp_path, 'gps2.csv', ';'.join(header).encode('utf-8')))
+
+
+def test_gps1_export_is_too_narrow_for_gps2(tmp_path):
+    assert not app.is_gps2_csv(upload(tmp_path, 'gps1.csv', GPS1_CSV.encode('utf-8')))
+
+
+def test_process_rejects_text_that_is_not_csv():
+    client = app.app.test_client()
+    for field in ('gps1_file', 'gps2_file'):
+        files = {'gps1_file': (io.BytesIO(GPS1_CSV.encode('utf-8')), 'gps1.csv')}
+        files[field] = (io.BytesIO(b'hello world\nthis is not a csv\n'), 'notes.txt')
+        response = client.post('/process', data=files)
+        assert response.status_code == 400
+        assert 'notes.txt не е .xlsx или CSV' in response.get_json()['error']
+
+    # Отказва се и преди фонова задача
+    files = {'gps1_file': (io.BytesIO(b'\x00\x01garbage'), 'gps1.xlsx'), 'async': '1'}
+    assert client.post('/process', data=files).status_code == 400
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Държава по координати (GeoClassifier) и приоритетът на адреса в location_code."""
+
+import pytest
+
+import app
+
+BULGARIA = 'България'
+ROMANIA = 'Румъния'
+
+# (ширина, дължина) на градове от двете страни на границите
+POINTS = [
+    ('Видин', 43.99, 22.88, BULGARIA),
+    ('Калафат', 43.99, 22.93, ROMANIA),
+    ('Лом', 43.826, 23.237, BULGARIA),
+    ('Никопол', 43.705, 24.895, BULGARIA),
+    ('Турну Мъгуреле', 43.75, 24.87, ROMANIA),
+    ('Свищов', 43.62, 25.345, BULGARIA),
+    ('Зимнича', 43.66, 25.37, ROMANIA),
+    ('Русе', 43.85, 25.97, BULGARIA),
+    ('Русе, пристанище', 43.856, 25.970, BULGARIA),
+    ('Гюргево', 43.90, 25.97, ROMANIA),
+    ('Силистра', 44.115, 27.26, BULGARIA),
+    ('Кълъраш', 44.20, 27.33, ROMANIA),
+    ('Кулата', 41.39, 23.36, BULGARIA),
+    ('Промахонас', 41.37, 23.36, 'Гърция'),
+    ('Капитан Андреево', 41.728, 26.33, BULGARIA),
+    ('Капъкуле', 41.715, 26.36, 'Турция'),
+    ('Созопол', 42.42, 27.70, BULGARIA),
+    ('Несебър', 42.66, 27.73, BULGARIA),
+    ('Варна, пристанище', 43.19, 27.95, BULGARIA),
+    ('Бургас', 42.50, 27.47, BULGARIA),
+    ('Калиакра', 43.36, 28.47, BULGARIA),
+    ('Мангалия', 43.81, 28.58, ROMANIA),
+    ('Констанца, пристанище', 44.17, 28.66, ROMANIA),
+]
+
+
+@pytest.mark.parametrize('name, lat, lon, country', POINTS, ids=[p[0] for p in POINTS])
+def test_border_and_coastal_points(name, lat, lon, country):
+    assert app.country_name(app.GEO_CLASSIFIER.code(lat, lon)) == country
+
+
+def test_open_sea_has_no_country():
+    assert app.GEO_CLASSIFIER.code(43.0, 30.0) is None
+
+
+def test_address_country_wins_over_coordinates():
+    # Адресът на пристанището в Русе с точка на румънския бряг
+    assert app.detect_country('Пристанище Русе, 7000 Русе, България', (43.90, 25.97)) == BULGARIA
+    assert app.detect_country('Port Giurgiu, Giurgiu, Romania', (43.856, 25.970)) == ROMANIA
+
+
+def test_coordinates_decide_unknown_addresses():
+    assert app.detect_country('Parking 12', (43.99, 22.93)) == ROMANIA
+    assert app.detect_country('', (42.42, 27.70)) == BULGARIA
+    assert app.detect_country('43.90, 25.97') == ROMANIA
+    assert app.detect_country('Parking 12') == app.COUNTRY_CLASSIFIER.fallback
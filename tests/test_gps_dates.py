@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Декодирането на датите по колони (DateDecoder)."""
+
+from datetime import datetime
+
+from gps_dates import DateDecoder, GPS1_DATE_FORMATS, GPS2_DATE_FORMATS
+
+
+def test_format_is_inferred_per_column():
+    start_dates = DateDecoder(GPS2_DATE_FORMATS)
+    end_dates = DateDecoder(GPS2_DATE_FORMATS)
+    assert start_dates.decode('01/03/2025 08:15:30') == datetime(2025, 3, 1, 8, 15, 30)
+    assert end_dates.decode('01.03.2025 18:40') == datetime(2025, 3, 1, 18, 40)
+    assert start_dates.format == '%d/%m/%Y %H:%M:%S'
+    assert end_dates.format == '%d.%m.%Y %H:%M'
+    assert start_dates.decode('02/03/2025 09:00:00') == datetime(2025, 3, 2, 9)
+    assert end_dates.decode('02.03.2025 19:05') == datetime(2025, 3, 2, 19, 5)
+    assert (start_dates.fallbacks, end_dates.fallbacks) == (0, 0)
+
+
+def test_mixed_formats_in_one_column():
+    dates = DateDecoder(GPS1_DATE_FORMATS)
+    assert dates.decode('2025-03-01 08:15:30') == datetime(2025, 3, 1, 8, 15, 30)
+    assert dates.decode('2025-03-01 08:15') == datetime(2025, 3, 1, 8, 15)
+    assert dates.decode('2025-03-01T08:15:30') == datetime(2025, 3, 1, 8, 15, 30)
+    assert dates.decode('01.03.2025 08:15:30') == datetime(2025, 3, 1, 8, 15, 30)
+    # Числа без водещи нули минават през strptime
+    assert dates.decode('2025-3-1 8:15:30') == datetime(2025, 3, 1, 8, 15, 30)
+    assert dates.format == '%Y-%m-%d %H:%M:%S'
+    assert dates.fallbacks == 4
+    assert dates.rejected == 0
+
+
+def test_fast_path_checks_separators():
+    dates = DateDecoder(GPS2_DATE_FORMATS)
+    assert dates.decode('01/03/2025 10:00') == datetime(2025, 3, 1, 10)
+    # %m-%d-%Y не е сред форматите - не бива да се чете по позиция като %d/%m/%Y
+    assert dates.decode('03-01-2025 10:00') is None
+    assert dates.rejected == 1
+
+
+def test_excel_serial_numbers():
+    dates = DateDecoder(GPS1_DATE_FORMATS)
+    assert dates.decode(45717) == datetime(2025, 3, 1)
+    assert dates.decode(45717.5) == datetime(2025, 3, 1, 12)
+    assert dates.decode(datetime(2025, 3, 1, 7)) == datetime(2025, 3, 1, 7)
+    assert dates.format is None
+    # Извън диапазона на датите и bool не са дати
+    assert dates.decode(5) is None
+    assert dates.decode(True) is None
+    assert dates.rejected == 2
+
+
+def test_rejected_values_are_counted():
+    dates = DateDecoder(GPS2_DATE_FORMATS)
+    for value in (None, '', 'няма данни', '31/02/2025 10:00', '01/03/2025'):
+        assert dates.decode(value) is None
+    assert dates.decode('01/03/2025 10:00') == datetime(2025, 3, 1, 10)
+    assert dates.rejected == 5
+    assert dates.fallbacks == 0
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Инкременталната обработка с история (HistoryStore)."""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import app
+from history_store import HistoryStore
+
+
+def trip(truck, start, hours, from_addr, to_addr):
+    return app._gps_record(truck, start, start + timedelta(hours=hours), from_addr, to_addr, 'GPS1')
+
+
+def sample_records():
+    day = datetime(2025, 3, 1, 8)
+    return [
+        trip('CA1234AB', day, 10, 'София, България', 'Bucuresti, Romania'),
+        trip('CA1234AB', day + timedelta(days=2), 10, 'Bucuresti, Romania', 'Istanbul, Turkey'),
+        trip('CA1234AB', day + timedelta(days=4), 12, 'Istanbul, Turkey', 'София, България'),
+        trip('PB5678CD', day, 8, 'Русе, България', 'Bucuresti, Romania'),
+        trip('PB5678CD', day + timedelta(days=1), 8, 'Bucuresti, Romania', 'Русе, България'),
+    ]
+
+
+def block_keys(blocks):
+    return {truck: [(b.start_date, b.end_date, b.days, bytes(b.day_countries)) for b in truck_blocks]
+            for truck, truck_blocks in blocks.items()}
+
+
+def test_records_are_read_outside_the_write_transaction(tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.db'))
+    seen = []
+
+    def records():
+        for rec in sample_records():
+            seen.append(history._conn.in_transaction)
+            yield rec
+
+    app.build_travel_blocks_incremental(records(), history)
+    assert seen and not any(seen)
+    assert history.stats()['records'] == 5
+
+
+def test_incremental_matches_full_build(tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.db'))
+    records = sample_records()
+    full = app.build_travel_blocks(records)
+
+    app.build_travel_blocks_incremental(records[:2], history)
+    blocks, stats = app.build_travel_blocks_incremental(records[2:], history)
+    assert stats['new_records'] == 3
+    assert block_keys(blocks)['CA1234AB'] == block_keys(full)['CA1234AB']
+
+    # Повторно качване: нищо ново
+    _, stats = app.build_travel_blocks_incremental(records, history)
+    assert stats['new_records'] == 0
+
+
+def test_late_record_rebuilds_truck(tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.db'))
+    records = sample_records()
+    app.build_travel_blocks_incremental(records[1:3], history)
+    blocks, stats = app.build_travel_blocks_incremental(records[:1], history)
+    assert stats['rebuilt_trucks'] == 1
+    assert block_keys(blocks)['CA1234AB'] == block_keys(app.build_travel_blocks(records[:3]))['CA1234AB']
+
+
+def test_record_with_empty_address_is_kept(tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.db'))
+    day = datetime(2025, 3, 1, 8)
+    records = [
+        trip('CA1234AB', day, 10, 'София, България', None),
+        trip('CA1234AB', day + timedelta(days=1), 10, '', 'Bucuresti, Romania'),
+        trip('CA1234AB', day + timedelta(days=2), 10, 'Bucuresti, Romania', 'София, България'),
+    ]
+    full = app.build_travel_blocks(records)
+    assert full['CA1234AB']
+
+    blocks, stats = app.build_travel_blocks_incremental(records, history)
+    assert stats['new_records'] == 3
+    assert block_keys(blocks) == block_keys(full)
+
+    # Повторно качване: записите с празен адрес са дубликати, а не нови
+    _, stats = app.build_travel_blocks_incremental(records, history)
+    assert stats['new_records'] == 0
+    with history.session() as session:
+        rows = list(session.truck_records('CA1234AB'))
+    assert [(row[2], row[3]) for row in rows[:2]] == [('София, България', None),
+                                                      (None, 'Bucuresti, Romania')]
+
+
+def test_add_record_raises_on_constraint_failure(tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.db'))
+    with pytest.raises(sqlite3.IntegrityError):
+        with history.session() as session:
+            session.add_record('CA1234AB', None, datetime(2025, 3, 1), 'София', 'Русе', 'GPS1')
+    assert history.stats()['records'] == 0
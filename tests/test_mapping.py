@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""parse_mapping: колоните с дати се намират по заглавието."""
+
+from datetime import datetime
+
+import app
+
+
+def write_mapping(tmp_path, text):
+    path = tmp_path / 'mapping.csv'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_two_columns_have_no_periods(tmp_path):
+    mapping = app.parse_mapping(write_mapping(tmp_path, 'Камион;Шофьор\nCA1234AB;Иван\n'))
+    assert mapping.single_driver('CA1234AB') == 'Иван'
+
+
+def test_unknown_column_is_ignored(tmp_path):
+    report = app.ParseReport()
+    path = write_mapping(tmp_path, 'Камион;Шофьор;Телефон\nCA1234AB;Иван;0888123456\n'
+                                   'PB5678CD;Петър;\n')
+    mapping = app.parse_mapping(path, report)
+    assert len(mapping) == 2
+    assert mapping.single_driver('CA1234AB') == 'Иван'
+    assert report.rejected['mapping'] == 0
+
+
+def test_date_columns_are_found_by_header(tmp_path):
+    report = app.ParseReport()
+    path = write_mapping(tmp_path, 'Камион;Шофьор;Телефон;От;До\n'
+                         + 'CA1234AB;Иван;0888123456;2025-03-01;2025-03-10\n'
+                         + 'CA1234AB;Петър;0888654321;11.03.2025;\n'
+                         + 'CA1234AB;Георги;;вчера;\n')
+    mapping = app.parse_mapping(path, report)
+    assert mapping.driver_at('CA1234AB', datetime(2025, 3, 5)) == 'Иван'
+    assert mapping.driver_at('CA1234AB', datetime(2025, 3, 20)) == 'Петър'
+    assert report.rejected['mapping'] == 1
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Сливането на дублирани и застъпващи се записи от GPS1 и GPS2 (merge_truck_records)."""
+
+from datetime import datetime, timedelta
+
+import app
+
+DAY = datetime(2025, 3, 1, 8)
+TOLERANCE = timedelta(seconds=300)
+
+
+def rec(source, start, end, from_addr='София, България', to_addr='Bucuresti, Romania'):
+    """start/end в секунди от DAY"""
+    return app._gps_record('CA1234AB', DAY + timedelta(seconds=start), DAY + timedelta(seconds=end),
+                           from_addr, to_addr, source)
+
+
+def merge(*records):
+    return app.merge_truck_records(app._runs_by_source(list(records)), TOLERANCE)
+
+
+def spans(records):
+    return [((r.start_time - DAY).total_seconds(), (r.end_time - DAY).total_seconds(), r.source)
+            for r in records]
+
+
+def test_duplicate_within_tolerance_is_merged():
+    merged, count = merge(rec('GPS1', 0, 240), rec('GPS2', 300, 540))
+    assert count == 1
+    assert spans(merged) == [(0, 540, 'GPS1')]
+
+
+def test_duplicate_one_second_past_tolerance_is_kept():
+    merged, count = merge(rec('GPS1', 0, 240), rec('GPS2', 301, 541))
+    assert count == 0
+    assert spans(merged) == [(0, 240, 'GPS1'), (301, 541, 'GPS2')]
+
+
+def test_overlap_of_exactly_tolerance_is_kept():
+    merged, count = merge(rec('GPS1', 0, 3600), rec('GPS2', 3300, 7200))
+    assert count == 0
+    assert len(merged) == 2
+
+
+def test_overlap_one_second_past_tolerance_is_merged():
+    merged, count = merge(rec('GPS1', 0, 3600), rec('GPS2', 3299, 7200, to_addr='Istanbul, Turkey'))
+    assert count == 1
+    assert spans(merged) == [(0, 7200, 'GPS1')]
+    assert merged[0].from_addr == 'София, България'
+    assert merged[0].to_addr == 'Istanbul, Turkey'
+
+
+def test_chain_of_overlaps_is_folded_into_one_trip():
+    hour = 3600
+    merged, count = merge(rec('GPS1', 0, 10 * hour), rec('GPS2', 5 * hour, 15 * hour),
+                          rec('GPS1', 12 * hour, 20 * hour), rec('GPS2', 18 * hour, 25 * hour))
+    assert count == 3
+    assert spans(merged) == [(0, 25 * hour, 'GPS1')]
+
+
+def test_overlapping_records_from_one_source_are_not_collapsed():
+    hour = 3600
+    merged, count = merge(rec('GPS1', 0, 10 * hour), rec('GPS1', 5 * hour, 15 * hour),
+                          rec('GPS2', 40 * hour, 45 * hour))
+    assert count == 0
+    assert spans(merged) == [(0, 10 * hour, 'GPS1'), (5 * hour, 15 * hour, 'GPS1'),
+                             (40 * hour, 45 * hour, 'GPS2')]
+
+
+def test_merged_records_stat():
+    hour = 3600
+    records = [
+        rec('GPS1', 0, 10 * hour),
+        rec('GPS2', 60, 10 * hour + 60),
+        rec('GPS1', 48 * hour, 58 * hour, 'Bucuresti, Romania', 'София, България'),
+        rec('GPS2', 48 * hour + 120, 58 * hour, 'Bucuresti, Romania', 'София, България'),
+    ]
+    stats = {}
+    blocks = app.build_travel_blocks(records, stats)
+    assert stats['merged_records'] == 2
+    gps1_only = app.build_travel_blocks([r for r in records if r.source == 'GPS1'])
+    assert [(b.start_date, b.end_date, b.records_count) for b in blocks['CA1234AB']] == \
+        [(b.start_date, b.end_date, b.records_count) for b in gps1_only['CA1234AB']]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Паралелното парсване на GPS2 по порции sheets дава записите на серийното."""
+
+import pytest
+
+import app
+from benchmarks import synthetic
+
+
+@pytest.fixture(scope='module')
+def gps_files(tmp_path_factory):
+    return synthetic.generate(str(tmp_path_factory.mktemp('gps')), trucks=12, trips=2,
+                              months=1, seed=3)
+
+
+@pytest.fixture
+def pool_cleanup():
+    yield
+    for pool in app._parse_pools.values():
+        pool.shutdown()
+    app._parse_pools.clear()
+
+
+def test_chunks_are_contiguous_and_balanced():
+    assert app._chunks(list('abcdefg'), 3) == [list('abc'), list('de'), list('fg')]
+    assert app._chunks(list('ab'), 4) == [['a'], ['b']]
+    assert app._chunks([], 2) == []
+
+
+def test_parallel_matches_serial(gps_files, monkeypatch, pool_cleanup):
+    monkeypatch.setattr(app, 'PARALLEL_MIN_SHEETS', 1)
+    monkeypatch.setattr(app.os, 'cpu_count', lambda: 2)
+    chunks = []
+    get_parse_pool = app.get_parse_pool
+
+    class RecordingPool:
+        def __init__(self, workers):
+            self._pool = get_parse_pool(workers)
+
+        def submit(self, task, *args):
+            chunks.append(args[1])
+            return self._pool.submit(task, *args)
+
+    monkeypatch.setattr(app, 'get_parse_pool', RecordingPool)
+
+    serial_report = app.ParseReport()
+    serial = [app._record_to_tuple(rec) for rec in
+              app.iter_gps2(gps_files['gps2'], report=serial_report)]
+
+    report = app.ParseReport()
+    gps1, gps2 = app.parallel_record_streams(None, gps_files['gps2'], workers=2, report=report)
+    assert list(gps1) == []
+    assert [app._record_to_tuple(rec) for rec in gps2] == serial
+    assert report.to_dict() == serial_report.to_dict()
+    # По една порция на worker, всеки sheet точно веднъж
+    assert len(chunks) == 2
+    assert sum(chunks, []) == app.gps2_sheet_names(gps_files['gps2'])
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Директорията на кеша на парсера (pickle) трябва да е само на приложението."""
+
+import os
+import stat
+
+import pytest
+
+import parse_cache
+from parse_cache import ParseCache
+
+
+def test_creates_private_directory(tmp_path):
+    directory = tmp_path / 'cache'
+    ParseCache(str(directory), 1024)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+def test_tightens_existing_directory(tmp_path):
+    directory = tmp_path / 'cache'
+    directory.mkdir(mode=0o777)
+    os.chmod(directory, 0o777)
+    ParseCache(str(directory), 1024)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+def test_rejects_symlink(tmp_path):
+    (tmp_path / 'real').mkdir()
+    os.symlink(tmp_path / 'real', tmp_path / 'link')
+    with pytest.raises(ValueError):
+        ParseCache(str(tmp_path / 'link'), 1024)
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='без собственици на файлове')
+def test_rejects_directory_of_another_user(tmp_path, monkeypatch):
+    directory = tmp_path / 'cache'
+    directory.mkdir()
+    monkeypatch.setattr(parse_cache.os, 'getuid', lambda: os.stat(directory).st_uid + 1)
+    with pytest.raises(ValueError):
+        ParseCache(str(directory), 1024)
+
+
+def test_round_trip(tmp_path):
+    source = tmp_path / 'gps.xlsx'
+    source.write_bytes(b'data')
+    cache = ParseCache(str(tmp_path / 'cache'), 1 << 20)
+    key = cache.make_key(str(source), 'gps1', 1)
+    writer = cache.writer(key)
+    writer.add(('CA1234AB', 1))
+    writer.commit({'rejected_rows': {'GPS1': 0}})
+    trailers = []
+    assert list(cache.read(key, trailers.append)) == [('CA1234AB', 1)]
+    assert trailers == [{'rejected_rows': {'GPS1': 0}}]
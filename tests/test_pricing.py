@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""price_block: ставките на блок по дните му."""
+
+from datetime import datetime
+
+import pytest
+
+import app
+
+
+def test_block_is_priced_by_its_start_date():
+    romania = app.COUNTRY_CLASSIFIER.code_of('Румъния')
+    block = app.TravelBlock('CA1234AB', datetime(2025, 3, 1, 8), datetime(2025, 3, 3, 18), romania, 0)
+    block.visit(block.end_date, romania)
+    ((part, country, rate),) = app.price_block(block.finalize())
+    assert part is block and country == romania
+    assert rate == app.PER_DIEM_RATES.rate(romania, block.start_date)
+
+
+def test_block_without_start_date_is_an_error():
+    romania = app.COUNTRY_CLASSIFIER.code_of('Румъния')
+    block = app.TravelBlock('CA1234AB', None, datetime(2025, 3, 3, 18), romania, 0)
+    with pytest.raises(ValueError, match='CA1234AB'):
+        app.price_block(block)
+
+
+def test_export_rejects_row_with_invalid_start_date():
+    client = app.app.test_client()
+    rows = [
+        {'driver': 'Иван', 'truck': 'CA1234AB', 'country': 'Румъния', 'start_date': '01.03.2025 08:00',
+         'end_date': '03.03.2025 18:00', 'days': 3},
+        {'driver': 'Иван', 'truck': 'CA1234AB', 'country': 'Румъния', 'start_date': '2025/03/10',
+         'end_date': '12.03.2025 18:00', 'days': 3},
+    ]
+    response = client.post('/export-excel', json={'data': rows})
+    assert response.status_code == 400
+    assert "ред 2: невалидна начална дата '2025/03/10'" in response.get_json()['error']
+
+    response = client.post('/export-excel', json={'data': rows[:1]})
+    assert response.status_code == 200
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""StoredResult.query: страници и суми."""
+
+from result_store import ResultQuery, StoredResult
+
+
+def row(driver, truck, block_num, country, days, eur_rate):
+    return {'driver': driver, 'truck': truck, 'block_num': block_num,
+            'start_date': '01.03.2025 08:00', 'end_date': '05.03.2025 18:00',
+            'country': country, 'days': days, 'eur_rate': eur_rate, 'records_count': 3}
+
+
+def test_block_on_several_rows_counts_once():
+    result = StoredResult([
+        row('Иван', 'CA1234AB', 1, 'Румъния', 2, 50.0),
+        row('Иван', 'CA1234AB', 1, 'Унгария', 3, 60.0),
+        row('Иван', 'CA1234AB', 2, 'Румъния', 1, 50.0),
+        row('Петър', 'PB5678CD', 1, 'Турция', 4, 40.0),
+    ], {})
+    page = result.query(ResultQuery(), 2.0)
+    assert page['total'] == 4
+    assert page['totals']['blocks'] == 3
+    assert page['driver_totals']['Иван']['blocks'] == 2
+    assert page['driver_totals']['Иван']['days'] == 6
+    assert [t['blocks'] for t in result.driver_totals(ResultQuery(), 2.0)] == [2, 1]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""iter_travel_blocks_streaming: кога излизат блоковете на камионите."""
+
+from datetime import datetime, timedelta
+
+import app
+
+
+def trip(truck, start, source, from_addr='София, България', to_addr='Bucuresti, Romania'):
+    return app._gps_record(truck, start, start + timedelta(hours=10), from_addr, to_addr, source)
+
+
+def round_trip(truck, day, source):
+    return [trip(truck, day, source),
+            trip(truck, day + timedelta(days=2), source, 'Bucuresti, Romania', 'София, България')]
+
+
+def records():
+    day = datetime(2025, 3, 1, 8)
+    return (round_trip('CA1111AA', day, 'GPS1') + round_trip('CA2222BB', day, 'GPS1')
+            + round_trip('CA2222BB', day + timedelta(days=5), 'GPS2')
+            + round_trip('CA3333CC', day, 'GPS2') + round_trip('CA4444DD', day, 'GPS2'))
+
+
+def consumed_at_yield(hold):
+    """{камион: колко записа са прочетени, когато камионът излиза}"""
+    recs = records()
+    read = []
+
+    def open_records(trucks=None):
+        for rec in recs:
+            if trucks is None:
+                read.append(rec)
+                yield rec
+            elif rec.truck in trucks:
+                yield rec
+
+    stats = {}
+    consumed = {}
+    blocks = {}
+    for truck, truck_blocks in app.iter_travel_blocks_streaming(open_records, stats, hold):
+        consumed[truck] = len(read)
+        blocks[truck] = truck_blocks
+    return consumed, blocks, len(recs)
+
+
+def test_gps2_truck_is_emitted_when_its_sheet_ends():
+    consumed, _, total = consumed_at_yield({'CA2222BB', 'CA3333CC', 'CA4444DD'})
+    assert consumed['CA1111AA'] < total
+    # CA3333CC е само в GPS2 - излиза, щом потокът мине на CA4444DD
+    assert consumed['CA3333CC'] < total
+
+
+def test_held_truck_from_both_sources_is_merged():
+    _, streamed, _ = consumed_at_yield({'CA2222BB', 'CA3333CC', 'CA4444DD'})
+    expected = app.build_travel_blocks(records())
+    assert set(streamed) == set(expected)
+    for truck, truck_blocks in expected.items():
+        assert [(b.start_date, b.end_date, b.days) for b in streamed[truck]] == \
+            [(b.start_date, b.end_date, b.days) for b in truck_blocks]
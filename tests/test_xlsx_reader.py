@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Паритет между бързия четец (xlsx_reader) и openpyxl: едни и същи редове и
+едни и същи GPS записи от parse_gps1/parse_gps2 с двата engine-а.
+"""
+
+from datetime import datetime
+
+import pytest
+
+import app
+from xlsx_fixtures import (CUSTOM_DATE, DATE, formula, inline, number, shared,
+                           write_xlsx)
+from xlsx_reader import XlsxReader, XlsxUnsupported
+
+WINDOWS_EPOCH = datetime(1899, 12, 30)
+MAC_EPOCH = datetime(1904, 1, 1)
+
+
+def serial(value, date1904=False):
+    """datetime → Excel сериен номер за системата на дати на файла"""
+    delta = value - (MAC_EPOCH if date1904 else WINDOWS_EPOCH)
+    return delta.days + delta.seconds / 86400
+
+
+def gps1_rows(date1904=False):
+    s = lambda value: number(serial(value, date1904), DATE)
+    return {
+        1: {0: inline('Отчет за пътувания')},
+        2: {0: shared('Период:'), 1: inline('01.03.2025 - 31.03.2025')},
+        # ред 3-7 липсват
+        8: {0: shared('Камион'), 1: shared('Начало'), 2: shared('Край'),
+            3: shared('Начален адрес'), 4: shared('Краен адрес')},
+        9: {0: shared('CA1234AB'), 1: s(datetime(2025, 3, 1, 6)),
+            2: number(serial(datetime(2025, 3, 1, 18), date1904), CUSTOM_DATE),
+            3: shared('София, България'), 4: inline('Bucuresti, Romania')},
+        # Пропуснат краен адрес и ред 11 липсва изцяло
+        10: {0: shared('CA1234AB'), 1: s(datetime(2025, 3, 2, 7, 30)),
+             2: s(datetime(2025, 3, 2, 20, 15)), 3: inline('Bucuresti, Romania')},
+        12: {0: shared('CA1234AB'), 1: s(datetime(2025, 3, 3, 8)),
+             2: s(datetime(2025, 3, 3, 16)), 3: shared('Ruse, Bulgaria'),
+             4: shared('София, България')},
+        13: {0: shared('Общо'), 3: inline('CA1234AB: 3 пътувания')},
+        14: {0: inline('PB5678CD'), 1: s(datetime(2025, 3, 4, 9)),
+             2: s(datetime(2025, 3, 5, 9)), 3: shared('София, България'),
+             4: inline('Istanbul, Turkey')},
+    }
+
+
+def gps2_sheet(truck, day):
+    header = ['№', 'Обект', 'Начален адрес', 'Начален пробег', 'Начална дата',
+              'Продължителност', 'Пробег, км', 'Макс. скорост', 'Ср. скорост', 'Престой',
+              'Краен адрес', 'Краен пробег', 'Крайна дата']
+    rows = {1: {i: shared(name) for i, name in enumerate(header)}}
+    rows[2] = {0: number(1), 1: shared(truck), 2: shared('София, България'),
+               4: shared(f'{day:02d}/03/2025 06:00:00'), 10: inline('Edirne, Turkey'),
+               12: inline(f'{day:02d}/03/2025 17:45:10')}
+    # Дата като Excel дата вместо текст и пропуснати колони по средата
+    rows[3] = {0: number(2), 2: inline('Edirne, Turkey'),
+               4: number(serial(datetime(2025, 3, day + 1, 8)), DATE),
+               10: shared('София, България'),
+               12: number(serial(datetime(2025, 3, day + 1, 19)), DATE)}
+    # Ред без начална дата се пропуска
+    rows[4] = {0: number(3), 2: inline('София, България')}
+    return truck, rows
+
+
+def record_tuples(records):
+    return [tuple(getattr(rec, name) for name in app.GpsRecord.__slots__) for rec in records]
+
+
+def parse_with(monkeypatch, engine, parse, path):
+    monkeypatch.setattr(app, 'XLSX_ENGINE', engine)
+    return record_tuples(parse(path))
+
+
+def openpyxl_rows(path, sheet, max_col):
+    wb = app._OpenpyxlWorkbook(path)
+    try:
+        return [tuple(row) for row in wb.iter_rows(sheet, 1, max_col, range(max_col))]
+    finally:
+        wb.close()
+
+
+def native_rows(path, sheet, max_col):
+    with XlsxReader(path) as reader:
+        return list(reader.iter_rows(sheet, 1, max_col, range(max_col)))
+
+
+@pytest.mark.parametrize('date1904', [False, True])
+@pytest.mark.parametrize('refs', [True, False])
+def test_gps1_rows_match_openpyxl(tmp_path, date1904, refs):
+    rows = gps1_rows(date1904)
+    if not refs:
+        # Клетки без r: позицията е поредна, затова без пропуснати клетки
+        rows = {n: cells for n, cells in rows.items() if sorted(cells) == list(range(len(cells)))}
+    path = write_xlsx(tmp_path / 'gps1.xlsx', [('Пътувания', rows)], date1904, refs)
+    assert native_rows(path, 'Пътувания', 5) == openpyxl_rows(path, 'Пътувания', 5)
+
+
+@pytest.mark.parametrize('date1904', [False, True])
+def test_gps1_records_match_openpyxl(tmp_path, monkeypatch, date1904):
+    path = write_xlsx(tmp_path / 'gps1.xlsx', [('Пътувания', gps1_rows(date1904))], date1904)
+    native = parse_with(monkeypatch, 'native', app.parse_gps1, path)
+    assert native == parse_with(monkeypatch, 'openpyxl', app.parse_gps1, path)
+    assert [rec[1] for rec in native] == [datetime(2025, 3, 1, 6), datetime(2025, 3, 2, 7, 30),
+                                          datetime(2025, 3, 3, 8), datetime(2025, 3, 4, 9)]
+    assert native[1][4] is None
+
+
+def test_gps2_records_match_openpyxl(tmp_path, monkeypatch):
+    path = write_xlsx(tmp_path / 'gps2.xlsx', [gps2_sheet('CA1234AB', 1), gps2_sheet('PB5678CD', 10)])
+    for sheet in ('CA1234AB', 'PB5678CD'):
+        assert native_rows(path, sheet, 13) == openpyxl_rows(path, sheet, 13)
+    native = parse_with(monkeypatch, 'native', app.parse_gps2, path)
+    assert native == parse_with(monkeypatch, 'openpyxl', app.parse_gps2, path)
+    assert len(native) == 4
+
+
+def test_formula_without_cached_value_falls_back_to_openpyxl(tmp_path, monkeypatch):
+    rows = gps1_rows()
+    rows[9][4] = formula('D12')
+    path = write_xlsx(tmp_path / 'gps1.xlsx', [('Пътувания', rows)])
+
+    with pytest.raises(XlsxUnsupported):
+        native_rows(path, 'Пътувания', 5)
+
+    native = parse_with(monkeypatch, 'native', app.parse_gps1, path)
+    assert native == parse_with(monkeypatch, 'openpyxl', app.parse_gps1, path)
+    assert native[0][4] == '=D12'
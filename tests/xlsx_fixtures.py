@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Ръчно сглобени .xlsx файлове за тестовете на четците: XML-ът на sheet-а е
+точно какъвто е нужен (споделени и inline низове, пропуснати клетки и
+редове, формули без кеширана стойност), без да минава през openpyxl.
+"""
+
+import zipfile
+from xml.sax.saxutils import escape
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+SPREADSHEETML = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+RELATIONSHIPS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_RELATIONSHIPS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+CONTENT_TYPES = (
+    XML_DECLARATION
+    + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">\n'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>\n'
+    '<Default Extension="xml" ContentType="application/xml"/>\n'
+    f'<Override PartName="/xl/workbook.xml" ContentType="{SPREADSHEETML}.sheet.main+xml"/>\n'
+    f'<Override PartName="/xl/styles.xml" ContentType="{SPREADSHEETML}.styles+xml"/>\n'
+    f'<Override PartName="/xl/sharedStrings.xml" ContentType="{SPREADSHEETML}.sharedStrings+xml"/>\n'
+    '{sheets}\n'
+    '</Types>')
+
+SHEET_CONTENT_TYPE = ('<Override PartName="/xl/worksheets/sheet{n}.xml" '
+                      f'ContentType="{SPREADSHEETML}.worksheet+xml"/>')
+
+ROOT_RELS = (
+    XML_DECLARATION
+    + f'<Relationships xmlns="{PACKAGE_RELATIONSHIPS}">\n'
+    f'<Relationship Id="rId1" Type="{RELATIONSHIPS}/officeDocument" Target="xl/workbook.xml"/>\n'
+    '</Relationships>')
+
+WORKBOOK = (
+    XML_DECLARATION
+    + '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    f' xmlns:r="{RELATIONSHIPS}">\n'
+    '<workbookPr{date1904}/>\n'
+    '<sheets>{sheets}</sheets>\n'
+    '</workbook>')
+
+WORKBOOK_RELS = (
+    XML_DECLARATION
+    + f'<Relationships xmlns="{PACKAGE_RELATIONSHIPS}">\n'
+    '{sheets}\n'
+    f'<Relationship Id="rIdStyles" Type="{RELATIONSHIPS}/styles" Target="styles.xml"/>\n'
+    f'<Relationship Id="rIdStrings" Type="{RELATIONSHIPS}/sharedStrings" Target="sharedStrings.xml"/>\n'
+    '</Relationships>')
+
+# Стил 0 - общ, стил 1 - дата и час (вграден формат 22), стил 2 - собствен формат
+STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="dd.mm.yyyy hh:mm:ss"/></numFmts>
+<fonts count="1"><font/></fonts>
+<fills count="1"><fill><patternFill patternType="none"/></fill></fills>
+<borders count="1"><border/></borders>
+<cellStyleXfs count="1"><xf/></cellStyleXfs>
+<cellXfs count="3"><xf numFmtId="0"/><xf numFmtId="22" applyNumberFormat="1"/>
+<xf numFmtId="164" applyNumberFormat="1"/></cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+SHEET = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetData>{rows}</sheetData>
+</worksheet>"""
+
+DATE = 1         # стил за дата по вграден формат
+CUSTOM_DATE = 2  # стил за дата по собствен формат
+
+
+class Cell:
+    """Клетка за sheet XML: kind е 's' (споделен низ), 'inline', 'n' или 'f' (формула)"""
+
+    def __init__(self, value, kind='n', style=None):
+        self.value = value
+        self.kind = kind
+        self.style = style
+
+
+def shared(text):
+    return Cell(text, 's')
+
+
+def inline(text):
+    return Cell(text, 'inline')
+
+
+def number(value, style=None):
+    return Cell(value, 'n', style)
+
+
+def formula(expr):
+    return Cell(expr, 'f')
+
+
+def _column_letters(idx):
+    letters = ''
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _cell_xml(ref, cell, strings):
+    attrs = f' r="{ref}"' if ref else ''
+    if cell.style is not None:
+        attrs += f' s="{cell.style}"'
+    if cell.kind == 's':
+        if cell.value not in strings:
+            strings.append(cell.value)
+        return f'<c{attrs} t="s"><v>{strings.index(cell.value)}</v></c>'
+    if cell.kind == 'inline':
+        return f'<c{attrs} t="inlineStr"><is><t>{escape(cell.value)}</t></is></c>'
+    if cell.kind == 'f':
+        # Без <v> - файлът не е преизчислен от Excel
+        return f'<c{attrs}><f>{escape(cell.value)}</f></c>'
+    return f'<c{attrs}><v>{cell.value}</v></c>'
+
+
+def _sheet_xml(rows, strings, refs=True):
+    """rows: {номер на ред: {индекс на колона: Cell}}; refs=False - клетки без r"""
+    parts = []
+    for row_num in sorted(rows):
+        cells = rows[row_num]
+        xml = ''.join(_cell_xml(f'{_column_letters(col)}{row_num}' if refs else None,
+                                cells[col], strings)
+                      for col in sorted(cells))
+        parts.append(f'<row r="{row_num}">{xml}</row>')
+    return SHEET.format(rows=''.join(parts))
+
+
+def write_xlsx(path, sheets, date1904=False, refs=True):
+    """
+    sheets: [(име, {ред: {колона: Cell}})]. Записва минимален .xlsx,
+    който се чете и от openpyxl, и от xlsx_reader.
+    """
+    strings = []
+    sheet_xml = [_sheet_xml(rows, strings, refs) for _, rows in sheets]
+    shared_xml = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                  '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                  + ''.join(f'<si><t>{escape(s)}</t></si>' for s in strings) + '</sst>')
+
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('[Content_Types].xml', CONTENT_TYPES.format(
+            sheets=''.join(SHEET_CONTENT_TYPE.format(n=n) for n in range(1, len(sheets) + 1))))
+        z.writestr('_rels/.rels', ROOT_RELS)
+        z.writestr('xl/workbook.xml', WORKBOOK.format(
+            date1904=' date1904="1"' if date1904 else '',
+            sheets=''.join(f'<sheet name="{escape(name)}" sheetId="{n}" r:id="rId{n}"/>'
+                           for n, (name, _) in enumerate(sheets, 1))))
+        z.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS.format(
+            sheets=''.join(
+                f'<Relationship Id="rId{n}" Type="{RELATIONSHIPS}/worksheet" '
+                f'Target="worksheets/sheet{n}.xml"/>'
+                for n in range(1, len(sheets) + 1))))
+        z.writestr('xl/styles.xml', STYLES)
+        z.writestr('xl/sharedStrings.xml', shared_xml)
+        for n, xml in enumerate(sheet_xml, 1):
+            z.writestr(f'xl/worksheets/sheet{n}.xml', xml)
+    return path
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Бърз четец на .xlsx за фиксираните GPS формати.
+
+Отваря zip архива директно и чете sheet XML-а с iterparse, без клетъчния
+модел на openpyxl. Декодират се само поисканите колони, а Excel серийните
+дати се превръщат в datetime тук. Всичко необичайно (формули, chartsheets,
+липсващи части) вдига XlsxUnsupported и извикващият минава на openpyxl.
+"""
+
+import posixpath
+import re
+import zipfile
+from datetime import datetime, time, timedelta
+from xml.etree.ElementTree import iterparse, fromstring
+
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+REL_OFFICE_DOCUMENT = NS_REL + '/officeDocument'
+REL_WORKSHEET = NS_REL + '/worksheet'
+REL_SHARED_STRINGS = NS_REL + '/sharedStrings'
+REL_STYLES = NS_REL + '/styles'
+
+ROW_TAG = '{%s}row' % NS_MAIN
+SHEET_DATA_TAG = '{%s}sheetData' % NS_MAIN
+VALUE_TAG = '{%s}v' % NS_MAIN
+FORMULA_TAG = '{%s}f' % NS_MAIN
+INLINE_STRING_TAG = '{%s}is' % NS_MAIN
+TEXT_TAG = '{%s}t' % NS_MAIN
+RUN_TAG = '{%s}r' % NS_MAIN
+SI_TAG = '{%s}si' % NS_MAIN
+
+WINDOWS_EPOCH = datetime(1899, 12, 30)
+MAC_EPOCH = datetime(1904, 1, 1)
+SECS_PER_DAY = 86400
+
+_COLUMN_RE = re.compile(r'^([A-Z]+)')
+
+
+class XlsxUnsupported(Exception):
+    """Файлът съдържа нещо, което бързият четец не поддържа"""
+
+
+def excel_serial_to_datetime(value, epoch=WINDOWS_EPOCH):
+    """Excel сериен номер → datetime (time за стойности под 1 ден)"""
+    day, fraction = divmod(value, 1)
+    diff = timedelta(milliseconds=round(fraction * SECS_PER_DAY * 1000))
+    if 0 <= value < 1 and diff.days == 0:
+        minutes, second = divmod(diff.seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        return time(hour, minute, second, diff.microseconds)
+    # Excel смята 1900 за високосна година
+    if 0 < value < 60 and epoch == WINDOWS_EPOCH:
+        day += 1
+    return epoch + timedelta(days=day) + diff
+
+
+def excel_serial_to_timedelta(value):
+    """Excel сериен номер → timedelta (формати като [h]:mm:ss)"""
+    td = timedelta(days=value)
+    if td.microseconds:
+        td = timedelta(seconds=td.total_seconds() // 1,
+                       microseconds=round(td.microseconds, -3))
+    return td
+
+
+def column_index(letters):
+    """'A' → 0, 'M' → 12, 'AA' → 26"""
+    idx = 0
+    for ch in letters:
+        idx = idx * 26 + ord(ch) - 64
+    return idx - 1
+
+
+def _text_content(node):
+    """Текст на <si>/<is>: директен <t> плюс <t> от rich text runs"""
+    parts = []
+    t = node.find(TEXT_TAG)
+    if t is not None and t.text:
+        parts.append(t.text)
+    for run in node.iterfind(RUN_TAG):
+        t = run.find(TEXT_TAG)
+        if t is not None and t.text:
+            parts.append(t.text)
+    return ''.join(parts)
+
+
+class XlsxReader:
+    """
+    Четец на един .xlsx файл.
+    sheetnames / active_sheet_name описват workbook-а, iter_rows чете sheet.
+    """
+
+    def __init__(self, file_path):
+        try:
+            self._zip = zipfile.ZipFile(file_path)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise XlsxUnsupported(str(e))
+
+        try:
+            self._load_workbook()
+        except XlsxUnsupported:
+            self.close()
+            raise
+        except (KeyError, ValueError, SyntaxError) as e:
+            self.close()
+            raise XlsxUnsupported(str(e))
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_rels(self, part):
+        folder, name = posixpath.split(part)
+        rels_path = posixpath.join(folder, '_rels', name + '.rels')
+        rels = {}
+        root = fromstring(self._zip.read(rels_path))
+        for rel in root.iter('{%s}Relationship' % NS_PKG_REL):
+            if rel.get('TargetMode') == 'External':
+                continue
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            rels[rel.get('Id')] = (rel.get('Type'), target)
+        return rels
+
+    def _load_workbook(self):
+        root_rels = self._read_rels('')
+        workbook_part = next((target for rel_type, target in root_rels.values()
+                              if rel_type == REL_OFFICE_DOCUMENT), None)
+        if workbook_part is None:
+            raise XlsxUnsupported('Липсва workbook част')
+
+        wb_rels = self._read_rels(workbook_part)
+        wb_root = fromstring(self._zip.read(workbook_part))
+
+        props = wb_root.find('{%s}workbookPr' % NS_MAIN)
+        date1904 = props is not None and props.get('date1904') in ('1', 'true')
+        self.epoch = MAC_EPOCH if date1904 else WINDOWS_EPOCH
+
+        active = 0
+        for view in wb_root.iter('{%s}workbookView' % NS_MAIN):
+            if view.get('activeTab') is not None:
+                active = int(view.get('activeTab'))
+                break
+
+        self._sheet_paths = {}
+        self.sheetnames = []
+        for sheet in wb_root.iter('{%s}sheet' % NS_MAIN):
+            rel_type, target = wb_rels[sheet.get('{%s}id' % NS_REL)]
+            if rel_type != REL_WORKSHEET:
+                raise XlsxUnsupported(f'Sheet {sheet.get("name")} не е worksheet')
+            self.sheetnames.append(sheet.get('name'))
+            self._sheet_paths[sheet.get('name')] = target
+
+        if not 0 <= active < len(self.sheetnames):
+            raise XlsxUnsupported('Невалиден активен sheet')
+        self.active_sheet_name = self.sheetnames[active]
+
+        self._shared_strings = []
+        self._date_styles = set()
+        self._timedelta_styles = set()
+        for rel_type, target in wb_rels.values():
+            if rel_type == REL_SHARED_STRINGS:
+                self._shared_strings = self._read_shared_strings(target)
+            elif rel_type == REL_STYLES:
+                self._read_styles(target)
+
+    def _read_shared_strings(self, part):
+        strings = []
+        with self._zip.open(part) as src:
+            for _, node in iterparse(src):
+                if node.tag == SI_TAG:
+                    strings.append(_text_content(node).replace('x005F_', ''))
+                    node.clear()
+        return strings
+
+    def _read_styles(self, part):
+        """Индекси на стиловете (cellXfs) с формат за дата или продължителност"""
+        root = fromstring(self._zip.read(part))
+
+        custom = {}
+        num_fmts = root.find('{%s}numFmts' % NS_MAIN)
+        if num_fmts is not None:
+            for fmt in num_fmts:
+                custom[int(fmt.get('numFmtId'))] = fmt.get('formatCode')
+
+        cell_xfs = root.find('{%s}cellXfs' % NS_MAIN)
+        if cell_xfs is None:
+            return
+        for idx, xf in enumerate(cell_xfs):
+            fmt_id = int(xf.get('numFmtId', 0))
+            fmt = custom.get(fmt_id, BUILTIN_FORMATS.get(fmt_id))
+            if is_date_format(fmt):
+                self._date_styles.add(idx)
+            if is_timedelta_format(fmt):
+                self._timedelta_styles.add(idx)
+
+    def _cell_value(self, cell):
+        """Стойност на клетка по правилата на openpyxl (read-only, без data_only)"""
+        if cell.find(FORMULA_TAG) is not None:
+            raise XlsxUnsupported('Формули не се поддържат')
+
+        data_type = cell.get('t', 'n')
+        if data_type == 'inlineStr':
+            node = cell.find(INLINE_STRING_TAG)
+            return _text_content(node) if node is not None else None
+
+        value = cell.findtext(VALUE_TAG) or None
+        if value is None:
+            return None
+
+        if data_type == 'n':
+            if '.' in value or 'E' in value or 'e' in value:
+                value = float(value)
+            else:
+                value = int(value)
+            style = int(cell.get('s', 0))
+            if style in self._date_styles:
+                try:
+                    if style in self._timedelta_styles:
+                        return excel_serial_to_timedelta(value)
+                    return excel_serial_to_datetime(value, self.epoch)
+                except (OverflowError, ValueError):
+                    return '#VALUE!'
+            return value
+        if data_type == 's':
+            return self._shared_strings[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        if data_type == 'str' or data_type == 'e':
+            return value
+        if data_type == 'd':
+            raise XlsxUnsupported('ISO дати не се поддържат')
+        return value
+
+    def iter_rows(self, sheet_name, min_row, max_col, columns):
+        """
+        Генератор на редовете на sheet от min_row нататък, като openpyxl
+        iter_rows(values_only=True): всеки ред е tuple с max_col стойности,
+        липсващите редове са празни. Декодират се само колоните от columns
+        (0-базирани индекси), останалите са None.
+        """
+        columns = frozenset(columns)
+        empty_row = (None,) * max_col
+        col_cache = {}
+
+        src = self._zip.open(self._sheet_paths[sheet_name])
+        try:
+            sheet_data = None
+            expected = min_row
+            row_idx = 0
+
+            for event, node in iterparse(src, events=('start', 'end')):
+                if event == 'start':
+                    if node.tag == SHEET_DATA_TAG:
+                        sheet_data = node
+                    continue
+                if node.tag != ROW_TAG:
+                    continue
+
+                r = node.get('r')
+                row_idx = int(r) if r is not None else row_idx + 1
+
+                if row_idx >= expected:
+                    # Пропуснатите редове са празни
+                    while expected < row_idx:
+                        yield empty_row
+                        expected += 1
+
+                    values = [None] * max_col
+                    col = -1
+                    for cell in node:
+                        ref = cell.get('r')
+                        if ref is None:
+                            col += 1
+                        else:
+                            letters = _COLUMN_RE.match(ref).group(1)
+                            col = col_cache.get(letters)
+                            if col is None:
+                                col = col_cache[letters] = column_index(letters)
+                        if col in columns and col < max_col:
+                            values[col] = self._cell_value(cell)
+
+                    yield tuple(values)
+                    expected += 1
+
+                if sheet_data is not None:
+                    sheet_data.clear()
+        finally:
+            src.close()